@@ -0,0 +1,72 @@
+import argparse
+import os
+import sys
+import time
+from typing import Dict
+
+import torch
+
+# Modules of this repository are in its root, as when running main_loop.py
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from model import destination_rowptr  # noqa: E402
+
+
+# python benchmarks/benchmark_model.py
+# python benchmarks/benchmark_model.py --num_graphs 100 --repeats 50
+
+def time_calls(calls, device: str, repeats: int) -> Dict[str, float]:
+    """
+    Mean time (in ms) of each (name, function) in calls, after one warm-up call.
+    """
+    times = {}
+    for name, function in calls:
+        function()
+        if device.startswith('cuda'):
+            torch.cuda.synchronize()
+        start = time.perf_counter()
+        for _ in range(repeats):
+            function()
+        if device.startswith('cuda'):
+            torch.cuda.synchronize()
+        times[name] = (time.perf_counter() - start) / repeats * 1000
+    return times
+
+
+def benchmark_node_aggregation(num_graphs: int = 500, num_nodes: int = 68, num_features: int = 34,
+                               device: str = 'cpu', repeats: int = 20) -> Dict[str, float]:
+    """
+    Mean time (in ms) of NodeModel's aggregation of the messages of a batch of complete graphs (threshold 100, with
+    self-loops), with scatter_mean over edges in networkx's order (sorted by source) and with segment_csr over edges
+    sorted by destination, including the check of the order and the calculation of rowptr.
+    """
+    from torch_scatter import scatter_mean, segment_csr
+
+    nodes = torch.arange(num_nodes, device=device)
+    row, col = nodes.repeat_interleave(num_nodes), nodes.repeat(num_nodes)
+    offsets = (torch.arange(num_graphs, device=device) * num_nodes).repeat_interleave(row.numel())
+    by_source = torch.stack([row.repeat(num_graphs), col.repeat(num_graphs)]) + offsets
+    by_destination = by_source.flip(0)
+    in_degree = torch.full((num_graphs * num_nodes,), num_nodes, dtype=torch.long, device=device)
+    messages = torch.randn(by_source.size(1), num_features, device=device)
+    total_nodes = num_graphs * num_nodes
+
+    def scatter_path():
+        return scatter_mean(messages, by_source[1], dim=0, dim_size=total_nodes)
+
+    def segment_path():
+        return segment_csr(messages, destination_rowptr(by_destination, total_nodes, in_degree), reduce='mean')
+
+    return time_calls([('scatter_mean', scatter_path), ('segment_csr', segment_path)], device, repeats)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--num_graphs', type=int, default=500)
+    parser.add_argument('--repeats', type=int, default=20)
+    args = parser.parse_args()
+
+    for device_name in ['cpu'] + (['cuda'] if torch.cuda.is_available() else []):
+        for benchmark in [benchmark_node_aggregation]:
+            benchmark_times = benchmark(num_graphs=args.num_graphs, device=device_name, repeats=args.repeats)
+            print(benchmark.__name__, device_name, {name: round(value, 3) for name, value in benchmark_times.items()})
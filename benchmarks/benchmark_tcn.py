@@ -0,0 +1,81 @@
+import argparse
+import os
+import sys
+from math import ceil
+from typing import Dict
+
+import torch
+
+# Modules of this repository are in its root, as when running main_loop.py
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmark_model import time_calls  # noqa: E402
+from tcn import StridedTemporalBlock  # noqa: E402
+from tests.test_tcn import PreviousStridedTemporalBlock  # noqa: E402
+
+
+# python benchmarks/benchmark_tcn.py
+# python benchmarks/benchmark_tcn.py --num_sequences 2176 --time_length 490
+
+def saved_for_backward_mb(function) -> float:
+    """
+    Size (in MB) of the tensors saved for the backward pass by function(), i.e. the activation memory of training.
+    Tensors sharing their storage (e.g. views, or the same tensor saved twice) are counted once. Needs
+    torch.autograd.graph.saved_tensors_hooks (torch >= 1.10).
+    """
+    storages = {}
+
+    def pack(tensor):
+        storage = tensor.untyped_storage()
+        storages[storage.data_ptr()] = storage.nbytes()
+        return tensor
+
+    with torch.autograd.graph.saved_tensors_hooks(pack, lambda tensor: tensor):
+        function()
+    return sum(storages.values()) / 2 ** 20
+
+
+def benchmark_temporal_block(num_sequences: int = 68 * 32, time_length: int = 1200, channels_conv: int = 8,
+                             device: str = 'cpu', repeats: int = 10) -> Dict[str, float]:
+    """
+    Time (in ms) of a forward and backward pass, and activation memory (in MB), of the previous and current
+    StridedTemporalBlock, for the two blocks of TemporalConvNet in SpatioTemporalModel (kernel 7, stride 2) over the
+    time series of num_sequences nodes (68 nodes of 32 graphs by default).
+    """
+    results = {}
+    num_inputs, length = 1, time_length
+    for block_num, dilation in enumerate([1, 4]):
+        hidden_channels, out_channels = channels_conv * 4 ** block_num, channels_conv * 2 * 4 ** block_num
+        final_output = ceil(length / 4)
+        kwargs = dict(kernel_size=7, stride=2, dilation=dilation, padding=6 * dilation, final_output=final_output)
+        x = torch.randn(num_sequences, num_inputs, length, device=device)
+        calls = []
+        for name, block_class in [('previous', PreviousStridedTemporalBlock), ('current', StridedTemporalBlock)]:
+            block = block_class(num_inputs, hidden_channels, out_channels, **kwargs).to(device)
+
+            def run(block_=block):
+                block_(x).sum().backward()
+
+            calls.append((f'block{block_num + 1}_{name}_ms', run))
+            results[f'block{block_num + 1}_{name}_saved_mb'] = saved_for_backward_mb(lambda: block(x).sum())
+            if device.startswith('cuda'):
+                torch.cuda.reset_peak_memory_stats()
+                run()
+                results[f'block{block_num + 1}_{name}_peak_cuda_mb'] = torch.cuda.max_memory_allocated() / 2 ** 20
+        results.update(time_calls(calls, device, repeats))
+        num_inputs, length = out_channels, final_output
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--num_sequences', type=int, default=68 * 32)
+    parser.add_argument('--time_length', type=int, default=1200)
+    parser.add_argument('--repeats', type=int, default=10)
+    args = parser.parse_args()
+
+    for device_name in ['cpu'] + (['cuda'] if torch.cuda.is_available() else []):
+        benchmark_results = benchmark_temporal_block(num_sequences=args.num_sequences, time_length=args.time_length,
+                                                     device=device_name, repeats=args.repeats)
+        for name, value in sorted(benchmark_results.items()):
+            print(device_name, name, round(value, 2))
@@ -0,0 +1,212 @@
+import hashlib
+import json
+import os
+import queue
+import random
+import sqlite3
+import threading
+import time
+from typing import Dict, Any, Optional, List, Tuple
+
+import numpy as np
+import torch
+
+
+def to_cpu(obj):
+    """
+    Copy of obj (e.g. a state_dict, or an optimiser's state) with all its tensors in the host.
+    """
+    if torch.is_tensor(obj):
+        return obj.detach().to('cpu', copy=True)
+    if isinstance(obj, dict):
+        return type(obj)((key, to_cpu(value)) for key, value in obj.items())
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(to_cpu(value) for value in obj)
+    return obj
+
+
+def get_rng_state() -> Dict[str, Any]:
+    return {'torch': torch.get_rng_state(),
+            'cuda': torch.cuda.get_rng_state_all() if torch.cuda.is_available() else None,
+            'numpy': np.random.get_state(),
+            'random': random.getstate()}
+
+
+def set_rng_state(rng_state: Dict[str, Any]):
+    # torch.load() with map_location may have moved these to the GPU
+    torch.set_rng_state(rng_state['torch'].cpu())
+    if rng_state['cuda'] is not None and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all([state.cpu() for state in rng_state['cuda']])
+    np.random.set_state(rng_state['numpy'])
+    random.setstate(rng_state['random'])
+
+
+class AsyncCheckpointer:
+    """
+    Writes checkpoints with torch.save() from a background thread.
+
+    save() only copies the state to the host, so training can continue while the file is written. Each file is
+    first written to a temporary path and then renamed, thus a run killed in the middle of a write never leaves a
+    corrupted checkpoint behind. Writes happen in the order of the calls to save().
+    """
+
+    def __init__(self):
+        self._queue: queue.Queue = queue.Queue()
+        self._error: Optional[BaseException] = None
+        self._worker = threading.Thread(target=self.__write_checkpoints, daemon=True)
+        self._worker.start()
+
+    def __write_checkpoints(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            state, path = item
+            try:
+                tmp_path = f'{path}.tmp'
+                torch.save(state, tmp_path)
+                os.replace(tmp_path, path)
+            except BaseException as e:
+                self._error = e
+            finally:
+                self._queue.task_done()
+
+    def save(self, state: Any, path: str):
+        if self._error is not None:
+            raise self._error
+        self._queue.put((to_cpu(state), path))
+
+    def remove(self, path: str):
+        """
+        Removes the file in path, after any pending write to it.
+        """
+        self.wait()
+        if os.path.exists(path):
+            os.remove(path)
+
+    def wait(self):
+        self._queue.join()
+        if self._error is not None:
+            raise self._error
+
+    def close(self):
+        self.wait()
+        self._queue.put(None)
+        self._worker.join()
+
+
+CHECKPOINT_STORE_PATH = 'logs/checkpoints'
+
+
+def normalise_config_value(value: Any) -> Any:
+    """
+    Value of a configuration as it is hashed and indexed. Floats keep 10 significant digits, so the same
+    hyperparameter read back with a slightly different precision (e.g. from wandb) gives the same checkpoint.
+    """
+    value = getattr(value, 'value', value)  # Enums
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float):
+        value = float(f'{value:.10g}')
+    return value
+
+
+class CheckpointStore:
+    """
+    Checkpoints saved under the hash of their (normalised) configuration, e.g. logs/checkpoints/3f/3fa2...c1.pth,
+    with an SQLite index of the configurations to find them by any subset of their values. The same configuration
+    always gets the same file.
+    """
+
+    def __init__(self, root: str = CHECKPOINT_STORE_PATH):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+        with self.__connect() as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS checkpoints (key TEXT PRIMARY KEY, created REAL, config TEXT)')
+            # One row per value of each configuration, so any subset of them is looked up with the index
+            conn.execute('CREATE TABLE IF NOT EXISTS params (key TEXT, name TEXT, value TEXT, '
+                         'PRIMARY KEY (key, name))')
+            conn.execute('CREATE INDEX IF NOT EXISTS params_lookup ON params (name, value)')
+
+    def __connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(os.path.join(self.root, 'index.db'), timeout=60)
+
+    @staticmethod
+    def normalise(config: Dict[str, Any]) -> Dict[str, Any]:
+        return {name: normalise_config_value(value) for name, value in config.items()}
+
+    def key(self, config: Dict[str, Any]) -> str:
+        config_json = json.dumps(self.normalise(config), sort_keys=True)
+        return hashlib.sha256(config_json.encode('utf-8')).hexdigest()[:32]
+
+    def __key_path(self, key: str, suffix: str) -> str:
+        return os.path.join(self.root, key[:2], key + suffix)
+
+    def path(self, config: Dict[str, Any], suffix: str = '.pth') -> str:
+        """
+        Where the checkpoint of config is (or will be) saved. The configuration is added to the index if needed.
+        """
+        key = self.key(config)
+        config = self.normalise(config)
+        with self.__connect() as conn:
+            if conn.execute('INSERT OR IGNORE INTO checkpoints VALUES (?, ?, ?)',
+                            (key, time.time(), json.dumps(config, sort_keys=True))).rowcount > 0:
+                conn.executemany('INSERT OR IGNORE INTO params VALUES (?, ?, ?)',
+                                 [(key, name, json.dumps(value)) for name, value in config.items()])
+        os.makedirs(os.path.dirname(self.__key_path(key, suffix)), exist_ok=True)
+        return self.__key_path(key, suffix)
+
+    def existing_path(self, config: Dict[str, Any], suffix: str = '.pth') -> Optional[str]:
+        """
+        Path of the checkpoint of config if it was saved, without adding anything to the store.
+        """
+        path = self.__key_path(self.key(config), suffix)
+        return path if os.path.exists(path) else None
+
+    def contains(self, path: str) -> bool:
+        return os.path.abspath(path).startswith(os.path.abspath(self.root) + os.sep)
+
+    def find(self, suffix: str = '.pth', **params) -> List[Tuple[str, Dict[str, Any]]]:
+        """
+        Checkpoints whose configuration has all values in params, e.g. find(target_var='gender', lr=0.0001).
+
+        :return: existing files with their configuration
+        """
+        sql = 'SELECT key, config FROM checkpoints'
+        values = []
+        if params:
+            sql += ' WHERE key IN (' + ' INTERSECT '.join(['SELECT key FROM params WHERE name = ? AND value = ?']
+                                                         * len(params)) + ')'
+            for name, value in params.items():
+                values += [name, json.dumps(normalise_config_value(value))]
+        with self.__connect() as conn:
+            rows = conn.execute(sql + ' ORDER BY created', values).fetchall()
+        return [(self.__key_path(key, suffix), json.loads(config)) for key, config in rows
+                if os.path.exists(self.__key_path(key, suffix))]
+
+    def migrate(self, legacy_path: str, config: Dict[str, Any], suffix: str = '.pth') -> str:
+        """
+        Moves a checkpoint saved with its old long name (or under an older configuration of the store) to the path of
+        config. If the store already has a file for config with the same content, the old copy is just removed.
+
+        :return: the new path of the checkpoint
+        """
+        new_path = self.path(config, suffix)
+        if os.path.abspath(new_path) == os.path.abspath(legacy_path):
+            return new_path
+        if os.path.exists(new_path):
+            if _file_hash(new_path) != _file_hash(legacy_path):
+                print(f'Not migrating {legacy_path}: {new_path} has a different checkpoint for the same configuration')
+                return legacy_path
+            os.remove(legacy_path)
+        else:
+            os.replace(legacy_path, new_path)
+        return new_path
+
+
+def _file_hash(path: str) -> str:
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
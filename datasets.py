@@ -15,6 +15,7 @@ from sklearn.preprocessing import RobustScaler
 from torch_geometric.data import InMemoryDataset, Data
 
 from utils import Normalisation, ConnType, AnalysisType, EncodingStrategy, DatasetType
+from utils_graphs import gcn_normalisation, sort_edges_by_destination
 from utils_datasets import DESIKAN_COMPLETE_TS, DESIKAN_TRACKS, UKB_IDS_PATH, UKB_PHENOTYPE_PATH, \
     UKB_TIMESERIES_PATH, NODE_FEATURES_NAMES, STRUCT_COLUMNS, UKB_WITHOUT_BMI
 
@@ -165,6 +166,56 @@ class BrainDataset(InMemoryDataset, ABC):
         # Download to `self.raw_dir`.
         pass
 
+    def prepare_edges(self):
+        """
+        Edge preprocessing done when the processed dataset is loaded, thus also for datasets processed before it was
+        added: sorts the edges by destination, and adds data.in_degree and data.gcn_norm.
+        """
+        self.sort_edges()
+        self.add_gcn_norm()
+
+    def __node_offsets(self) -> torch.Tensor:
+        """
+        For each edge of the collated data, number of nodes in the graphs before its own. Edges of the collated data
+        have the node ids of their own graph, so edge_index + offsets numbers the nodes of all graphs consecutively.
+        """
+        edge_slices, node_slices = self.slices['edge_index'], self.slices['x']
+        return node_slices[:-1].repeat_interleave(edge_slices[1:] - edge_slices[:-1])
+
+    def sort_edges(self):
+        """
+        Sorts the edges of each graph by destination and adds data.in_degree (see sort_edges_by_destination()). It is
+        done for all graphs at once: with their nodes numbered consecutively, the edges of each graph stay in the same
+        positions of the collated data.
+        """
+        node_slices = self.slices['x']
+        node_offsets = self.__node_offsets()
+        edge_index, edge_attr, in_degree = sort_edges_by_destination(self.data.edge_index + node_offsets,
+                                                                     self.data.edge_attr, int(node_slices[-1]))
+        self.data.edge_index = edge_index - node_offsets
+        self.data.edge_attr = edge_attr
+        self.data.in_degree = in_degree
+        self.slices['in_degree'] = node_slices.clone()
+
+    def add_gcn_norm(self):
+        """
+        Adds data.gcn_norm, the GCNConv normalisation of the edges of each graph (with edge_attr as weights if
+        edge_weights), so GCN models do not calculate it again in every forward pass. It is calculated for all graphs
+        at once when the processed dataset is loaded. data.gcn_norm_weighted (one value per graph) tells whether
+        edge_attr was used, so models with another edge_weights setting calculate their own normalisation.
+        """
+        edge_slices, node_slices = self.slices['edge_index'], self.slices['x']
+        edge_weight = None
+        if self.include_edge_weights and self.data.edge_attr is not None:
+            edge_weight = self.data.edge_attr.view(-1)
+        gcn_norm = gcn_normalisation(self.data.edge_index + self.__node_offsets(), edge_weight, int(node_slices[-1]))
+        if gcn_norm is not None:
+            self.data.gcn_norm = gcn_norm
+            self.slices['gcn_norm'] = edge_slices.clone()
+            num_graphs = node_slices.size(0) - 1
+            self.data.gcn_norm_weighted = torch.full((num_graphs,), edge_weight is not None, dtype=torch.bool)
+            self.slices['gcn_norm_weighted'] = torch.arange(num_graphs + 1)
+
 
 class HCPDataset(BrainDataset):
     def __init__(self, root, target_var: str, num_nodes: int, threshold: int, connectivity_type: ConnType,
@@ -192,6 +243,7 @@ class HCPDataset(BrainDataset):
                                          encoding_strategy=encoding_strategy, edge_weights=edge_weights,
                                          transform=transform, pre_transform=pre_transform)
         self.data, self.slices = torch.load(self.processed_paths[0])
+        self.prepare_edges()
 
     @property
     def processed_file_names(self):
@@ -304,6 +356,7 @@ class UKBDataset(BrainDataset):
                                          encoding_strategy=encoding_strategy, edge_weights=edge_weights,
                                          pre_transform=pre_transform)
         self.data, self.slices = torch.load(self.processed_paths[0])
+        self.prepare_edges()
 
     @property
     def processed_file_names(self):
@@ -1,26 +1,48 @@
+import copy
+import multiprocessing
 import os
 import pickle
+import queue
 import random
+import uuid
 from collections import deque
 from sys import exit
-from typing import Dict, Any, Union
+from typing import Dict, Any, Union, Callable, List
 
 import numpy as np
 import pandas as pd
 import torch
+import torch.distributed as dist
 import wandb
 from scipy.stats import stats
 from sklearn.metrics import roc_auc_score, accuracy_score, f1_score, classification_report, r2_score
 from sklearn.model_selection import StratifiedKFold
 from sklearn.preprocessing import LabelEncoder, MinMaxScaler
-from torch_geometric.data import DataLoader
+from torch.nn.parallel import DistributedDataParallel
+from torch.utils.data.distributed import DistributedSampler
+from torch_geometric.data import Data, DataLoader
 from xgboost import XGBClassifier, XGBRegressor, XGBModel
 
+from checkpoints import AsyncCheckpointer, CheckpointStore, CHECKPOINT_STORE_PATH, get_rng_state, set_rng_state
 from datasets import BrainDataset, HCPDataset, UKBDataset, FlattenCorrsDataset
 from model import SpatioTemporalModel
-from utils import create_name_for_brain_dataset, create_name_for_model, Normalisation, ConnType, ConvStrategy, \
+from profiling import StageProfiler, NULL_PROFILER
+from results_warehouse import ResultsWarehouse, RESULTS_PATH
+from run_logger import BufferedLogger, WandbLogger, WANDB_LOGGER
+from run_registry import RunRegistry, REGISTRY_PATH
+from telemetry import GradientTelemetry
+from utils import create_name_for_brain_dataset, Normalisation, ConnType, ConvStrategy, \
     StratifiedGroupKFold, PoolingStrategy, AnalysisType, merge_y_and_others, EncodingStrategy, create_best_encoder_name, \
-    SweepType, DatasetType, get_freer_gpu, free_gpu_info, create_name_for_flattencorrs_dataset, create_name_for_xgbmodel
+    SweepType, DatasetType, DeviceLeaseManager, create_name_for_flattencorrs_dataset, create_name_for_xgbmodel
+from utils_distributed import init_distributed, is_distributed, is_main_process, get_rank, get_world_size, \
+    shard_dataset, sync_buffers, broadcast_object, all_gather_object
+
+
+N_OUT_SPLITS: int = 5
+N_INNER_SPLITS: int = 5
+
+# Filled in by create_run_cfg(), depending on the device of the run
+kwargs_dataloader: Dict[str, Any] = {}
 
 
 class MSLELoss(torch.nn.Module):
@@ -43,50 +65,164 @@ class MSLELoss(torch.nn.Module):
         return loss.mean()
 
 
-def train_model(model, train_loader, optimizer, pooling_mechanism, device, label_scaler=None):
+class MetricsAccumulator:
+    """
+    Keeps running loss sums, predictions and labels as tensors on the device where they were calculated, so
+    nothing is synchronised with the host in the middle of an epoch. compute() is then called once at the end and
+    returns the same dictionary as return_classifier_metrics()/return_regressor_metrics().
+    """
+
+    def __init__(self, device, label_scaler: MinMaxScaler = None):
+        self.label_scaler = label_scaler
+        self.loss_sum = torch.zeros((), device=device)
+        self.link_loss_sum = torch.zeros((), device=device)
+        self.ent_loss_sum = torch.zeros((), device=device)
+        self.num_graphs: int = 0
+        self.predictions = []
+        self.labels = []
+
+    def update(self, num_graphs: int, loss, link_loss=None, ent_loss=None, pred=None, label=None):
+        self.num_graphs += num_graphs
+        self.loss_sum += loss.detach() * num_graphs
+        if link_loss is not None:
+            self.link_loss_sum += link_loss.detach() * num_graphs
+        if ent_loss is not None:
+            self.ent_loss_sum += ent_loss.detach() * num_graphs
+        if pred is not None:
+            self.predictions.append(pred.detach().flatten())
+            self.labels.append(label.detach().flatten())
+
+    def all_reduce(self):
+        """
+        Gathers the sums, predictions and labels of all processes, when each one only had part of the data.
+        """
+        sums = torch.stack([self.loss_sum, self.link_loss_sum, self.ent_loss_sum,
+                            torch.tensor(float(self.num_graphs), device=self.loss_sum.device)])
+        dist.all_reduce(sums)
+        self.loss_sum, self.link_loss_sum, self.ent_loss_sum = sums[0], sums[1], sums[2]
+        self.num_graphs = int(sums[3].item())
+        if self.predictions:
+            gathered = all_gather_object((torch.cat(self.predictions).cpu(), torch.cat(self.labels).cpu()))
+            self.predictions = [predictions for predictions, _ in gathered]
+            self.labels = [labels for _, labels in gathered]
+
+    def losses(self):
+        # Returning a weighted average according to number of graphs
+        return (self.loss_sum.item() / self.num_graphs,
+                self.link_loss_sum.item() / self.num_graphs,
+                self.ent_loss_sum.item() / self.num_graphs)
+
+    def compute(self) -> Dict[str, float]:
+        loss_value, link_loss_value, ent_loss_value = self.losses()
+        # Double precision to stay close to sklearn's results
+        predictions = torch.cat(self.predictions).double()
+        labels = torch.cat(self.labels).double()
+
+        if self.label_scaler is None:
+            metrics = self._classifier_metrics(labels, predictions)
+        else:
+            metrics = self._regressor_metrics(labels, predictions)
+
+        return {'loss': loss_value,
+                'link_loss': link_loss_value,
+                'ent_loss': ent_loss_value,
+                **{key: value.item() for key, value in metrics.items()}}
+
+    @staticmethod
+    def _binary_auc(labels, pred_prob):
+        # Mann-Whitney U statistic, with ties getting the average of their ranks (same as roc_auc_score)
+        sorted_pred, order = torch.sort(pred_prob)
+        _, inverse, counts = torch.unique_consecutive(sorted_pred, return_inverse=True, return_counts=True)
+        ends = torch.cumsum(counts, dim=0).double()
+        average_ranks = ends - (counts.double() - 1) / 2
+        ranks = torch.empty_like(pred_prob)
+        ranks[order] = average_ranks[inverse]
+
+        num_pos = labels.sum()
+        num_neg = labels.numel() - num_pos
+        return ((ranks * labels).sum() - num_pos * (num_pos + 1) / 2) / (num_pos * num_neg)
+
+    @staticmethod
+    def _safe_div(num, den):
+        # zero_division=0, as in the sklearn calls
+        return torch.where(den > 0, num / den.clamp(min=1), torch.zeros_like(num))
+
+    def _classifier_metrics(self, labels, pred_prob):
+        pred_binary = (pred_prob > 0.5).double()
+        tp = (pred_binary * labels).sum()
+        tn = ((1 - pred_binary) * (1 - labels)).sum()
+        fp = (pred_binary * (1 - labels)).sum()
+        fn = ((1 - pred_binary) * labels).sum()
+
+        return {'auc': self._binary_auc(labels, pred_prob),
+                'acc': (tp + tn) / labels.numel(),
+                'f1': self._safe_div(2 * tp, 2 * tp + fp + fn),
+                'sensitivity': self._safe_div(tp, tp + fn),
+                'specificity': self._safe_div(tn, tn + fp)}
+
+    def _regressor_metrics(self, labels, pred_prob):
+        # MinMaxScaler.inverse_transform() is just an affine transformation
+        scale = float(self.label_scaler.scale_[0])
+        minimum = float(self.label_scaler.min_[0])
+        labels = (labels - minimum) / scale
+        pred_prob = (pred_prob - minimum) / scale
+
+        ss_res = ((labels - pred_prob) ** 2).sum()
+        ss_tot = ((labels - labels.mean()) ** 2).sum()
+
+        labels_c = labels - labels.mean()
+        pred_c = pred_prob - pred_prob.mean()
+        r = (labels_c * pred_c).sum() / (labels_c.norm() * pred_c.norm())
+
+        return {'r2': 1 - ss_res / ss_tot,
+                'r': r}
+
+
+def compute_batch_loss(model, data, pooling_mechanism, criterion):
+    if pooling_mechanism == PoolingStrategy.DIFFPOOL:
+        output_batch, link_loss, ent_loss = model(data)
+        loss = criterion(output_batch, data.y.unsqueeze(1)) + link_loss + ent_loss
+    else:
+        output_batch = model(data)
+        loss = criterion(output_batch, data.y.unsqueeze(1))
+        link_loss, ent_loss = None, None
+    return output_batch, loss, link_loss, ent_loss
+
+
+def train_model(model, train_loader, optimizer, pooling_mechanism, device, label_scaler=None,
+                telemetry: GradientTelemetry = None, profiler: StageProfiler = NULL_PROFILER, distributed: bool = False):
     model.train()
-    loss_all = 0
-    loss_all_link = 0
-    loss_all_ent = 0
+    accumulator = MetricsAccumulator(device, label_scaler=label_scaler)
     if label_scaler is None:
         criterion = torch.nn.BCELoss()
     else:
         criterion = torch.nn.SmoothL1Loss()
 
-    grads = {'final_l': [],
-             'conv1d_1': []
-             }
-    for data in train_loader:
-        data = data.to(device)
+    for data in profiler.iterate(train_loader, 'collation'):
+        with profiler.stage('to_device'):
+            data = data.to(device)
         optimizer.zero_grad()
-        if pooling_mechanism == PoolingStrategy.DIFFPOOL:
-            output_batch, link_loss, ent_loss = model(data)
-            loss = criterion(output_batch, data.y.unsqueeze(1)) + link_loss + ent_loss
-            loss_b_link = link_loss
-            loss_b_ent = ent_loss
-        else:
-            output_batch = model(data)
-            loss = criterion(output_batch, data.y.unsqueeze(1))
+        with profiler.stage('forward'):
+            _, loss, link_loss, ent_loss = compute_batch_loss(model, data, pooling_mechanism, criterion)
 
-        loss.backward()
+        with profiler.stage('backward'):
+            loss.backward()
 
-        grads['final_l'].extend(model.final_linear.weight.grad.flatten().cpu().tolist())
-        grads['conv1d_1'].extend(model.final_linear.weight.grad.flatten().cpu().tolist())
+        if telemetry is not None:
+            telemetry.step()
 
-        loss_all += loss.item() * data.num_graphs
-        if pooling_mechanism == PoolingStrategy.DIFFPOOL:
-            loss_all_link += loss_b_link.item() * data.num_graphs
-            loss_all_ent += loss_b_ent.item() * data.num_graphs
+        accumulator.update(data.num_graphs, loss, link_loss=link_loss, ent_loss=ent_loss)
 
-        torch.nn.utils.clip_grad_value_(model.parameters(), 1)
-        optimizer.step()
-    print("GRAD", np.mean(grads['final_l']), np.max(grads['final_l']), np.std(grads['final_l']))
-    # len(train_loader) gives the number of batches
-    # len(train_loader.dataset) gives the number of graphs
+        with profiler.stage('clip_grad'):
+            torch.nn.utils.clip_grad_value_(model.parameters(), 1)
+        with profiler.stage('optimizer_step'):
+            optimizer.step()
+        profiler.step()
 
-    # Returning a weighted average according to number of graphs
-    return loss_all / len(train_loader.dataset), loss_all_link / len(train_loader.dataset), loss_all_ent / len(
-        train_loader.dataset)
+    # Only synchronising with the device once, at the end of the epoch
+    if distributed:
+        accumulator.all_reduce()
+    return accumulator.losses()
 
 
 def return_regressor_metrics(labels, pred_prob, label_scaler=None, loss_value=None, link_loss_value=None,
@@ -133,66 +269,84 @@ def return_classifier_metrics(labels, pred_binary, pred_prob, loss_value=None, l
             }
 
 
-def evaluate_model(model, loader, pooling_mechanism, device, label_scaler=None):
-    model.eval()
+def evaluate_model(model, loader, pooling_mechanism, device, label_scaler=None, distributed: bool = False):
+    return evaluate_models([model], loader, pooling_mechanism, device, label_scaler=label_scaler,
+                           distributed=distributed)['models'][0]
+
+
+def evaluate_models(models, loader, pooling_mechanism, device, label_scaler=None,
+                    distributed: bool = False) -> Dict[str, Any]:
+    """
+    Evaluates several models (e.g. the models of the folds of a configuration) on the same batches. Each batch is
+    collated and sent to the device once, and then goes through the models one after the other. Their predictions are
+    averaged into the prediction of the ensemble.
+
+    :param distributed: each process has a different part of the data in loader, metrics are for all of them
+    :return: 'models' with the metrics of each model, 'ensemble' with the metrics of the averaged predictions, and
+             'predictions' (num_models x num_graphs), 'ensemble_predictions' and 'labels' in the order of loader
+    """
+    for model in models:
+        model.eval()
     if label_scaler is None:
         criterion = torch.nn.BCELoss()
     else:
         criterion = torch.nn.SmoothL1Loss()
 
-    predictions = []
-    labels = []
-    test_error = 0
-    test_link_loss = 0
-    test_ent_loss = 0
+    accumulators = [MetricsAccumulator(device, label_scaler=label_scaler) for _ in models]
+    # The ensemble of a single model is the model itself
+    ensemble_accumulator = MetricsAccumulator(device, label_scaler=label_scaler) if len(models) > 1 else None
 
     for data in loader:
         with torch.no_grad():
             data = data.to(device)
-            if pooling_mechanism == PoolingStrategy.DIFFPOOL:
-                output_batch, link_loss, ent_loss = model(data)
-                # output_batch = output_batch.flatten()
-                loss = criterion(output_batch, data.y.unsqueeze(1)) + link_loss + ent_loss
-                loss_b_link = link_loss
-                loss_b_ent = ent_loss
-            else:
-                output_batch = model(data)
-                # output_batch = output_batch.flatten()
-                loss = criterion(output_batch, data.y.unsqueeze(1))
-
-            test_error += loss.item() * data.num_graphs
-            if pooling_mechanism == PoolingStrategy.DIFFPOOL:
-                test_link_loss += loss_b_link.item() * data.num_graphs
-                test_ent_loss += loss_b_ent.item() * data.num_graphs
-
-            pred = output_batch.flatten().detach().cpu().numpy()
-
-            label = data.y.detach().cpu().numpy()
-            predictions.append(pred)
-            labels.append(label)
-    predictions = np.hstack(predictions)
-    labels = np.hstack(labels)
-
-    if label_scaler is None:
-        pred_binary = np.where(predictions > 0.5, 1, 0)
-        return return_classifier_metrics(labels, pred_binary, predictions,
-                                         loss_value=test_error / len(loader.dataset),
-                                         link_loss_value=test_link_loss / len(loader.dataset),
-                                         ent_loss_value=test_ent_loss / len(loader.dataset))
-    else:
-        return return_regressor_metrics(labels, predictions,
-                                        label_scaler=label_scaler,
-                                        loss_value=test_error / len(loader.dataset),
-                                        link_loss_value=test_link_loss / len(loader.dataset),
-                                        ent_loss_value=test_ent_loss / len(loader.dataset))
+            outputs = []
+            for model, accumulator in zip(models, accumulators):
+                output_batch, loss, link_loss, ent_loss = compute_batch_loss(model, data, pooling_mechanism,
+                                                                             criterion)
+                accumulator.update(data.num_graphs, loss, link_loss=link_loss, ent_loss=ent_loss,
+                                   pred=output_batch, label=data.y)
+                outputs.append(output_batch)
+            if ensemble_accumulator is not None:
+                ensemble_output = torch.stack(outputs).mean(dim=0)
+                ensemble_accumulator.update(data.num_graphs, criterion(ensemble_output, data.y.unsqueeze(1)),
+                                            pred=ensemble_output, label=data.y)
+
+    if ensemble_accumulator is None:
+        ensemble_accumulator = accumulators[0]
+    elif distributed:
+        ensemble_accumulator.all_reduce()
+    if distributed:
+        for accumulator in accumulators:
+            accumulator.all_reduce()
+    return {'models': [accumulator.compute() for accumulator in accumulators],
+            'ensemble': ensemble_accumulator.compute(),
+            'predictions': torch.stack([torch.cat(accumulator.predictions) for accumulator in accumulators]),
+            'ensemble_predictions': torch.cat(ensemble_accumulator.predictions),
+            'labels': torch.cat(ensemble_accumulator.labels)}
 
 
 def training_step(outer_split_no, inner_split_no, epoch, model, train_loader, val_loader, optimizer,
-                  pooling_mechanism, device, label_scaler=None):
-    loss, link_loss, ent_loss = train_model(model, train_loader, optimizer, pooling_mechanism, device,
-                                            label_scaler=label_scaler)
-    train_metrics = evaluate_model(model, train_loader, pooling_mechanism, device, label_scaler=label_scaler)
-    val_metrics = evaluate_model(model, val_loader, pooling_mechanism, device, label_scaler=label_scaler)
+                  pooling_mechanism, device, label_scaler=None, telemetry: GradientTelemetry = None,
+                  profiler: StageProfiler = NULL_PROFILER, ddp_model: DistributedDataParallel = None,
+                  train_eval_loader=None, logger: WandbLogger = WANDB_LOGGER):
+    """
+    :param ddp_model: model wrapped for distributed training, only used for the optimisation steps
+    :param train_eval_loader: training data for evaluation, if different from train_loader
+    :param logger: where the metrics of the epoch are sent
+    """
+    distributed = ddp_model is not None
+    loss, link_loss, ent_loss = train_model(ddp_model if distributed else model, train_loader, optimizer,
+                                            pooling_mechanism, device, label_scaler=label_scaler,
+                                            telemetry=telemetry, profiler=profiler, distributed=distributed)
+    if distributed:
+        sync_buffers(model)
+    if train_eval_loader is None:
+        train_eval_loader = train_loader
+    with profiler.stage('evaluation'):
+        train_metrics = evaluate_model(model, train_eval_loader, pooling_mechanism, device, label_scaler=label_scaler,
+                                       distributed=distributed)
+        val_metrics = evaluate_model(model, val_loader, pooling_mechanism, device, label_scaler=label_scaler,
+                                     distributed=distributed)
 
     if label_scaler is None:
         print(
@@ -201,7 +355,7 @@ def training_step(outer_split_no, inner_split_no, epoch, model, train_loader, va
                               train_metrics['auc'], val_metrics['auc'],
                               train_metrics['acc'], val_metrics['acc'],
                               train_metrics['f1'], val_metrics['f1']))
-        wandb.log({
+        logger.log({
             f'train_loss{inner_split_no}': train_metrics['loss'], f'val_loss{inner_split_no}': val_metrics['loss'],
             f'train_auc{inner_split_no}': train_metrics['auc'], f'val_auc{inner_split_no}': val_metrics['auc'],
             f'train_acc{inner_split_no}': train_metrics['acc'], f'val_acc{inner_split_no}': val_metrics['acc'],
@@ -217,14 +371,14 @@ def training_step(outer_split_no, inner_split_no, epoch, model, train_loader, va
             ''.format(outer_split_no, inner_split_no, epoch, train_metrics['loss'], val_metrics['loss'],
                       train_metrics['r2'], val_metrics['r2'],
                       train_metrics['r'], val_metrics['r']))
-        wandb.log({
+        logger.log({
             f'train_loss{inner_split_no}': train_metrics['loss'], f'val_loss{inner_split_no}': val_metrics['loss'],
             f'train_r2{inner_split_no}': train_metrics['r2'], f'val_r2{inner_split_no}': val_metrics['r2'],
             f'train_r{inner_split_no}': train_metrics['r'], f'val_r{inner_split_no}': val_metrics['r']
         })
 
     if pooling_mechanism == PoolingStrategy.DIFFPOOL:
-        wandb.log({
+        logger.log({
             f'train_link_loss{inner_split_no}': link_loss, f'val_link_loss{inner_split_no}': val_metrics['link_loss'],
             f'train_ent_loss{inner_split_no}': ent_loss, f'val_ent_loss{inner_split_no}': val_metrics['ent_loss']
         })
@@ -340,17 +494,71 @@ def generate_xgb_model(run_cfg: Dict[str, Any]) -> XGBModel:
     return model
 
 
-def generate_st_model(run_cfg: Dict[str, Any], for_test: bool = False) -> SpatioTemporalModel:
-    if run_cfg['param_encoding_strategy'] in [EncodingStrategy.NONE, EncodingStrategy.STATS]:
+def load_encoder_model(run_cfg: Dict[str, Any]):
+    if run_cfg['param_encoding_strategy'] == EncodingStrategy.AE3layers:
+        pass  # from encoders import AE  # Necessary to torch.load
+    elif run_cfg['param_encoding_strategy'] == EncodingStrategy.VAE3layers:
+        pass  # from encoders import VAE  # Necessary to torch.load
+    return torch.load(create_best_encoder_name(ts_length=run_cfg['time_length'],
+                                               outer_split_num=run_cfg['split_to_test'],
+                                               encoder_name=run_cfg['param_encoding_strategy'].value))
+
+
+def encode_dataset(dataset: BrainDataset, run_cfg: Dict[str, Any], chunk_size: int = 65536) -> BrainDataset:
+    """
+    Dataset in which the time series of each node is replaced by the output of the (already trained) encoder of this
+    outer split: the embedding for AE, and mean and logvar for VAE. Multimodal features are kept as they are.
+
+    Embeddings are saved in the processed folder of the dataset, and only calculated again if the encoder changes.
+    """
+    encoder_path = create_best_encoder_name(ts_length=run_cfg['time_length'],
+                                            outer_split_num=run_cfg['split_to_test'],
+                                            encoder_name=run_cfg['param_encoding_strategy'].value)
+    cache_path = os.path.join(dataset.processed_dir, os.path.basename(encoder_path).replace('.pth', '_embeddings.pt'))
+
+    if os.path.exists(cache_path) and os.path.getmtime(cache_path) >= os.path.getmtime(encoder_path):
+        encoded_x = torch.load(cache_path)
+    else:
+        print('Calculating embeddings with', encoder_path)
+        encoder_model = load_encoder_model(run_cfg).to(run_cfg['device_run'])
+        encoder_model.eval()
+        all_x = dataset.data.x
+        multimodal_size = run_cfg['multimodal_size']
+        encoded_chunks = []
+        with torch.no_grad():
+            for start in range(0, all_x.shape[0], chunk_size):
+                x = all_x[start:start + chunk_size].to(run_cfg['device_run'])
+                xn, x = x[:, :multimodal_size], x[:, multimodal_size:]
+                if run_cfg['param_encoding_strategy'] == EncodingStrategy.VAE3layers:
+                    mu, logvar = encoder_model.encode(x)
+                    x = torch.cat((mu, logvar), dim=1)
+                else:
+                    x = encoder_model.encode(x)
+                encoded_chunks.append(torch.cat((xn, x), dim=1).cpu())
+        encoded_x = torch.cat(encoded_chunks, dim=0)
+        # Other runs (or processes) might be reading it
+        torch.save(encoded_x, f'{cache_path}.{os.getpid()}.tmp')
+        os.replace(f'{cache_path}.{os.getpid()}.tmp', cache_path)
+
+    # New data object and slices, so nothing is shared with the original dataset. x has the same number of rows, thus
+    # the slices are still valid
+    encoded_dataset = copy.copy(dataset)
+    encoded_dataset.data = Data(**{key: encoded_x if key == 'x' else value.clone() if torch.is_tensor(value) else value
+                                   for key, value in dataset.data})
+    encoded_dataset.slices = {key: slices.clone() for key, slices in dataset.slices.items()}
+    # Newer versions of pyg cache the graphs already indexed, which would have the time series
+    if getattr(encoded_dataset, '_data_list', None) is not None:
+        encoded_dataset._data_list = None
+    return encoded_dataset
+
+
+def generate_st_model(run_cfg: Dict[str, Any], for_test: bool = False,
+                      logger: WandbLogger = WANDB_LOGGER) -> SpatioTemporalModel:
+    if run_cfg['param_encoding_strategy'] in [EncodingStrategy.NONE, EncodingStrategy.STATS] or \
+            run_cfg.get('cache_encodings', False):
         encoding_model = None
     else:
-        if run_cfg['param_encoding_strategy'] == EncodingStrategy.AE3layers:
-            pass  # from encoders import AE  # Necessary to torch.load
-        elif run_cfg['param_encoding_strategy'] == EncodingStrategy.VAE3layers:
-            pass  # from encoders import VAE  # Necessary to torch.load
-        encoding_model = torch.load(create_best_encoder_name(ts_length=run_cfg['time_length'],
-                                                             outer_split_num=outer_split_num,
-                                                             encoder_name=run_cfg['param_encoding_strategy'].value))
+        encoding_model = load_encoder_model(run_cfg)
 
     model = SpatioTemporalModel(num_time_length=run_cfg['time_length'],
                                 dropout_perc=run_cfg['param_dropout'],
@@ -366,21 +574,27 @@ def generate_st_model(run_cfg: Dict[str, Any], for_test: bool = False) -> Spatio
                                 num_gnn_layers=run_cfg['param_num_gnn_layers'],
                                 encoding_strategy=run_cfg['param_encoding_strategy'],
                                 encoding_model=encoding_model,
+                                cached_encodings=run_cfg.get('cache_encodings', False),
                                 multimodal_size=run_cfg['multimodal_size'],
-                                temporal_embed_size=run_cfg['temporal_embed_size']
+                                temporal_embed_size=run_cfg['temporal_embed_size'],
+                                checkpointed_modules=run_cfg.get('activation_checkpointing', [])
                                 ).to(run_cfg['device_run'])
 
     if not for_test:
-        wandb.watch(model, log='all')
+        # 'none' turns off wandb's own logging of every parameter and gradient
+        if run_cfg.get('wandb_watch', 'all') != 'none':
+            logger.watch(model, log=run_cfg.get('wandb_watch', 'all'))
         trainable_params = sum(p.numel() for p in model.parameters() if p.requires_grad)
         print("Number of trainable params:", trainable_params)
+        logger.summary('trainable_params', trainable_params)
     # elif analysis_type == AnalysisType.FLATTEN_CORRS or analysis_type == AnalysisType.FLATTEN_CORRS_THRESHOLD:
     #    model = XGBClassifier(n_jobs=-1, seed=1111, random_state=1111, **params)
     return model
 
 
 def fit_xgb_model(out_fold_num: int, in_fold_num: int, run_cfg: Dict[str, Any], model: XGBModel,
-                  X_train_in: FlattenCorrsDataset, X_val_in: FlattenCorrsDataset) -> Dict:
+                  X_train_in: FlattenCorrsDataset, X_val_in: FlattenCorrsDataset,
+                  logger: WandbLogger = WANDB_LOGGER) -> Dict:
     model_saving_path = create_name_for_xgbmodel(model=model,
                                                  outer_split_num=out_fold_num,
                                                  inner_split_num=in_fold_num,
@@ -417,7 +631,7 @@ def fit_xgb_model(out_fold_num: int, in_fold_num: int, run_cfg: Dict[str, Any],
                                 train_metrics['auc'], val_metrics['auc'],
                                 train_metrics['acc'], val_metrics['acc'],
                                 train_metrics['f1'], val_metrics['f1']))
-        wandb.log({
+        logger.log({
             f'train_auc{in_fold_num}': train_metrics['auc'], f'val_auc{in_fold_num}': val_metrics['auc'],
             f'train_acc{in_fold_num}': train_metrics['acc'], f'val_acc{in_fold_num}': val_metrics['acc'],
             f'train_sens{in_fold_num}': train_metrics['sensitivity'],
@@ -435,7 +649,7 @@ def fit_xgb_model(out_fold_num: int, in_fold_num: int, run_cfg: Dict[str, Any],
         print('{:1d}-{:1d}: R2: {:.4f} / {:.4f}, R: {:.4f} / {:.4f}'.format(out_fold_num, in_fold_num,
                                                                             train_metrics['r2'], val_metrics['r2'],
                                                                             train_metrics['r'], val_metrics['r']))
-        wandb.log({
+        logger.log({
             f'train_r2{in_fold_num}': train_metrics['r2'], f'val_r2{in_fold_num}': val_metrics['r2'],
             f'train_r{in_fold_num}': train_metrics['r'], f'val_r{in_fold_num}': val_metrics['r']
         })
@@ -443,37 +657,115 @@ def fit_xgb_model(out_fold_num: int, in_fold_num: int, run_cfg: Dict[str, Any],
     return val_metrics
 
 
+def create_st_model_checkpoint_config(run_cfg: Dict[str, Any], model: SpatioTemporalModel, out_fold_num: int,
+                                      in_fold_num: int) -> Dict[str, Any]:
+    """
+    Everything that create_name_for_model() used to put in the name of a checkpoint, and analysis_type, which it only
+    had implicitly through multimodal_size.
+    """
+    return {'target_var': run_cfg['target_var'],
+            'dataset_type': run_cfg['dataset_type'],
+            'analysis_type': run_cfg['analysis_type'],
+            'outer_split_num': out_fold_num,
+            'inner_split_num': in_fold_num,
+            'metric_evaluated': 'loss',
+            **model.to_config(),
+            'lr': run_cfg['param_lr'],
+            'weight_decay': run_cfg['param_weight_decay'],
+            'n_epochs': run_cfg['num_epochs'],
+            'threshold': run_cfg['param_threshold'],
+            'normalisation': run_cfg['param_normalisation'],
+            'batch_size': run_cfg['batch_size'],
+            'num_nodes': run_cfg['num_nodes'],
+            'conn_type': run_cfg['param_conn_type']}
+
+
+def create_st_model_saving_path(run_cfg: Dict[str, Any], model: SpatioTemporalModel, out_fold_num: int,
+                                in_fold_num: int, suffix: str = '.pth') -> str:
+    store = CheckpointStore(run_cfg.get('checkpoint_store', CHECKPOINT_STORE_PATH))
+    return store.path(create_st_model_checkpoint_config(run_cfg, model, out_fold_num, in_fold_num), suffix=suffix)
+
+
+def update_best_model_metrics(best_model_metrics: Dict[str, float], val_metrics: Dict[str, float],
+                              run_cfg: Dict[str, Any], label_scaler: MinMaxScaler = None):
+    best_model_metrics['loss'] = val_metrics['loss']
+    if label_scaler is None:
+        best_model_metrics['sensitivity'] = val_metrics['sensitivity']
+        best_model_metrics['specificity'] = val_metrics['specificity']
+        best_model_metrics['acc'] = val_metrics['acc']
+        best_model_metrics['f1'] = val_metrics['f1']
+        best_model_metrics['auc'] = val_metrics['auc']
+    else:
+        best_model_metrics['r2'] = val_metrics['r2']
+        best_model_metrics['r'] = val_metrics['r']
+    if run_cfg['param_pooling'] == PoolingStrategy.DIFFPOOL:
+        best_model_metrics['ent_loss'] = val_metrics['ent_loss']
+        best_model_metrics['link_loss'] = val_metrics['link_loss']
+
+
 def fit_st_model(out_fold_num: int, in_fold_num: int, run_cfg: Dict[str, Any], model: SpatioTemporalModel,
-                 X_train_in: BrainDataset, X_val_in: BrainDataset, label_scaler: MinMaxScaler = None) -> Dict:
-    train_in_loader = DataLoader(X_train_in, batch_size=run_cfg['batch_size'], shuffle=True, **kwargs_dataloader)
-    val_loader = DataLoader(X_val_in, batch_size=run_cfg['batch_size'], shuffle=False, **kwargs_dataloader)
+                 X_train_in: BrainDataset, X_val_in: BrainDataset, label_scaler: MinMaxScaler = None,
+                 profiler: StageProfiler = None, trial_reporter: Callable[[int, float], bool] = None,
+                 logger: WandbLogger = WANDB_LOGGER) -> Dict:
+    """
+    :param trial_reporter: called after each epoch with the best validation loss so far, training stops if it
+                           returns False (e.g. ASHA in sweep_runner.py)
+    :param logger: where the metrics of each epoch are sent
+    """
+    distributed: bool = run_cfg.get('distributed', False)
+    if distributed:
+        # Each process gets part of each batch, so the batch size is the same as with a single process
+        train_sampler = DistributedSampler(X_train_in, shuffle=True)
+        batch_size = max(run_cfg['batch_size'] // get_world_size(), 1)
+        train_in_loader = DataLoader(X_train_in, batch_size=batch_size, sampler=train_sampler, **kwargs_dataloader)
+        train_eval_loader = DataLoader(shard_dataset(X_train_in), batch_size=batch_size, shuffle=False,
+                                       **kwargs_dataloader)
+        val_loader = DataLoader(shard_dataset(X_val_in), batch_size=batch_size, shuffle=False, **kwargs_dataloader)
+        # Some parameters are not used depending on the pooling/sweep_type
+        ddp_model = DistributedDataParallel(model, find_unused_parameters=True)
+    else:
+        train_sampler, ddp_model = None, None
+        train_in_loader = DataLoader(X_train_in, batch_size=run_cfg['batch_size'], shuffle=True, **kwargs_dataloader)
+        train_eval_loader = DataLoader(X_train_in, batch_size=run_cfg['batch_size'], shuffle=False,
+                                       **kwargs_dataloader)
+        val_loader = DataLoader(X_val_in, batch_size=run_cfg['batch_size'], shuffle=False, **kwargs_dataloader)
 
     optimizer = torch.optim.Adam(model.parameters(),
                                  lr=run_cfg['param_lr'],
                                  weight_decay=run_cfg['param_weight_decay'])
 
-    model_saving_path = create_name_for_model(target_var=run_cfg['target_var'],
-                                              model=model,
-                                              outer_split_num=out_fold_num,
-                                              inner_split_num=in_fold_num,
-                                              n_epochs=run_cfg['num_epochs'],
-                                              threshold=run_cfg['param_threshold'],
-                                              batch_size=run_cfg['batch_size'],
-                                              num_nodes=run_cfg['num_nodes'],
-                                              conn_type=run_cfg['param_conn_type'],
-                                              normalisation=run_cfg['param_normalisation'],
-                                              analysis_type=run_cfg['analysis_type'],
-                                              metric_evaluated='loss',
-                                              dataset_type=run_cfg['dataset_type'],
-                                              edge_weights=run_cfg['edge_weights'],
-                                              lr=run_cfg['param_lr'],
-                                              weight_decay=run_cfg['param_weight_decay']
-                                              )
+    model_saving_path = create_st_model_saving_path(run_cfg, model, out_fold_num, in_fold_num)
+    # Whole training state every checkpoint_interval epochs, to resume the run if interrupted. It is also keyed by the
+    # run id, so runs of the same configuration at the same time do not share it
+    training_state_path = create_st_model_saving_path(run_cfg, model, out_fold_num, in_fold_num,
+                                                      suffix=f'_{get_run_id(run_cfg)}_training_state.pth')
+    checkpoint_interval: int = run_cfg.get('checkpoint_interval', 0)
+    checkpointer = AsyncCheckpointer()
+
+    telemetry = GradientTelemetry(model, interval=run_cfg.get('telemetry_interval', 0),
+                                  log_fn=lambda summary: logger.log(summary, commit=False))
+    if profiler is None:
+        profiler = StageProfiler.from_run_cfg(run_cfg)
+    profiler.attach(model)
+    profiler.start_trace()
 
     best_model_metrics = {'loss': 9999}
 
     last_losses_val = deque([9999 for _ in range(run_cfg['early_stop_steps'])], maxlen=run_cfg['early_stop_steps'])
-    for epoch in range(run_cfg['num_epochs'] + 1):
+    start_epoch = 0
+    if checkpoint_interval > 0 and os.path.exists(training_state_path):
+        training_state = torch.load(training_state_path, map_location=run_cfg['device_run'])
+        model.load_state_dict(training_state['model'])
+        optimizer.load_state_dict(training_state['optimizer'])
+        best_model_metrics = training_state['best_model_metrics']
+        last_losses_val = deque(training_state['last_losses_val'], maxlen=run_cfg['early_stop_steps'])
+        set_rng_state(training_state['rng'])
+        start_epoch = training_state['epoch'] + 1
+        print('Resuming training from epoch', start_epoch, 'with', training_state_path)
+
+    for epoch in range(start_epoch, run_cfg['num_epochs'] + 1):
+        if train_sampler is not None:
+            train_sampler.set_epoch(epoch)
         val_metrics = training_step(out_fold_num,
                                     in_fold_num,
                                     epoch,
@@ -483,34 +775,267 @@ def fit_st_model(out_fold_num: int, in_fold_num: int, run_cfg: Dict[str, Any], m
                                     optimizer,
                                     run_cfg['param_pooling'],
                                     run_cfg['device_run'],
-                                    label_scaler=label_scaler)
+                                    label_scaler=label_scaler,
+                                    telemetry=telemetry,
+                                    profiler=profiler,
+                                    ddp_model=ddp_model,
+                                    train_eval_loader=train_eval_loader,
+                                    logger=logger)
+        # Validation metrics are the same in all processes, thus they all stop at the same epoch
         if sum([val_metrics['loss'] > loss for loss in last_losses_val]) == run_cfg['early_stop_steps']:
             print("EARLY STOPPING IT")
             break
         last_losses_val.append(val_metrics['loss'])
 
         if val_metrics['loss'] < best_model_metrics['loss']:
-            best_model_metrics['loss'] = val_metrics['loss']
-            if label_scaler is None:
-                best_model_metrics['sensitivity'] = val_metrics['sensitivity']
-                best_model_metrics['specificity'] = val_metrics['specificity']
-                best_model_metrics['acc'] = val_metrics['acc']
-                best_model_metrics['f1'] = val_metrics['f1']
-                best_model_metrics['auc'] = val_metrics['auc']
-            else:
-                best_model_metrics['r2'] = val_metrics['r2']
-                best_model_metrics['r'] = val_metrics['r']
-            if run_cfg['param_pooling'] == PoolingStrategy.DIFFPOOL:
-                best_model_metrics['ent_loss'] = val_metrics['ent_loss']
-                best_model_metrics['link_loss'] = val_metrics['link_loss']
+            update_best_model_metrics(best_model_metrics, val_metrics, run_cfg, label_scaler)
 
             # wandb.unwatch()#[model])
             # torch.save(model, model_names['loss'])
-            torch.save(model.state_dict(), model_saving_path)
+            if is_main_process():
+                with profiler.stage('checkpoint'):
+                    checkpointer.save(model.state_dict(), model_saving_path)
+        if checkpoint_interval > 0 and epoch % checkpoint_interval == 0 and is_main_process():
+            with profiler.stage('checkpoint'):
+                checkpointer.save({'epoch': epoch,
+                                   'model': model.state_dict(),
+                                   'optimizer': optimizer.state_dict(),
+                                   'best_model_metrics': best_model_metrics,
+                                   'last_losses_val': list(last_losses_val),
+                                   'rng': get_rng_state()}, training_state_path)
+        profiler.epoch_summary(epoch, logger=logger)
+
+        if trial_reporter is not None and not trial_reporter(epoch, best_model_metrics['loss']):
+            print("TRIAL STOPPED BY SCHEDULER")
+            break
     # wandb.unwatch()
+    # Training finished, so there is nothing to resume anymore
+    if is_main_process():
+        checkpointer.remove(training_state_path)
+    checkpointer.close()
+    telemetry.close()
+    profiler.close()
     return best_model_metrics
 
 
+def run_inner_fold(run_cfg: Dict[str, Any], inner_loop_run: int, X_train_out: Union[BrainDataset, FlattenCorrsDataset],
+                   inner_train_index, inner_val_index, scaler_labels: MinMaxScaler = None,
+                   profiler: StageProfiler = None, trial_reporter: Callable[[int, float], bool] = None,
+                   logger: WandbLogger = WANDB_LOGGER) -> Dict:
+    if run_cfg['analysis_type'] in [AnalysisType.ST_UNIMODAL, AnalysisType.ST_MULTIMODAL]:
+        model: SpatioTemporalModel = generate_st_model(run_cfg, logger=logger)
+    elif run_cfg['analysis_type'] in [AnalysisType.FLATTEN_CORRS]:
+        model: XGBModel = generate_xgb_model(run_cfg)
+    else:
+        model = None
+
+    X_train_in = X_train_out[torch.tensor(inner_train_index)]
+    X_val_in = X_train_out[torch.tensor(inner_val_index)]
+    print("Inner Size is:", len(X_train_in), "/", len(X_val_in))
+    if run_cfg['analysis_type'] == AnalysisType.FLATTEN_CORRS:
+        print("Inner Positive sex classes:", sum([data.sex.item() for data in X_train_in]),
+              "/", sum([data.sex.item() for data in X_val_in]))
+        print('Mean age distribution:', np.mean([data.age.item() for data in X_train_in]),
+              '/', np.mean([data.age.item() for data in X_val_in]))
+    elif run_cfg['target_var'] in ['age', 'bmi']:
+        print('Mean of distribution', np.mean([data.y.item() for data in X_train_in]),
+              '/', np.mean([data.y.item() for data in X_val_in]))
+    else:
+        print("Inner Positive classes:", sum([data.y.item() for data in X_train_in]),
+              "/", sum([data.y.item() for data in X_val_in]))
+
+    if run_cfg['analysis_type'] in [AnalysisType.ST_UNIMODAL, AnalysisType.ST_MULTIMODAL]:
+        inner_fold_metrics = fit_st_model(out_fold_num=run_cfg['split_to_test'],
+                                          in_fold_num=inner_loop_run,
+                                          run_cfg=run_cfg,
+                                          model=model,
+                                          X_train_in=X_train_in,
+                                          X_val_in=X_val_in,
+                                          label_scaler=scaler_labels,
+                                          profiler=profiler,
+                                          trial_reporter=trial_reporter,
+                                          logger=logger)
+
+    elif run_cfg['analysis_type'] in [AnalysisType.FLATTEN_CORRS]:
+        inner_fold_metrics = fit_xgb_model(out_fold_num=run_cfg['split_to_test'],
+                                           in_fold_num=inner_loop_run,
+                                           run_cfg=run_cfg,
+                                           model=model,
+                                           X_train_in=X_train_in,
+                                           X_val_in=X_val_in,
+                                           logger=logger)
+    return inner_fold_metrics
+
+
+# Set in each worker by _init_inner_fold_worker()
+_inner_fold_shared_state: Dict[str, Any] = {}
+
+
+class _FoldTrialReporter:
+    """
+    trial_reporter of fit_st_model() in the workers of run_inner_folds_in_parallel(): the best validation loss of each
+    epoch is sent to the parent, where _FoldsTrialAggregator gives them to the actual trial_reporter. Training stops
+    at the first epoch after the parent decides to stop the trial.
+    """
+
+    def __init__(self, inner_loop_run: int, report_queue, stop_event):
+        self.inner_loop_run: int = inner_loop_run
+        self.report_queue = report_queue
+        self.stop_event = stop_event
+
+    def __call__(self, epoch: int, loss: float) -> bool:
+        self.report_queue.put((self.inner_loop_run, epoch, loss))
+        return not self.stop_event.is_set()
+
+    def finish(self):
+        self.report_queue.put((self.inner_loop_run, None, None))
+
+
+class _FoldsTrialAggregator:
+    """
+    Calls trial_reporter once per epoch with the mean over the inner folds of their best validation loss so far, when
+    all folds still training have reached that epoch. Folds which already finished (e.g. early stopping) count with
+    their last best loss.
+    """
+
+    def __init__(self, trial_reporter: Callable[[int, float], bool], inner_loop_runs: List[int], stop_event):
+        self.trial_reporter = trial_reporter
+        self.losses: Dict[int, Dict[int, float]] = {inner_loop_run: {} for inner_loop_run in inner_loop_runs}
+        self.finished = set()
+        self.last_epoch: int = -1
+        self.stop_event = stop_event
+
+    def add(self, inner_loop_run: int, epoch: int, loss: float):
+        if epoch is None:
+            self.finished.add(inner_loop_run)
+        else:
+            self.losses[inner_loop_run][epoch] = loss
+        self.__report_ready_epochs()
+
+    def __loss_at(self, inner_loop_run: int, epoch: int):
+        epochs = [fold_epoch for fold_epoch in self.losses[inner_loop_run].keys() if fold_epoch <= epoch]
+        return self.losses[inner_loop_run][max(epochs)] if epochs else None
+
+    def __report_ready_epochs(self):
+        reported_epochs = sorted({epoch for fold_losses in self.losses.values() for epoch in fold_losses.keys()
+                                  if epoch > self.last_epoch})
+        for epoch in reported_epochs:
+            if self.stop_event.is_set():
+                return
+            training = [inner_loop_run for inner_loop_run in self.losses.keys() if inner_loop_run not in self.finished]
+            if any(max(self.losses[inner_loop_run].keys(), default=-1) < epoch for inner_loop_run in training):
+                return
+            losses = [self.__loss_at(inner_loop_run, epoch) for inner_loop_run in self.losses.keys()]
+            self.last_epoch = epoch
+            if not self.trial_reporter(epoch, float(np.mean([loss for loss in losses if loss is not None]))):
+                self.stop_event.set()
+
+
+def _init_inner_fold_worker(num_threads: int, shared_state: Dict[str, Any], device_queue, report_queue, stop_event):
+    global kwargs_dataloader
+    torch.set_num_threads(num_threads)
+    # Pool workers are daemonic, thus cannot start DataLoader workers
+    kwargs_dataloader = {}
+    # Each worker keeps one of the devices leased by the parent
+    run_cfg = dict(shared_state['run_cfg'])
+    run_cfg['device_run'] = device_queue.get()
+    _inner_fold_shared_state.update(shared_state, run_cfg=run_cfg, report_queue=report_queue, stop_event=stop_event)
+
+
+def _run_inner_fold_worker(fold_info):
+    inner_loop_run, (inner_train_index, inner_val_index) = fold_info
+    run_cfg = _inner_fold_shared_state['run_cfg']
+    # Workers have no wandb run: their metrics are sent by the parent
+    logger = BufferedLogger()
+    profiler = StageProfiler.from_run_cfg(run_cfg)
+    profiler.trace_name = f'{profiler.trace_name}_inner{inner_loop_run}'
+    trial_reporter = None
+    if _inner_fold_shared_state['with_trial_reporter']:
+        trial_reporter = _FoldTrialReporter(inner_loop_run, _inner_fold_shared_state['report_queue'],
+                                            _inner_fold_shared_state['stop_event'])
+    try:
+        inner_fold_metrics = run_inner_fold(run_cfg, inner_loop_run, _inner_fold_shared_state['X_train_out'],
+                                            inner_train_index, inner_val_index,
+                                            _inner_fold_shared_state['scaler_labels'], profiler=profiler,
+                                            trial_reporter=trial_reporter, logger=logger)
+    finally:
+        if trial_reporter is not None:
+            trial_reporter.finish()
+    return inner_fold_metrics, logger, profiler.peaks()
+
+
+def run_inner_folds_in_parallel(run_cfg: Dict[str, Any], inner_folds: list, X_train_out: BrainDataset,
+                                scaler_labels: MinMaxScaler = None, profiler: StageProfiler = NULL_PROFILER,
+                                trial_reporter: Callable[[int, float], bool] = None,
+                                logger: WandbLogger = WANDB_LOGGER) -> list:
+    """
+    Trains every inner fold at the same time, in a pool of up to run_cfg['inner_fold_workers'] spawned processes with
+    the CPU threads split between them. Returns the metrics of each fold, in order.
+
+    On GPU, each worker has its own device: the one of this run, and others leased here with DeviceLeaseManager (as
+    many as are free now, up to one per worker).
+
+    :param profiler: gets the peak memory of the workers, which profile their own fold (with the settings of run_cfg)
+    :param trial_reporter: see fit_st_model(), called here with the mean of the best validation losses of the folds
+    :param logger: where the metrics of the workers are sent, once all folds are trained
+    """
+    num_workers = min(run_cfg['inner_fold_workers'], len(inner_folds))
+    lease_manager = DeviceLeaseManager.from_available_devices()
+    extra_leases = []
+    if run_cfg['device_run'].startswith('cuda'):
+        while len(extra_leases) < num_workers - 1:
+            device = lease_manager.try_acquire(['cuda'])
+            if device is None:
+                break
+            extra_leases.append(device)
+        num_workers = len(extra_leases) + 1
+        devices = [run_cfg['device_run']] + extra_leases
+    else:
+        devices = [run_cfg['device_run']] * num_workers
+    num_threads = max(torch.get_num_threads() // num_workers, 1)
+    print(f'Running {len(inner_folds)} inner folds with {num_workers} workers ({num_threads} threads each) in',
+          devices)
+
+    # spawn, as CUDA might already be initialised in this process (e.g. by encode_dataset())
+    context = multiprocessing.get_context('spawn')
+    device_queue = context.Queue()
+    for device in devices:
+        device_queue.put(device)
+    report_queue, stop_event = context.Queue(), context.Event()
+    aggregator = None
+    if trial_reporter is not None:
+        aggregator = _FoldsTrialAggregator(trial_reporter, [inner_loop_run for inner_loop_run, _ in inner_folds],
+                                           stop_event)
+    # Workers have no wandb run, so the run id (which keys the training states) is set here
+    get_run_id(run_cfg)
+    shared_state = {'run_cfg': run_cfg, 'X_train_out': X_train_out, 'scaler_labels': scaler_labels,
+                    'with_trial_reporter': trial_reporter is not None}
+    try:
+        with context.Pool(num_workers, initializer=_init_inner_fold_worker,
+                          initargs=(num_threads, shared_state, device_queue, report_queue, stop_event)) as pool:
+            async_results = pool.map_async(_run_inner_fold_worker, inner_folds, chunksize=1)
+            # Until every fold is trained and (with a trial_reporter) all their reports are received
+            while not async_results.ready() or \
+                    (aggregator is not None and async_results.successful() and
+                     len(aggregator.finished) < len(inner_folds)):
+                try:
+                    report = report_queue.get(timeout=1)
+                except queue.Empty:
+                    continue
+                aggregator.add(*report)
+            results = async_results.get()
+    finally:
+        for device in extra_leases:
+            lease_manager.release(device)
+
+    all_fold_metrics = []
+    for inner_fold_metrics, fold_logger, peaks in results:
+        fold_logger.replay(logger)
+        profiler.merge_peaks(peaks)
+        all_fold_metrics.append(inner_fold_metrics)
+    return all_fold_metrics
+
+
 def get_empty_metrics_dict(run_cfg: Dict[str, Any]) -> Dict[str, list]:
     if run_cfg['target_var'] == 'gender':
         tmp_dict = {'loss': [], 'sensitivity': [], 'specificity': [], 'acc': [], 'f1': [], 'auc': [],
@@ -520,16 +1045,45 @@ def get_empty_metrics_dict(run_cfg: Dict[str, Any]) -> Dict[str, list]:
     return tmp_dict
 
 
-def send_inner_loop_metrics_to_wandb(overall_metrics: Dict[str, list]):
+def get_inner_loop_summary(overall_metrics: Dict[str, list]) -> Dict[str, Any]:
+    summary: Dict[str, Any] = {}
     for key, values in overall_metrics.items():
         if len(values) == 0 or values[0] is None:
             continue
         elif len(values) == 1:
-            wandb.run.summary[f"mean_val_{key}"] = values[0]
+            summary[f"mean_val_{key}"] = values[0]
         else:
-            wandb.run.summary[f"mean_val_{key}"] = np.mean(values)
-            wandb.run.summary[f"std_val_{key}"] = np.std(values)
-            wandb.run.summary[f"values_val_{key}"] = values
+            summary[f"mean_val_{key}"] = np.mean(values)
+            summary[f"std_val_{key}"] = np.std(values)
+            summary[f"values_val_{key}"] = values
+    return summary
+
+
+def get_run_id(run_cfg: Dict[str, Any]) -> str:
+    """
+    Id of the run in wandb, or a random one (kept in run_cfg) without wandb.
+    """
+    if 'run_id' not in run_cfg:
+        run_cfg['run_id'] = wandb.run.id if wandb.run is not None else uuid.uuid4().hex[:8]
+    return run_cfg['run_id']
+
+
+def send_inner_loop_metrics_to_wandb(overall_metrics: Dict[str, list], run_cfg: Dict[str, Any] = None):
+    """
+    :param run_cfg: if given, the metrics of each inner fold are also saved in the ResultsWarehouse
+    """
+    for key, value in get_inner_loop_summary(overall_metrics).items():
+        wandb.run.summary[key] = value
+
+    if run_cfg is not None and is_main_process():
+        warehouse = ResultsWarehouse(run_cfg['results_warehouse'])
+        warehouse.add_run(get_run_id(run_cfg), run_cfg)
+        num_inner_folds = max(len(values) for values in overall_metrics.values())
+        for inner_fold in range(num_inner_folds):
+            warehouse.add_metrics(get_run_id(run_cfg), 'val',
+                                  {key: values[inner_fold] for key, values in overall_metrics.items()
+                                   if len(values) > inner_fold},
+                                  inner_fold=inner_fold + 1)
 
 
 def update_overall_metrics(overall_metrics: Dict[str, list], inner_fold_metrics: Dict[str, float]):
@@ -537,79 +1091,126 @@ def update_overall_metrics(overall_metrics: Dict[str, list], inner_fold_metrics:
         overall_metrics[key].append(value)
 
 
-def send_global_results(test_metrics: Dict[str, float]):
-    for key, value in test_metrics.items():
-        wandb.run.summary[f"values_test_{key}"] = value
+def get_global_summary(test_metrics: Dict[str, float]) -> Dict[str, float]:
+    return {f"values_test_{key}": value for key, value in test_metrics.items()}
 
 
-if __name__ == '__main__':
-    # Because of strange bug with symbolic links in server
-    os.environ['WANDB_DISABLE_CODE'] = 'true'
+def send_global_results(test_metrics: Dict[str, float], run_cfg: Dict[str, Any] = None, predictions=None,
+                        labels=None):
+    """
+    :param run_cfg: if given, the metrics (and the predictions, for ROC curves) are also saved in the ResultsWarehouse
+    """
+    for key, value in get_global_summary(test_metrics).items():
+        wandb.run.summary[key] = value
 
-    wandb.init(entity='st-team')
-    config = wandb.config
-    print('Config file from wandb:', config)
+    if run_cfg is not None:
+        warehouse = ResultsWarehouse(run_cfg['results_warehouse'])
+        warehouse.add_run(get_run_id(run_cfg), run_cfg)
+        warehouse.add_metrics(get_run_id(run_cfg), 'test', test_metrics)
+        if predictions is not None:
+            warehouse.add_predictions(get_run_id(run_cfg), 'test', predictions, labels)
 
-    torch.manual_seed(1)
-    np.random.seed(1111)
-    random.seed(1111)
-    torch.cuda.manual_seed_all(1111)
 
+def register_run(run_cfg: Dict[str, Any], overall_metrics: Dict[str, list], test_metrics: Dict[str, float],
+                 checkpoint_path: str):
+    """
+    Saves the run in the local RunRegistry, with the same summary as in wandb, so it can be evaluated later offline.
+    """
+    summary = {**get_inner_loop_summary(overall_metrics), **get_global_summary(test_metrics)}
+    run_id = RunRegistry(run_cfg['run_registry']).register(get_run_id(run_cfg), run_cfg, summary, checkpoint_path)
+    print('Run registered with id', run_id)
+
+
+def create_run_cfg(config, device_run: str = 'cpu') -> Dict[str, Any]:
+    """
+    Creates the run_cfg dictionary used everywhere in this file from a wandb.config (or a plain dictionary with the
+    same keys, as in the sweep .yaml files).
+
+    :param device_run: device for ST models (e.g. leased with DeviceLeaseManager), xgboost always runs in the cpu
+    """
     # Making a single variable for each argument
     run_cfg: Dict[str, Any] = {
-        'analysis_type': AnalysisType(config.analysis_type),
-        'dataset_type': DatasetType(config.dataset_type),
-        'num_nodes': config.num_nodes,
-        'param_conn_type': ConnType(config.conn_type),
-        'split_to_test': config.fold_num,
-        'target_var': config.target_var,
-        'time_length': config.time_length,
+        'analysis_type': AnalysisType(config['analysis_type']),
+        'dataset_type': DatasetType(config['dataset_type']),
+        'num_nodes': config['num_nodes'],
+        'param_conn_type': ConnType(config['conn_type']),
+        'split_to_test': config['fold_num'],
+        'target_var': config['target_var'],
+        'time_length': config['time_length'],
+        # SQLite database where the run is saved at the end (see run_registry.py)
+        'run_registry': config.get('run_registry', REGISTRY_PATH),
+        # SQLite database with the metrics of all runs, for summary tables (see results_warehouse.py)
+        'results_warehouse': config.get('results_warehouse', RESULTS_PATH),
     }
     if run_cfg['analysis_type'] in [AnalysisType.ST_UNIMODAL, AnalysisType.ST_MULTIMODAL]:
-        run_cfg['batch_size'] = config.batch_size
-        run_cfg['device_run'] = f'cuda:{get_freer_gpu()}'
-        run_cfg['early_stop_steps'] = config.early_stop_steps
-        run_cfg['edge_weights'] = config.edge_weights
+        run_cfg['batch_size'] = config['batch_size']
+        run_cfg['device_run'] = device_run
+        run_cfg['early_stop_steps'] = config['early_stop_steps']
+        run_cfg['edge_weights'] = config['edge_weights']
         run_cfg['model_with_sigmoid'] = True
-        run_cfg['num_epochs'] = config.num_epochs
-        run_cfg['param_activation'] = config.activation
-        run_cfg['param_channels_conv'] = config.channels_conv
-        run_cfg['param_conv_strategy'] = ConvStrategy(config.conv_strategy)
-        run_cfg['param_dropout'] = config.dropout
-        run_cfg['param_encoding_strategy'] = EncodingStrategy(config.encoding_strategy)
-        run_cfg['param_lr'] = config.lr
-        run_cfg['param_normalisation'] = Normalisation(config.normalisation)
-        run_cfg['param_num_gnn_layers'] = config.num_gnn_layers
-        run_cfg['param_pooling'] = PoolingStrategy(config.pooling)
-        run_cfg['param_threshold'] = config.threshold
-        run_cfg['param_weight_decay'] = config.weight_decay
-        run_cfg['sweep_type'] = SweepType(config.sweep_type)
-        run_cfg['temporal_embed_size'] = config.temporal_embed_size
+        run_cfg['num_epochs'] = config['num_epochs']
+        run_cfg['param_activation'] = config['activation']
+        run_cfg['param_channels_conv'] = config['channels_conv']
+        run_cfg['param_conv_strategy'] = ConvStrategy(config['conv_strategy'])
+        run_cfg['param_dropout'] = config['dropout']
+        run_cfg['param_encoding_strategy'] = EncodingStrategy(config['encoding_strategy'])
+        run_cfg['param_lr'] = config['lr']
+        run_cfg['param_normalisation'] = Normalisation(config['normalisation'])
+        run_cfg['param_num_gnn_layers'] = config['num_gnn_layers']
+        run_cfg['param_pooling'] = PoolingStrategy(config['pooling'])
+        run_cfg['param_threshold'] = config['threshold']
+        run_cfg['param_weight_decay'] = config['weight_decay']
+        run_cfg['sweep_type'] = SweepType(config['sweep_type'])
+        run_cfg['temporal_embed_size'] = config['temporal_embed_size']
+        # Optional monitoring: sample gradient/activation statistics every N steps (0 is off) and wandb.watch()
+        run_cfg['telemetry_interval'] = config.get('telemetry_interval', 0)
+        run_cfg['wandb_watch'] = config.get('wandb_watch', 'all')
+        # Time per stage of each epoch, and optionally a torch.profiler trace for a few training steps
+        run_cfg['profile'] = config.get('profile', False)
+        run_cfg['profile_trace_steps'] = config.get('profile_trace_steps', 0)
+        # Peak host RSS and torch allocator memory per stage, saved in the run summary
+        run_cfg['profile_memory'] = config.get('profile_memory', False)
+        # >1 trains all inner folds concurrently in that many processes, otherwise only the first inner fold is run
+        run_cfg['inner_fold_workers'] = config.get('inner_fold_workers', 0)
+        # Every N epochs the whole training state is saved, and an interrupted run resumes from it (0 is off)
+        run_cfg['checkpoint_interval'] = config.get('checkpoint_interval', 0)
+        # DistributedDataParallel over the processes started with torchrun (see init_distributed())
+        run_cfg['distributed'] = is_distributed()
+        # AE/VAE encoders run once over the dataset and the ST model trains on their (frozen) output. Opt-in, as it also
+        # stops gradients from reaching the encoder
+        run_cfg['cache_encodings'] = config.get('cache_encodings', False)
+        # Directory of the CheckpointStore where the models are saved
+        run_cfg['checkpoint_store'] = config.get('checkpoint_store', CHECKPOINT_STORE_PATH)
+        # Submodules (temporal_conv, meta_layer, diff_pool) whose activations are calculated again in the backward
+        # pass instead of kept in memory, as a list or comma-separated
+        checkpointed_modules = config.get('activation_checkpointing', [])
+        if isinstance(checkpointed_modules, str):
+            checkpointed_modules = [name.strip() for name in checkpointed_modules.split(',') if name.strip()]
+        run_cfg['activation_checkpointing'] = checkpointed_modules
 
         run_cfg['ts_spit_num'] = int(4800 / run_cfg['time_length'])
 
         # Not sure whether this makes a difference with the cuda random issues, but it was in the examples :(
-        kwargs_dataloader = {'num_workers': 1, 'pin_memory': True} if run_cfg['device_run'].startswith('cuda') else {}
+        kwargs_dataloader.clear()
+        kwargs_dataloader.update(
+            {'num_workers': 1, 'pin_memory': True} if run_cfg['device_run'].startswith('cuda') else {})
 
         # Definitions depending on sweep_type
         run_cfg['param_gat_heads'] = 0
         if run_cfg['sweep_type'] == SweepType.GAT:
-            run_cfg['param_gat_heads'] = config.gat_heads
+            run_cfg['param_gat_heads'] = config['gat_heads']
 
     elif run_cfg['analysis_type'] in [AnalysisType.FLATTEN_CORRS]:
         run_cfg['device_run'] = 'cpu'
-        run_cfg['colsample_bylevel'] = config.colsample_bylevel
-        run_cfg['colsample_bynode'] = config.colsample_bynode
-        run_cfg['colsample_bytree'] = config.colsample_bytree
-        run_cfg['gamma'] = config.gamma
-        run_cfg['learning_rate'] = config.learning_rate
-        run_cfg['max_depth'] = config.max_depth
-        run_cfg['min_child_weight'] = config.min_child_weight
-        run_cfg['n_estimators'] = config.n_estimators
-        run_cfg['subsample'] = config.subsample
-
-    N_OUT_SPLITS: int = 5
-    N_INNER_SPLITS: int = 5
+        run_cfg['colsample_bylevel'] = config['colsample_bylevel']
+        run_cfg['colsample_bynode'] = config['colsample_bynode']
+        run_cfg['colsample_bytree'] = config['colsample_bytree']
+        run_cfg['gamma'] = config['gamma']
+        run_cfg['learning_rate'] = config['learning_rate']
+        run_cfg['max_depth'] = config['max_depth']
+        run_cfg['min_child_weight'] = config['min_child_weight']
+        run_cfg['n_estimators'] = config['n_estimators']
+        run_cfg['subsample'] = config['subsample']
 
     # Handling inputs and what is possible
     if run_cfg['analysis_type'] not in [AnalysisType.ST_MULTIMODAL, AnalysisType.ST_UNIMODAL,
@@ -630,9 +1231,30 @@ if __name__ == '__main__':
     if run_cfg['target_var'] in ['age', 'bmi']:
         run_cfg['model_with_sigmoid'] = False
 
-    print('Resulting run_cfg:', run_cfg)
+    return run_cfg
+
+
+def run_experiment(run_cfg: Dict[str, Any], dataset: Union[BrainDataset, FlattenCorrsDataset] = None,
+                   profiler: StageProfiler = None, trial_reporter: Callable[[int, float], bool] = None):
+    """
+    Runs the whole experiment defined by run_cfg: outer split, inner fold(s) and final metrics in the test set.
+
+    :param dataset: an already loaded dataset for run_cfg, otherwise generate_dataset() is called
+    :param trial_reporter: see fit_st_model() and run_inner_folds_in_parallel(). If it has a stopped_epoch (as
+                           ASHAScheduler) which is set after training, the test set is not evaluated and the run is
+                           not registered
+    :return: metrics of the inner fold(s) and metrics in the test set
+    """
+    if profiler is None:
+        profiler = StageProfiler.from_run_cfg(run_cfg)
     # DATASET
-    dataset = generate_dataset(run_cfg)
+    if dataset is None:
+        with profiler.stage('ingestion'):
+            dataset = generate_dataset(run_cfg)
+    if run_cfg.get('cache_encodings', False) and \
+            run_cfg['param_encoding_strategy'] in [EncodingStrategy.AE3layers, EncodingStrategy.VAE3layers]:
+        with profiler.stage('encoding'):
+            dataset = encode_dataset(dataset, run_cfg)
 
     skf_outer_generator = create_fold_generator(dataset, run_cfg, N_OUT_SPLITS)
 
@@ -681,100 +1303,65 @@ if __name__ == '__main__':
     # Main inner-loop
     #################
     overall_metrics: Dict[str, list] = get_empty_metrics_dict(run_cfg)
-    inner_loop_run: int = 0
-    for inner_train_index, inner_val_index in skf_inner_generator:
-        inner_loop_run += 1
-
-        if run_cfg['analysis_type'] in [AnalysisType.ST_UNIMODAL, AnalysisType.ST_MULTIMODAL]:
-            model: SpatioTemporalModel = generate_st_model(run_cfg)
-        elif run_cfg['analysis_type'] in [AnalysisType.FLATTEN_CORRS]:
-            model: XGBModel = generate_xgb_model(run_cfg)
-        else:
-            model = None
-
-        X_train_in = X_train_out[torch.tensor(inner_train_index)]
-        X_val_in = X_train_out[torch.tensor(inner_val_index)]
-        print("Inner Size is:", len(X_train_in), "/", len(X_val_in))
-        if run_cfg['analysis_type'] == AnalysisType.FLATTEN_CORRS:
-            print("Inner Positive sex classes:", sum([data.sex.item() for data in X_train_in]),
-                  "/", sum([data.sex.item() for data in X_val_in]))
-            print('Mean age distribution:', np.mean([data.age.item() for data in X_train_in]),
-                  '/', np.mean([data.age.item() for data in X_val_in]))
-        elif run_cfg['target_var'] in ['age', 'bmi']:
-            print('Mean of distribution', np.mean([data.y.item() for data in X_train_in]),
-                  '/', np.mean([data.y.item() for data in X_val_in]))
-        else:
-            print("Inner Positive classes:", sum([data.y.item() for data in X_train_in]),
-                  "/", sum([data.y.item() for data in X_val_in]))
-
-        if run_cfg['analysis_type'] in [AnalysisType.ST_UNIMODAL, AnalysisType.ST_MULTIMODAL]:
-            inner_fold_metrics = fit_st_model(out_fold_num=run_cfg['split_to_test'],
-                                              in_fold_num=inner_loop_run,
-                                              run_cfg=run_cfg,
-                                              model=model,
-                                              X_train_in=X_train_in,
-                                              X_val_in=X_val_in,
-                                              label_scaler=scaler_labels)
-
-        elif run_cfg['analysis_type'] in [AnalysisType.FLATTEN_CORRS]:
-            inner_fold_metrics = fit_xgb_model(out_fold_num=run_cfg['split_to_test'],
-                                               in_fold_num=inner_loop_run,
-                                               run_cfg=run_cfg,
-                                               model=model,
-                                               X_train_in=X_train_in,
-                                               X_val_in=X_val_in)
-        update_overall_metrics(overall_metrics, inner_fold_metrics)
-
-        # One inner loop only
-        #if run_cfg['dataset_type'] == DatasetType.UKB and run_cfg['analysis_type'] in [AnalysisType.ST_UNIMODAL,
-        #                                                                               AnalysisType.ST_MULTIMODAL]:
-        #    break
+    inner_folds = list(enumerate(skf_inner_generator, start=1))
+    if run_cfg.get('inner_fold_workers', 0) > 1 and not run_cfg.get('distributed', False) and \
+            run_cfg['analysis_type'] in [AnalysisType.ST_UNIMODAL, AnalysisType.ST_MULTIMODAL]:
+        # All inner folds at the same time, one per worker
+        all_fold_metrics = run_inner_folds_in_parallel(run_cfg, inner_folds, X_train_out, scaler_labels,
+                                                       profiler=profiler, trial_reporter=trial_reporter)
+    else:
         # One inner loop no matter what analysis type for more systematic comparison
-        break
+        inner_loop_run, (inner_train_index, inner_val_index) = inner_folds[0]
+        all_fold_metrics = [run_inner_fold(run_cfg, inner_loop_run, X_train_out, inner_train_index,
+                                           inner_val_index, scaler_labels, profiler=profiler,
+                                           trial_reporter=trial_reporter)]
+    for inner_fold_metrics in all_fold_metrics:
+        update_overall_metrics(overall_metrics, inner_fold_metrics)
 
-    send_inner_loop_metrics_to_wandb(overall_metrics)
+    # Trials stopped by a scheduler are not finished runs, so they are kept out of the warehouse and registry
+    stopped_trial = getattr(trial_reporter, 'stopped_epoch', None) is not None
+    send_inner_loop_metrics_to_wandb(overall_metrics, None if stopped_trial else run_cfg)
     print('Overall inner loop results:', overall_metrics)
 
+    # With distributed training, only the main process saved the best model
+    if not is_main_process():
+        return overall_metrics, None
+    if stopped_trial:
+        print('Trial stopped by the scheduler, not evaluating on the test set')
+        return overall_metrics, None
+
     #############################################
     # Final metrics on test set, calculated already for being easy to get the metrics on the best model later
     # Getting best model of the run
     inner_fold_for_val: int = 1
+    # Only for classification, to get ROC curves later
+    test_predictions, test_labels = None, None
     if run_cfg['analysis_type'] in [AnalysisType.ST_UNIMODAL, AnalysisType.ST_MULTIMODAL]:
         model: SpatioTemporalModel = generate_st_model(run_cfg, for_test=True)
 
-        model_saving_path: str = create_name_for_model(target_var=run_cfg['target_var'],
-                                                       model=model,
-                                                       outer_split_num=run_cfg['split_to_test'],
-                                                       inner_split_num=inner_fold_for_val,
-                                                       n_epochs=run_cfg['num_epochs'],
-                                                       threshold=run_cfg['param_threshold'],
-                                                       batch_size=run_cfg['batch_size'],
-                                                       num_nodes=run_cfg['num_nodes'],
-                                                       conn_type=run_cfg['param_conn_type'],
-                                                       normalisation=run_cfg['param_normalisation'],
-                                                       analysis_type=run_cfg['analysis_type'],
-                                                       metric_evaluated='loss',
-                                                       dataset_type=run_cfg['dataset_type'],
-                                                       lr=run_cfg['param_lr'],
-                                                       weight_decay=run_cfg['param_weight_decay'],
-                                                       edge_weights=run_cfg['edge_weights'])
+        model_saving_path: str = create_st_model_saving_path(run_cfg, model, run_cfg['split_to_test'],
+                                                             inner_fold_for_val)
         model.load_state_dict(torch.load(model_saving_path))
         model.eval()
 
         # Calculating on test set
         test_out_loader = DataLoader(X_test_out, batch_size=run_cfg['batch_size'], shuffle=False, **kwargs_dataloader)
 
-        test_metrics = evaluate_model(model, test_out_loader, run_cfg['param_pooling'], run_cfg['device_run'],
-                                      label_scaler=scaler_labels)
+        test_results = evaluate_models([model], test_out_loader, run_cfg['param_pooling'], run_cfg['device_run'],
+                                       label_scaler=scaler_labels)
+        test_metrics = test_results['models'][0]
         print(test_metrics)
+        if scaler_labels is None:
+            test_predictions = test_results['predictions'][0].cpu().numpy()
+            test_labels = test_results['labels'].cpu().numpy()
 
         if scaler_labels is None:
             print('{:1d}-Final: {:.7f}, Auc: {:.4f}, Acc: {:.4f}, Sens: {:.4f}, Speci: {:.4f}'
-                  ''.format(outer_split_num, test_metrics['loss'], test_metrics['auc'], test_metrics['acc'],
+                  ''.format(run_cfg['split_to_test'], test_metrics['loss'], test_metrics['auc'], test_metrics['acc'],
                             test_metrics['sensitivity'], test_metrics['specificity']))
         else:
             print('{:1d}-Final: {:.7f}, R2: {:.4f}, R: {:.4f}'
-                  ''.format(outer_split_num, test_metrics['loss'], test_metrics['r2'], test_metrics['r']))
+                  ''.format(run_cfg['split_to_test'], test_metrics['loss'], test_metrics['r2'], test_metrics['r']))
     elif run_cfg['analysis_type'] in [AnalysisType.FLATTEN_CORRS]:
         model: XGBModel = generate_xgb_model(run_cfg)
         model_saving_path = create_name_for_xgbmodel(model=model,
@@ -787,14 +1374,15 @@ if __name__ == '__main__':
 
         if run_cfg['target_var'] == 'gender':
             y_test = [int(data.sex.item()) for data in X_test_out]
+            test_predictions, test_labels = model.predict_proba(test_arr)[:, 1], y_test
             test_metrics = return_classifier_metrics(y_test,
-                                                     pred_prob=model.predict_proba(test_arr)[:, 1],
+                                                     pred_prob=test_predictions,
                                                      pred_binary=model.predict(test_arr),
                                                      flatten_approach=True)
             print(test_metrics)
 
             print('{:1d}-Final: Auc: {:.4f}, Acc: {:.4f}, Sens: {:.4f}, Speci: {:.4f}'
-                  ''.format(outer_split_num, test_metrics['auc'], test_metrics['acc'],
+                  ''.format(run_cfg['split_to_test'], test_metrics['auc'], test_metrics['acc'],
                             test_metrics['sensitivity'], test_metrics['specificity']))
         elif run_cfg['target_var'] == 'age':
             # np.array() because of printing calls in the regressor_metrics function
@@ -802,11 +1390,60 @@ if __name__ == '__main__':
             test_metrics = return_regressor_metrics(y_test,
                                                     pred_prob=model.predict(test_arr))
             print(test_metrics)
-            print('{:1d}-Final: R2: {:.4f}, R: {:.4f}'.format(outer_split_num,
+            print('{:1d}-Final: R2: {:.4f}, R: {:.4f}'.format(run_cfg['split_to_test'],
                                                               test_metrics['r2'],
                                                               test_metrics['r']))
 
-    send_global_results(test_metrics)
+    send_global_results(test_metrics, run_cfg, test_predictions, test_labels)
+    register_run(run_cfg, overall_metrics, test_metrics, model_saving_path)
+    profiler.send_memory_summary()
+
+    return overall_metrics, test_metrics
+
+
+if __name__ == '__main__':
+    # Because of strange bug with symbolic links in server
+    os.environ['WANDB_DISABLE_CODE'] = 'true'
+
+    # Several processes (gloo backend) when launched with torchrun, e.g.
+    # torchrun --nnodes=2 --nproc_per_node=8 --rdzv_endpoint=host:29500 main_loop.py
+    # Only the first process logs to wandb, and it sends the configuration to the others
+    init_distributed()
+    if is_main_process():
+        wandb.init(entity='st-team')
+        config = wandb.config
+    else:
+        # Offline, with its own run id, so that wandb.log() still works in this process without touching the run of the
+        # first one. WANDB_MODE=dryrun works with the pinned wandb 0.8.31 (wandb.init(mode=...) needs wandb >= 0.10)
+        os.environ['WANDB_MODE'] = 'dryrun'
+        wandb.init(id=f'rank{get_rank()}-{os.getpid()}')
+        config = None
+    if is_distributed():
+        config = broadcast_object(dict(config) if is_main_process() else None)
+    print('Config file from wandb:', config)
+
+    torch.manual_seed(1)
+    np.random.seed(1111)
+    random.seed(1111)
+    torch.cuda.manual_seed_all(1111)
+
+    # ST runs wait for a GPU (or use the CPU in machines without them), xgboost only needs a CPU slot. The lease is
+    # given back even if the run crashes
+    if AnalysisType(config['analysis_type']) in [AnalysisType.ST_UNIMODAL, AnalysisType.ST_MULTIMODAL]:
+        device_prefixes = None
+    else:
+        device_prefixes = ['cpu']
+    if is_distributed():
+        # Processes are placed by torchrun, and gloo is only used here for CPU training
+        run_cfg: Dict[str, Any] = create_run_cfg(config, device_run='cpu')
+        # The run id of the first process, so all of them find the same training state
+        run_cfg['run_id'] = broadcast_object(wandb.run.id if is_main_process() else None)
+        print('Resulting run_cfg:', run_cfg)
+        run_experiment(run_cfg)
+        dist.destroy_process_group()
+    else:
+        with DeviceLeaseManager.from_available_devices().lease(device_prefixes) as leased_device:
+            run_cfg: Dict[str, Any] = create_run_cfg(config, device_run=leased_device)
+            print('Resulting run_cfg:', run_cfg)
 
-    if run_cfg['device_run'] == 'cuda:0':
-        free_gpu_info()
+            run_experiment(run_cfg)
@@ -1,4 +1,5 @@
 from sys import exit
+from typing import Dict, Any, List, Optional
 
 import torch
 import torch.nn as nn
@@ -6,15 +7,28 @@ import torch.nn.functional as F
 import torch_geometric.utils as pyg_utils
 from math import ceil
 from torch.nn import BatchNorm1d
+from torch.utils.checkpoint import checkpoint
 from torch_geometric.nn import DenseSAGEConv, dense_diff_pool
 from torch_geometric.nn import MetaLayer
 from torch_geometric.nn import global_mean_pool, GCNConv, GATConv
 from torch_geometric.utils import to_dense_batch
-from torch_scatter import scatter_mean
+from torch_scatter import scatter_mean, segment_csr
 
 from tcn import TemporalConvNet
 from utils import ConvStrategy, PoolingStrategy, EncodingStrategy, SweepType
 
+# Submodules of SpatioTemporalModel which can be run with activation checkpointing
+CHECKPOINTABLE_MODULES = ['temporal_conv', 'meta_layer', 'diff_pool']
+
+# Intermediate representations of SpatioTemporalModel.forward(return_intermediates=True), with one row per 'node' (of
+# all graphs in the batch) or per 'graph'
+INTERMEDIATE_ROWS = {'temporal_embeddings': 'node',
+                     'node_embeddings': 'node',
+                     'node_mask': 'graph',
+                     'diffpool_assignments1': 'graph',
+                     'diffpool_assignments2': 'graph',
+                     'graph_embeddings': 'graph'}
+
 
 class GNN(torch.nn.Module):
     def __init__(self,
@@ -80,14 +94,19 @@ class DiffPoolLayer(torch.nn.Module):
 
         self.gnn3_embed = GNN(3 * self.INTERN_EMBED_SIZE, self.INTERN_EMBED_SIZE, self.INTERN_EMBED_SIZE, lin=False)
 
-    def forward(self, x, adj, mask=None):
+    def forward(self, x, adj, mask=None, intermediates: Dict[str, torch.Tensor] = None):
         s = self.gnn1_pool(x, adj, mask)
         x = self.gnn1_embed(x, adj, mask)
+        if intermediates is not None:
+            # dense_diff_pool() applies the same softmax
+            intermediates['diffpool_assignments1'] = torch.softmax(s, dim=-1)
 
         x, adj, l1, e1 = dense_diff_pool(x, adj, s, mask)
 
         s = self.gnn2_pool(x, adj)
         x = self.gnn2_embed(x, adj)
+        if intermediates is not None:
+            intermediates['diffpool_assignments2'] = torch.softmax(s, dim=-1)
 
         x, adj, l2, e2 = dense_diff_pool(x, adj, s)
 
@@ -98,10 +117,30 @@ class DiffPoolLayer(torch.nn.Module):
         return x, l1 + l2, e1 + e2
 
 
+def destination_rowptr(edge_index: torch.Tensor, num_nodes: int,
+                       in_degree: torch.Tensor = None) -> Optional[torch.Tensor]:
+    """
+    CSR pointers of edges sorted by destination (as done by utils_graphs.sort_edges_by_destination()): the edges
+    arriving at node i are rowptr[i]:rowptr[i + 1].
+
+    :param in_degree: number of edges arriving at each node, calculated from edge_index if not given
+    :return: rowptr ([N + 1]), or None if the edges are not sorted by destination
+    """
+    col = edge_index[1]
+    if col.numel() > 1 and not bool((col[1:] >= col[:-1]).all()):
+        return None
+    if in_degree is None or in_degree.numel() != num_nodes:
+        in_degree = torch.bincount(col, minlength=num_nodes)
+    rowptr = col.new_zeros(num_nodes + 1)
+    rowptr[1:] = torch.cumsum(in_degree, dim=0)
+    return rowptr
+
+
 class EdgeModel(torch.nn.Module):
     def __init__(self, num_node_features, num_edge_features, activation='relu'):
         super().__init__()
         self.input_size = 2 * num_node_features + num_edge_features
+        self.num_node_features = num_node_features
         dict_activations = {'relu': nn.ReLU(),
                             'elu': nn.ELU(),
                             'tanh': nn.Tanh()}
@@ -121,11 +160,35 @@ class EdgeModel(torch.nn.Module):
         out = self.edge_mlp(out)
         return out
 
+    def __first_layer_parts(self, x, edge_attr):
+        """
+        The first linear layer over [src, dest, edge_attr] is the sum of one projection per part, so the node parts are
+        calculated once per node instead of once per edge.
+
+        :return: projections of x as source and as destination nodes ([N, H] each), and of edge_attr with the bias
+        """
+        first_layer = self.edge_mlp[0]
+        w_src = first_layer.weight[:, :self.num_node_features]
+        w_dest = first_layer.weight[:, self.num_node_features:2 * self.num_node_features]
+        w_edge = first_layer.weight[:, 2 * self.num_node_features:]
+        # Both node parts in a single product
+        x_src, x_dest = F.linear(x, torch.cat([w_src, w_dest], dim=0)).chunk(2, dim=1)
+        return x_src, x_dest, F.linear(edge_attr, w_edge, first_layer.bias)
+
+    def forward_nodes(self, x, edge_index, edge_attr):
+        """
+        Same as forward(x[row], x[col], edge_attr), with the first layer factorised per node.
+        """
+        row, col = edge_index
+        x_src, x_dest, edge_term = self.__first_layer_parts(x, edge_attr)
+        return self.edge_mlp[1:](x_src[row] + x_dest[col] + edge_term)
+
 
 class NodeModel(torch.nn.Module):
     def __init__(self, num_node_features, num_edge_features, activation='relu'):
         super(NodeModel, self).__init__()
         self.input_size = num_node_features + num_edge_features
+        self.num_node_features = num_node_features
         dict_activations = {'relu': nn.ReLU(),
                             'elu': nn.ELU(),
                             'tanh': nn.Tanh()}
@@ -142,28 +205,65 @@ class NodeModel(torch.nn.Module):
             nn.Linear(self.input_size, num_node_features),
         )
 
-    def forward(self, x, edge_index, edge_attr, u=None, batch=None):
+    def forward(self, x, edge_index, edge_attr, u=None, batch=None, rowptr=None):
         # x: [N, F_x], where N is the number of nodes.
         # edge_index: [2, E] with max entry N - 1.
         # edge_attr: [E, F_e]
         # u: [B, F_u]
         # batch: [N] with max entry B - 1.
+        # rowptr: [N + 1], only when edges are sorted by destination (see destination_rowptr())
         row, col = edge_index
-        out = torch.cat([x[row], edge_attr], dim=1)
-        out = self.node_mlp_1(out)
-        # Scatter around "col" (destination nodes)
-        out = scatter_mean(out, col, dim=0, dim_size=x.size(0))
+        # First layer of node_mlp_1 over [x[row], edge_attr], with the x part projected once per node
+        x_proj, edge_term = self.__first_layer_parts(x, edge_attr)
+        out = self.node_mlp_1[1:](x_proj[row] + edge_term)
+        # Mean around "col" (destination nodes), over contiguous segments when sorted
+        if rowptr is not None:
+            out = segment_csr(out, rowptr, reduce='mean')
+        else:
+            out = scatter_mean(out, col, dim=0, dim_size=x.size(0))
         # Concatenate X with transformed representation given the source nodes with edge's messages
         out = torch.cat([x, out], dim=1)
         return self.node_mlp_2(out)
 
+    def __first_layer_parts(self, x, edge_attr):
+        """
+        :return: projection of x ([N, 2(F_x + F_e)]) and of edge_attr with the bias, whose sum is the first layer of
+                 node_mlp_1 over [x, edge_attr]
+        """
+        first_layer = self.node_mlp_1[0]
+        w_node = first_layer.weight[:, :self.num_node_features]
+        w_edge = first_layer.weight[:, self.num_node_features:]
+        return F.linear(x, w_node), F.linear(edge_attr, w_edge, first_layer.bias)
+
+
+class EdgeNodeMetaLayer(MetaLayer):
+    """
+    MetaLayer with EdgeModel/NodeModel, whose first layers are calculated per node and then gathered per edge. The
+    messages of NodeModel are averaged with segment reductions if the edges are sorted by destination.
+    """
+
+    def __init__(self, edge_model: EdgeModel = None, node_model: NodeModel = None):
+        super(EdgeNodeMetaLayer, self).__init__(edge_model=edge_model, node_model=node_model)
+
+    def forward(self, x, edge_index, edge_attr=None, u=None, batch=None, in_degree=None):
+        """
+        :param in_degree: number of edges arriving at each node, when edges are sorted by destination (data.in_degree)
+        """
+        if self.edge_model is not None:
+            edge_attr = self.edge_model.forward_nodes(x, edge_index, edge_attr)
+        if self.node_model is not None:
+            rowptr = destination_rowptr(edge_index, x.size(0), in_degree)
+            x = self.node_model(x, edge_index, edge_attr, u, batch, rowptr=rowptr)
+        return x, edge_attr, u
+
 
 class SpatioTemporalModel(nn.Module):
     def __init__(self, num_time_length: int, dropout_perc: float, pooling: PoolingStrategy, channels_conv: int,
                  activation: str, conv_strategy: ConvStrategy, sweep_type: SweepType, num_gnn_layers: int = 1,
                  gat_heads: int = 0, multimodal_size: int = 0, temporal_embed_size: int = 16, model_version: str = '70',
                  encoding_strategy: EncodingStrategy = EncodingStrategy.NONE, encoding_model=None,
-                 edge_weights: bool = False, final_sigmoid: bool = True, num_nodes: int = None):
+                 edge_weights: bool = False, final_sigmoid: bool = True, num_nodes: int = None,
+                 cached_encodings: bool = False, encoder_embed_size: int = 50, checkpointed_modules: List[str] = None):
         super(SpatioTemporalModel, self).__init__()
 
         self.VERSION = model_version
@@ -184,6 +284,9 @@ class SpatioTemporalModel(nn.Module):
                                                                             EncodingStrategy.STATS]:
             print('Mismatch on conv_strategy/encoding_strategy')
             exit(-1)
+        if checkpointed_modules and not set(checkpointed_modules).issubset(CHECKPOINTABLE_MODULES):
+            print('Activation checkpointing is only prepared for', CHECKPOINTABLE_MODULES)
+            exit(-1)
 
         self.multimodal_size: int = multimodal_size
         self.TEMPORAL_EMBED_SIZE: int = temporal_embed_size
@@ -195,8 +298,17 @@ class SpatioTemporalModel(nn.Module):
 
         self.encoding_strategy = encoding_strategy
         self.encoder_model = encoding_model
+        # When cached, data.x already has the encoder's output (mean and logvar for VAE) instead of the time series
+        self.cached_encodings: bool = cached_encodings and encoding_strategy in [EncodingStrategy.AE3layers,
+                                                                              EncodingStrategy.VAE3layers]
+        # Node embeddings have the multimodal features in front (see node_embeddings()). Previously the encoder's
+        # EMBED_SIZE alone: the same size for ST_UNIMODAL, so its checkpoints still load, while ST_MULTIMODAL models
+        # with an encoder failed in their first forward pass, so none of them could be saved
         if encoding_model is not None:
-            self.NODE_EMBED_SIZE = self.encoding_model.EMBED_SIZE
+            self.NODE_EMBED_SIZE = self.encoder_model.EMBED_SIZE + self.multimodal_size
+        elif self.cached_encodings:
+            self.NODE_EMBED_SIZE = encoder_embed_size + self.multimodal_size
+        self.encoder_embed_size: int = encoder_embed_size
 
         if self.encoding_strategy == EncodingStrategy.STATS:
             self.stats_lin = nn.Linear(self.TEMPORAL_EMBED_SIZE, self.TEMPORAL_EMBED_SIZE)
@@ -216,6 +328,8 @@ class SpatioTemporalModel(nn.Module):
         self.channels_conv = channels_conv
         self.final_sigmoid = final_sigmoid
         self.sweep_type = sweep_type
+        # Their activations are not kept for the backward pass, but calculated again in it (see __call_module())
+        self.checkpointed_modules: List[str] = [] if checkpointed_modules is None else list(checkpointed_modules)
 
         self.num_time_length = num_time_length
         self.final_feature_size = ceil(self.num_time_length / 2 / 8)
@@ -224,11 +338,14 @@ class SpatioTemporalModel(nn.Module):
         self.num_gnn_layers = num_gnn_layers
         self.gat_heads = gat_heads
         if self.sweep_type == SweepType.GCN:
+            # Edge weights are normalised beforehand, once for both layers (see __gcn_inputs())
             self.gnn_conv1 = GCNConv(self.NODE_EMBED_SIZE,
-                                     self.NODE_EMBED_SIZE)
+                                     self.NODE_EMBED_SIZE,
+                                     normalize=False)
             if self.num_gnn_layers == 2:
                 self.gnn_conv2 = GCNConv(self.NODE_EMBED_SIZE,
-                                         self.NODE_EMBED_SIZE)
+                                         self.NODE_EMBED_SIZE,
+                                         normalize=False)
         elif self.sweep_type == SweepType.GAT:
             self.gnn_conv1 = GATConv(self.NODE_EMBED_SIZE,
                                      self.NODE_EMBED_SIZE,
@@ -242,16 +359,16 @@ class SpatioTemporalModel(nn.Module):
                                          concat=False,
                                          dropout=dropout_perc)
         elif self.sweep_type == SweepType.META_EDGE_NODE:
-            self.meta_layer = MetaLayer(edge_model=EdgeModel(num_node_features=self.NODE_EMBED_SIZE,
-                                                             num_edge_features=1,
-                                                             activation=activation),
-                                        node_model=NodeModel(num_node_features=self.NODE_EMBED_SIZE,
-                                                             num_edge_features=1,
-                                                             activation=activation))
+            self.meta_layer = EdgeNodeMetaLayer(edge_model=EdgeModel(num_node_features=self.NODE_EMBED_SIZE,
+                                                                     num_edge_features=1,
+                                                                     activation=activation),
+                                                node_model=NodeModel(num_node_features=self.NODE_EMBED_SIZE,
+                                                                     num_edge_features=1,
+                                                                     activation=activation))
         elif self.sweep_type == SweepType.META_NODE:
-            self.meta_layer = MetaLayer(node_model=NodeModel(num_node_features=self.NODE_EMBED_SIZE,
-                                                             num_edge_features=1,
-                                                             activation=activation))
+            self.meta_layer = EdgeNodeMetaLayer(node_model=NodeModel(num_node_features=self.NODE_EMBED_SIZE,
+                                                                     num_edge_features=1,
+                                                                     activation=activation))
 
         if self.conv_strategy == ConvStrategy.TCN_ENTIRE:
             self.size_before_lin_temporal = self.channels_conv * 8 * self.final_feature_size
@@ -302,7 +419,12 @@ class SpatioTemporalModel(nn.Module):
         self.conv1d_3.weight.data.normal_(0, 0.01)
         self.conv1d_4.weight.data.normal_(0, 0.01)
 
-    def forward(self, data):
+    def node_embeddings(self, data, intermediates: Dict[str, torch.Tensor] = None):
+        """
+        Everything in forward() before pooling.
+
+        :return: node embeddings, and edge attributes (changed with META_EDGE_NODE)
+        """
         x, edge_index, edge_attr = data.x, data.edge_index, data.edge_attr
 
         if self.multimodal_size > 0:
@@ -315,7 +437,7 @@ class SpatioTemporalModel(nn.Module):
         # Processing temporal part
         if self.conv_strategy != ConvStrategy.NONE:
             x = x.view(-1, 1, self.num_time_length)
-            x = self.temporal_conv(x)
+            x = self.__call_module('temporal_conv', self.temporal_conv, x)
 
             # Concatenating for the final embedding per node
             x = x.view(-1, self.size_before_lin_temporal)
@@ -328,15 +450,31 @@ class SpatioTemporalModel(nn.Module):
             x = self.stats_batch(x)
             x = F.dropout(x, p=self.dropout, training=self.training)
         elif self.encoding_strategy == EncodingStrategy.VAE3layers:
-            mu, logvar = self.encoder_model.encode(x)
-            x = self.encoder_model.reparameterize(mu, logvar)
-        elif self.encoding_strategy == EncodingStrategy.AE3layers:
+            if self.cached_encodings:
+                mu, logvar = x[:, :self.encoder_embed_size], x[:, self.encoder_embed_size:]
+                # Same as VAE.reparameterize()
+                x = mu + torch.randn_like(logvar) * torch.exp(0.5 * logvar)
+            else:
+                mu, logvar = self.encoder_model.encode(x)
+                x = self.encoder_model.reparameterize(mu, logvar)
+        elif self.encoding_strategy == EncodingStrategy.AE3layers and not self.cached_encodings:
             x = self.encoder_model.encode(x)
+        if intermediates is not None:
+            intermediates['temporal_embeddings'] = x
 
         if self.multimodal_size > 0:
             x = torch.cat((xn, x), dim=1)
 
-        if self.sweep_type in [SweepType.GAT, SweepType.GCN]:
+        if self.sweep_type == SweepType.GCN:
+            gcn_edge_index, gcn_norm = self.__gcn_inputs(data, x.size(0))
+            x = self.gnn_conv1(x, gcn_edge_index, edge_weight=gcn_norm)
+            x = self.activation(x)
+            x = F.dropout(x, training=self.training)
+            if self.num_gnn_layers == 2:
+                x = self.gnn_conv2(x, gcn_edge_index, edge_weight=gcn_norm)
+                x = self.activation(x)
+                x = F.dropout(x, training=self.training)
+        elif self.sweep_type == SweepType.GAT:
             if self.edge_weights:
                 x = self.gnn_conv1(x, edge_index, edge_weight=edge_attr.view(-1))
             else:
@@ -351,17 +489,99 @@ class SpatioTemporalModel(nn.Module):
                 x = self.activation(x)
                 x = F.dropout(x, training=self.training)
         elif self.sweep_type in [SweepType.META_NODE, SweepType.META_EDGE_NODE]:
-            x, edge_attr, _ = self.meta_layer(x, edge_index, edge_attr)
+            in_degree = getattr(data, 'in_degree', None)
+            x, edge_attr = self.__call_module('meta_layer',
+                                              lambda x_, edge_attr_: self.meta_layer(
+                                                  x_, edge_index, edge_attr_, in_degree=in_degree)[:2],
+                                              x, edge_attr)
+        if intermediates is not None:
+            intermediates['node_embeddings'] = x
+
+        return x, edge_attr
+
+    def __call_module(self, name: str, function, *inputs):
+        """
+        function(*inputs), where function runs the submodule name. When training with activation checkpointing for
+        that submodule, its intermediate activations are not kept, and function runs again in the backward pass.
+        """
+        if name not in self.checkpointed_modules or not self.training or not torch.is_grad_enabled():
+            return function(*inputs)
+        module = getattr(self, name)
+
+        def run(_, *checkpoint_inputs):
+            if not torch.is_grad_enabled():
+                return function(*checkpoint_inputs)
+            # Running again in the backward pass, when BatchNorm's running statistics were already updated
+            batch_norms = [m for m in module.modules() if isinstance(m, nn.modules.batchnorm._BatchNorm)]
+            momenta = [batch_norm.momentum for batch_norm in batch_norms]
+            for batch_norm in batch_norms:
+                batch_norm.momentum = 0.0
+            # For StageProfiler, to report this time apart
+            module.recomputing = True
+            try:
+                return function(*checkpoint_inputs)
+            finally:
+                module.recomputing = False
+                for batch_norm, momentum in zip(batch_norms, momenta):
+                    batch_norm.momentum = momentum
+
+        # checkpoint() only calculates the gradients of the parameters when some input requires grad, which is not
+        # the case of data.x
+        requires_grad = inputs[0].new_ones(1).requires_grad_()
+        return checkpoint(run, requires_grad, *inputs)
+
+    def __gcn_inputs(self, data, num_nodes: int):
+        """
+        :return: edge_index and normalised edge weights for the GCNConv layers: data.gcn_norm when the dataset has it
+                 (see BrainDataset.add_gcn_norm()) with the same edge_weights setting as this model, otherwise
+                 calculated here as GCNConv would do
+        """
+        gcn_norm = getattr(data, 'gcn_norm', None)
+        gcn_norm_weighted = getattr(data, 'gcn_norm_weighted', None)
+        if gcn_norm is not None and gcn_norm_weighted is not None and \
+                bool((gcn_norm_weighted == self.edge_weights).all()):
+            return data.edge_index, gcn_norm
+        edge_weight = data.edge_attr.view(-1) if self.edge_weights else None
+        return GCNConv.norm(data.edge_index, num_nodes, edge_weight, dtype=data.x.dtype)
+
+    def __dense_inputs(self, x, edge_index, edge_attr, batch):
+        adj_tmp = pyg_utils.to_dense_adj(edge_index, batch, edge_attr=edge_attr)
+        if edge_attr is not None:  # Because edge_attr only has 1 feature per edge
+            adj_tmp = adj_tmp[:, :, :, 0]
+        x_tmp, batch_mask = pyg_utils.to_dense_batch(x, batch)
+        return x_tmp, adj_tmp, batch_mask
+
+    def diffpool_assignments(self, data):
+        """
+        Soft assignment of each node to the clusters of the first DiffPool layer, for interpretation.
+
+        :return: assignments (batch_size x max_num_nodes x num_clusters) and the mask of the nodes in each graph
+        """
+        _, intermediates = self(data, return_intermediates=True)
+        return intermediates['diffpool_assignments1'], intermediates['node_mask']
+
+    def forward(self, data, return_intermediates: bool = False):
+        """
+        :param return_intermediates: also returns a dictionary with intermediate representations (with one row per
+            node or per graph, as in INTERMEDIATE_ROWS): temporal_embeddings and node_embeddings (before and after the
+            GNN part), node_mask, diffpool_assignments1 and diffpool_assignments2 (only with DiffPool), and
+            graph_embeddings (input of the final linear layer)
+        """
+        intermediates = {} if return_intermediates else None
+        x, edge_attr = self.node_embeddings(data, intermediates)
+        edge_index = data.edge_index
 
         if self.pooling == PoolingStrategy.MEAN:
             x = global_mean_pool(x, data.batch)
         elif self.pooling == PoolingStrategy.DIFFPOOL:
-            adj_tmp = pyg_utils.to_dense_adj(edge_index, data.batch, edge_attr=edge_attr)
-            if edge_attr is not None: # Because edge_attr only has 1 feature per edge
-                adj_tmp = adj_tmp[:, :, :, 0]
-            x_tmp, batch_mask = pyg_utils.to_dense_batch(x, data.batch)
-
-            x, link_loss, ent_loss = self.diff_pool(x_tmp, adj_tmp, batch_mask)
+            x_tmp, adj_tmp, batch_mask = self.__dense_inputs(x, edge_index, edge_attr, data.batch)
+            if return_intermediates:
+                intermediates['node_mask'] = batch_mask
+
+            x, link_loss, ent_loss = self.__call_module('diff_pool',
+                                                        lambda x_, adj_, mask_: self.diff_pool(x_, adj_, mask_,
+                                                                                               intermediates),
+                                                        x_tmp, adj_tmp, batch_mask)
             x = F.dropout(x, p=self.dropout, training=self.training)
             x = self.activation(self.pre_final_linear(x))
         elif self.pooling == PoolingStrategy.CONCAT:
@@ -370,13 +590,19 @@ class SpatioTemporalModel(nn.Module):
             x = self.activation(self.pre_final_linear(x))
 
         x = F.dropout(x, p=self.dropout, training=self.training)
+        if return_intermediates:
+            intermediates['graph_embeddings'] = x
         x = self.final_linear(x)
 
         if self.final_sigmoid:
-            return torch.sigmoid(x) if self.pooling != PoolingStrategy.DIFFPOOL else (
+            output = torch.sigmoid(x) if self.pooling != PoolingStrategy.DIFFPOOL else (
                 torch.sigmoid(x), link_loss, ent_loss)
         else:
-            return x if self.pooling != PoolingStrategy.DIFFPOOL else (x, link_loss, ent_loss)
+            output = x if self.pooling != PoolingStrategy.DIFFPOOL else (x, link_loss, ent_loss)
+
+        if return_intermediates:
+            return output, intermediates
+        return output
 
     def to_string_name(self):
         model_vars = ['V_' + self.VERSION,
@@ -397,3 +623,23 @@ class SpatioTemporalModel(nn.Module):
                       ]
 
         return ''.join(model_vars)
+
+    def to_config(self) -> Dict[str, Any]:
+        """
+        Same values as to_string_name(), used to address checkpoints in CheckpointStore.
+        """
+        return {'model_version': self.VERSION,
+                'time_length': self.num_time_length,
+                'dropout': self.dropout,
+                'activation': self.activation_str,
+                'pooling': self.pooling,
+                'conv_strategy': self.conv_strategy,
+                'channels_conv': self.channels_conv,
+                'final_sigmoid': self.final_sigmoid,
+                'sweep_type': self.sweep_type,
+                'edge_weights': self.edge_weights,
+                'gat_heads': self.gat_heads,
+                'num_gnn_layers': self.num_gnn_layers,
+                'encoding_strategy': self.encoding_strategy,
+                'multimodal_size': self.multimodal_size,
+                'temporal_embed_size': self.TEMPORAL_EMBED_SIZE}
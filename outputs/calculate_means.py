@@ -1,128 +1,136 @@
-
-import numpy as np
-
-dict_results = {
-  'dummy to copy' : {'aucs': [0., 0., 0., 0., 0.],
-                   'sens': [0., 0., 0., 0., 0.],
-                   'spec': [0., 0., 0., 0., 0.]},
-
-  'ukb xgboost' : {'aucs': [0.8835, 0.8755, 0.8850, 0.8911, 0.8795],
-                   'sens': [0.8932, 0.8725, 0.8780, 0.8816, 0.8871],
-                   'spec': [0.8737, 0.8786, 0.8920, 0.9005, 0.8719]},
-
-  'concat without gcn' : {'aucs': [0.7595, 0.6832, 0.6945, 0.7485, 0.7289],
-                   'sens': [0.9202, 0.5771, 0.6170, 0.7181, 0.7984],
-                   'spec': [0.3820, 0.6800, 0.6497, 0.6197, 0.4973]},
-
-  'concat with 5% gcn' : {'aucs': [0.7513, 0.6629, 0.6863, 0.7523, 0.7124],
-                   'sens': [0.6995, 0.6037, 0.7394, 0.7207, 0.6989],
-                   'spec': [0.6207, 0.6400, 0.5455, 0.6649, 0.5802]},
-
-  'concat with 20% gcn' : {'aucs': [0.7520, 0.6502, 0.6827, 0.7638, 0.7037],
-                   'sens': [0.7580, 0.5984, 0.5612, 0.7314, 0.6586],
-                   'spec': [0.5995, 0.6213, 0.6952, 0.6516, 0.6471]},
-
-  'xgboost binarised 5' : {'aucs': [0.6600, 0.7217, 0.6706, 0.7114, 0.6757],
-                   	  'sens': [0.6622, 0.7447, 0.6888, 0.6968, 0.7070],
-                  	  'spec': [0.6578, 0.6987, 0.6524, 0.7261, 0.6444]},
-  'xgboost binarised 20' : {'aucs': [0.7370, 0.7243, 0.7067, 0.7247, 0.7064],
-                   	  'sens': [0.7287, 0.7473, 0.6968, 0.6782, 0.7070],
-                   	  'spec': [0.7454, 0.7013, 0.7166, 0.7713, 0.7059]},
-                   
-  'mean_TCN_GCN5' : {'aucs': [0.6920, 0.6349, 0.5968, 0.7117, 0.6074],
-                   'sens': [1.0000, 1.0000, 0.0000, 0.8537, 1.0000],
-                   'spec': [0.0000, 0.0027, 1.0000, 0.3777, 0.0000]},
-                   
-  'mean_TCN' : {'aucs': [0.6928, 0.6169, 0.6612, 0.7520, 0.6453],
-                   'sens': [0.7287, 0.9973, 0.6064, 0.4601, 0.0000],
-                   'spec': [0.5438, 0.0160, 0.6364, 0.8723, 1.0000]},
-                   
-  'mean_CNN_64split+' : {'aucs': [0.6483, 0.6442, 0.6534, 0.6842, 0.6233],
-                   'sens': [0.6690, 0.6471, 0.5296, 0.6418, 0.6964],
-                   'spec': [0.5463, 0.5519, 0.6791, 0.6250, 0.4898]},
-                   
-  'mean_CNN_64split' : {'aucs': [0.6426, 0.6404, 0.6394, 0.6885, 0.6206],
-                   'sens': [0.6815, 0.6277, 0.5136, 0.6511, 0.6252],
-                   'spec': [0.5167, 0.5712, 0.6749, 0.6219, 0.5500]},
-
-  'AUC xgboost 64plit' : {'aucs': [0.6971, 0.6947, 0.6877, 0.6814, 0.6873],
-                   'sens': [0.6867, 0.6780, 0.6672, 0.6795, 0.6788],
-                   'spec': [0.7075, 0.7114, 0.7081, 0.6832, 0.6959]},
-
-  'AUC xgboost4plit' : {'aucs': [0.7875, 0.7723, 0.7853, 0.7859, 0.7950],
-                   'accs': [0.7875, 0.7723, 0.7853, 0.7859, 0.7949],
-                   'sens': [0.7686, 0.7899, 0.7819, 0.7660, 0.8118],
-                   'spec': [0.8064, 0.7547, 0.7888, 0.8059, 0.7781]},
-   ############
-  'AUC diff_pool 5' : {'aucs': [0.6752, 0.6335, 0.6529, 0.6993, 0.6767],
-                       'accs': [0.6016, 0.6005, 0.6147, 0.6184, 0.6327],
-                       'f1s' : [0.6842, 0.6386, 0.6980, 0.6911, 0.6675]},
-                       
-  'AUC diff_pool 20' : {'aucs': [0.6576, 0.6453, 0.6744, 0.7378, 0.6735],
-                        'accs': [0.6255, 0.6165, 0.6400, 0.6343, 0.6434],
-                        'f1s' : [0.7044, 0.6697, 0.6438, 0.7046, 0.6463]},
-                        
-  'AUC mean 5' :  {'aucs': [0.6782, 0.6404, 0.6872, 0.7488, 0.7032],
-                   'accs': [0.5007, 0.5819, 0.5947, 0.6622, 0.6180],
-                   'f1s' : [0.0000, 0.5527, 0.4967, 0.6947, 0.4956]},
-                   
-  'AUC mean 20' : {'aucs': [0.6787, 0.6404, 0.6873, 0.7490, 0.7021],
-                   'accs': [0.5007, 0.5819, 0.5693, 0.6622, 0.6072],
-                   'f1s' : [0.0000, 0.5527, 0.3501, 0.6947, 0.4564]},
-                   
-  'Loss diff_pool 5' : {'aucs': [0.5045, 0.5039, 0.6614, 0.5159, 0.6733],
-                       'accs': [0.5007, 0.5007, 0.6227, 0.5000, 0.6206],
-                       'f1s' : [0.0000, 0.6673, 0.6907, 0.6667, 0.6698]},
-                       
-  'Loss diff_pool 20' : {'aucs': [0.6915, 0.6444, 0.6722, 0.5247, 0.4919],
-                        'accs': [0.6255, 0.6192, 0.6173, 0.5000, 0.4987],
-                        'f1s' : [0.6853, 0.6324, 0.6530, 0.0000, 0.6655]},
-                        
-  'Loss mean 5' :  {'aucs': [0.6895, 0.6388, 0.6871, 0.7488, 0.6807],
-                   'accs': [0.6321, 0.5925, 0.6267, 0.6622, 0.6059],
-                   'f1s' : [0.6126, 0.5785, 0.6143, 0.6947, 0.6142]},
-                   
-  'Loss mean 20' : {'aucs': [0.6895, 0.6388, 0.6871, 0.7490, 0.6807],
-                   'accs': [0.6321, 0.5925, 0.6267, 0.6622, 0.6059],
-                   'f1s' : [0.6126, 0.5785, 0.6143, 0.6947, 0.6202]},
-                   
-   ############
-  'GCN AUC diff_pool 5' : {'aucs': [0.6097, 0.6304, 0.6719, 0.7066, 0.6454],
-                       'accs': [0.4993, 0.6178, 0.5013, 0.6449, 0.6005],
-                       'f1s' : [0., 0., 0., 0., 0.]},
-                       
-  'GCN AUC diff_pool 20' : {'aucs': [0.6367, 0.6383, 0.6703, 0.6999, 0.6736],
-                        'accs': [0.4993, 0.6152, 0.6293, 0.6609, 0.6247],
-                        'f1s' : [0., 0., 0., 0., 0.]},
-                        
-  'GCN AUC mean 5' :  {'aucs': [0.7266, 0.6478, 0.6832, 0.7682, 0.6887],
-                   'accs': [0.4993, 0.5007, 0.6187, 0.6742, 0.5697],
-                   'f1s' : [0., 0., 0., 0., 0.]},
-                   
-  'GCN AUC mean 20' : {'aucs': [0.6778, 0.6506, 0.6706, 0.7282, 0.6904],
-                   'accs': [0.6361, 0.6232, 0.5013, 0.5000, 0.6099],
-                   'f1s' : [0., 0., 0., 0., 0.]},
-                   
-  'GCN Loss diff_pool 5' : {'aucs': [0.5055, 0.4938, 0.6230, 0.5902, 0.4557],
-                       'accs': [0.4993, 0.4993, 0.5013, 0.5066, 0.4987],
-                       'f1s' : [0., 0., 0., 0., 0.]},
-                       
-  'GCN Loss diff_pool 20' : {'aucs': [0.5159, 0.6256, 0.6658, 0.4174, 0.4065],
-                        'accs': [0.5060, 0.5925, 0.6320, 0.4814, 0.5013],
-                        'f1s' : [0., 0., 0., 0., 0.]},
-                        
-  'GCN Loss mean 5' :  {'aucs': [0.7206, 0.6477, 0.6855, 0.7581, 0.6935],
-                   'accs': [0.6640, 0.5925, 0.6280, 0.6862, 0.6287],
-                   'f1s' : [0., 0., 0., 0., 0.]},
-                   
-  'GCN Loss mean 20' : {'aucs': [0.7216, 0.6460, 0.6840, 0.7588, 0.6897],
-                   'accs': [0.6521, 0.5939, 0.6320, 0.6902, 0.6247],
-                   'f1s' : [0., 0., 0., 0., 0.]}
-}
-
-
-for key, value in dict_results.items():
-    print(key, ":")
-    for metric, values in value.items():
-        print(metric, ":", round(np.mean(values), 3), "(", round(np.std(values), 3), ")")
-    print()
+import argparse
+
+from results_warehouse import ResultsWarehouse, RESULTS_PATH
+
+# Results written by hand before the ResultsWarehouse, imported into it with --import_legacy
+dict_results = {
+  'ukb xgboost' : {'aucs': [0.8835, 0.8755, 0.8850, 0.8911, 0.8795],
+                   'sens': [0.8932, 0.8725, 0.8780, 0.8816, 0.8871],
+                   'spec': [0.8737, 0.8786, 0.8920, 0.9005, 0.8719]},
+
+  'concat without gcn' : {'aucs': [0.7595, 0.6832, 0.6945, 0.7485, 0.7289],
+                   'sens': [0.9202, 0.5771, 0.6170, 0.7181, 0.7984],
+                   'spec': [0.3820, 0.6800, 0.6497, 0.6197, 0.4973]},
+
+  'concat with 5% gcn' : {'aucs': [0.7513, 0.6629, 0.6863, 0.7523, 0.7124],
+                   'sens': [0.6995, 0.6037, 0.7394, 0.7207, 0.6989],
+                   'spec': [0.6207, 0.6400, 0.5455, 0.6649, 0.5802]},
+
+  'concat with 20% gcn' : {'aucs': [0.7520, 0.6502, 0.6827, 0.7638, 0.7037],
+                   'sens': [0.7580, 0.5984, 0.5612, 0.7314, 0.6586],
+                   'spec': [0.5995, 0.6213, 0.6952, 0.6516, 0.6471]},
+
+  'xgboost binarised 5' : {'aucs': [0.6600, 0.7217, 0.6706, 0.7114, 0.6757],
+                   	  'sens': [0.6622, 0.7447, 0.6888, 0.6968, 0.7070],
+                  	  'spec': [0.6578, 0.6987, 0.6524, 0.7261, 0.6444]},
+  'xgboost binarised 20' : {'aucs': [0.7370, 0.7243, 0.7067, 0.7247, 0.7064],
+                   	  'sens': [0.7287, 0.7473, 0.6968, 0.6782, 0.7070],
+                   	  'spec': [0.7454, 0.7013, 0.7166, 0.7713, 0.7059]},
+                   
+  'mean_TCN_GCN5' : {'aucs': [0.6920, 0.6349, 0.5968, 0.7117, 0.6074],
+                   'sens': [1.0000, 1.0000, 0.0000, 0.8537, 1.0000],
+                   'spec': [0.0000, 0.0027, 1.0000, 0.3777, 0.0000]},
+                   
+  'mean_TCN' : {'aucs': [0.6928, 0.6169, 0.6612, 0.7520, 0.6453],
+                   'sens': [0.7287, 0.9973, 0.6064, 0.4601, 0.0000],
+                   'spec': [0.5438, 0.0160, 0.6364, 0.8723, 1.0000]},
+                   
+  'mean_CNN_64split+' : {'aucs': [0.6483, 0.6442, 0.6534, 0.6842, 0.6233],
+                   'sens': [0.6690, 0.6471, 0.5296, 0.6418, 0.6964],
+                   'spec': [0.5463, 0.5519, 0.6791, 0.6250, 0.4898]},
+                   
+  'mean_CNN_64split' : {'aucs': [0.6426, 0.6404, 0.6394, 0.6885, 0.6206],
+                   'sens': [0.6815, 0.6277, 0.5136, 0.6511, 0.6252],
+                   'spec': [0.5167, 0.5712, 0.6749, 0.6219, 0.5500]},
+
+  'AUC xgboost 64plit' : {'aucs': [0.6971, 0.6947, 0.6877, 0.6814, 0.6873],
+                   'sens': [0.6867, 0.6780, 0.6672, 0.6795, 0.6788],
+                   'spec': [0.7075, 0.7114, 0.7081, 0.6832, 0.6959]},
+
+  'AUC xgboost4plit' : {'aucs': [0.7875, 0.7723, 0.7853, 0.7859, 0.7950],
+                   'accs': [0.7875, 0.7723, 0.7853, 0.7859, 0.7949],
+                   'sens': [0.7686, 0.7899, 0.7819, 0.7660, 0.8118],
+                   'spec': [0.8064, 0.7547, 0.7888, 0.8059, 0.7781]},
+   ############
+  'AUC diff_pool 5' : {'aucs': [0.6752, 0.6335, 0.6529, 0.6993, 0.6767],
+                       'accs': [0.6016, 0.6005, 0.6147, 0.6184, 0.6327],
+                       'f1s' : [0.6842, 0.6386, 0.6980, 0.6911, 0.6675]},
+                       
+  'AUC diff_pool 20' : {'aucs': [0.6576, 0.6453, 0.6744, 0.7378, 0.6735],
+                        'accs': [0.6255, 0.6165, 0.6400, 0.6343, 0.6434],
+                        'f1s' : [0.7044, 0.6697, 0.6438, 0.7046, 0.6463]},
+                        
+  'AUC mean 5' :  {'aucs': [0.6782, 0.6404, 0.6872, 0.7488, 0.7032],
+                   'accs': [0.5007, 0.5819, 0.5947, 0.6622, 0.6180],
+                   'f1s' : [0.0000, 0.5527, 0.4967, 0.6947, 0.4956]},
+                   
+  'AUC mean 20' : {'aucs': [0.6787, 0.6404, 0.6873, 0.7490, 0.7021],
+                   'accs': [0.5007, 0.5819, 0.5693, 0.6622, 0.6072],
+                   'f1s' : [0.0000, 0.5527, 0.3501, 0.6947, 0.4564]},
+                   
+  'Loss diff_pool 5' : {'aucs': [0.5045, 0.5039, 0.6614, 0.5159, 0.6733],
+                       'accs': [0.5007, 0.5007, 0.6227, 0.5000, 0.6206],
+                       'f1s' : [0.0000, 0.6673, 0.6907, 0.6667, 0.6698]},
+                       
+  'Loss diff_pool 20' : {'aucs': [0.6915, 0.6444, 0.6722, 0.5247, 0.4919],
+                        'accs': [0.6255, 0.6192, 0.6173, 0.5000, 0.4987],
+                        'f1s' : [0.6853, 0.6324, 0.6530, 0.0000, 0.6655]},
+                        
+  'Loss mean 5' :  {'aucs': [0.6895, 0.6388, 0.6871, 0.7488, 0.6807],
+                   'accs': [0.6321, 0.5925, 0.6267, 0.6622, 0.6059],
+                   'f1s' : [0.6126, 0.5785, 0.6143, 0.6947, 0.6142]},
+                   
+  'Loss mean 20' : {'aucs': [0.6895, 0.6388, 0.6871, 0.7490, 0.6807],
+                   'accs': [0.6321, 0.5925, 0.6267, 0.6622, 0.6059],
+                   'f1s' : [0.6126, 0.5785, 0.6143, 0.6947, 0.6202]},
+                   
+   ############
+  'GCN AUC diff_pool 5' : {'aucs': [0.6097, 0.6304, 0.6719, 0.7066, 0.6454],
+                       'accs': [0.4993, 0.6178, 0.5013, 0.6449, 0.6005],
+                       'f1s' : [0., 0., 0., 0., 0.]},
+                       
+  'GCN AUC diff_pool 20' : {'aucs': [0.6367, 0.6383, 0.6703, 0.6999, 0.6736],
+                        'accs': [0.4993, 0.6152, 0.6293, 0.6609, 0.6247],
+                        'f1s' : [0., 0., 0., 0., 0.]},
+                        
+  'GCN AUC mean 5' :  {'aucs': [0.7266, 0.6478, 0.6832, 0.7682, 0.6887],
+                   'accs': [0.4993, 0.5007, 0.6187, 0.6742, 0.5697],
+                   'f1s' : [0., 0., 0., 0., 0.]},
+                   
+  'GCN AUC mean 20' : {'aucs': [0.6778, 0.6506, 0.6706, 0.7282, 0.6904],
+                   'accs': [0.6361, 0.6232, 0.5013, 0.5000, 0.6099],
+                   'f1s' : [0., 0., 0., 0., 0.]},
+                   
+  'GCN Loss diff_pool 5' : {'aucs': [0.5055, 0.4938, 0.6230, 0.5902, 0.4557],
+                       'accs': [0.4993, 0.4993, 0.5013, 0.5066, 0.4987],
+                       'f1s' : [0., 0., 0., 0., 0.]},
+                       
+  'GCN Loss diff_pool 20' : {'aucs': [0.5159, 0.6256, 0.6658, 0.4174, 0.4065],
+                        'accs': [0.5060, 0.5925, 0.6320, 0.4814, 0.5013],
+                        'f1s' : [0., 0., 0., 0., 0.]},
+                        
+  'GCN Loss mean 5' :  {'aucs': [0.7206, 0.6477, 0.6855, 0.7581, 0.6935],
+                   'accs': [0.6640, 0.5925, 0.6280, 0.6862, 0.6287],
+                   'f1s' : [0., 0., 0., 0., 0.]},
+                   
+  'GCN Loss mean 20' : {'aucs': [0.7216, 0.6460, 0.6840, 0.7588, 0.6897],
+                   'accs': [0.6521, 0.5939, 0.6320, 0.6902, 0.6247],
+                   'f1s' : [0., 0., 0., 0., 0.]}
+}
+
+
+if __name__ == '__main__':
+    # New runs are saved in the warehouse by main_loop, e.g. --group_by sweep_type param_pooling param_threshold
+    parser = argparse.ArgumentParser(description='Mean (std) over the folds of each group of runs')
+    parser.add_argument('--db_path', default=RESULTS_PATH)
+    parser.add_argument('--group_by', nargs='+', default=['model_name'])
+    parser.add_argument('--metrics', nargs='+', default=['auc', 'acc', 'f1', 'sensitivity', 'specificity'])
+    parser.add_argument('--split', default='test', choices=['test', 'val'])
+    parser.add_argument('--import_legacy', action='store_true')
+    args = parser.parse_args()
+
+    warehouse = ResultsWarehouse(args.db_path)
+    if args.import_legacy:
+        for model_name, results in dict_results.items():
+            warehouse.import_fold_results(model_name, results)
+    print(warehouse.summary_table(args.metrics, args.group_by, split=args.split).to_string())
@@ -0,0 +1,31 @@
+import torch
+
+
+def binarise_assignments(s: torch.Tensor, threshold: float = 0.5, mask: torch.Tensor = None) -> torch.Tensor:
+    """
+    :param s: soft assignments (batch_size x num_nodes x num_clusters), e.g. from model.diffpool_assignments()
+    :param mask: nodes that exist in each graph (batch_size x num_nodes)
+    :return: 1 where a node is assigned to a cluster with a probability above threshold, 0 otherwise
+    """
+    assignments = (s > threshold).float()
+    if mask is not None:
+        assignments = assignments * mask.unsqueeze(-1).float()
+    return assignments
+
+
+def coassignment_counts(s: torch.Tensor, groups: torch.Tensor, num_groups: int, threshold: float = 0.5,
+                        mask: torch.Tensor = None) -> torch.Tensor:
+    """
+    Number of graphs of each group in which each pair of nodes is assigned to the same cluster.
+
+    For one graph with binarised assignments B (num_nodes x num_clusters), B.B^T has a 1 in (i, j) when i and j share
+    a cluster. This is summed over the graphs of each group with a single einsum, and only the upper triangle is kept
+    (i < j), as when counting each pair of nodes once.
+
+    :param groups: group of each graph in the batch (e.g. data.y for sex)
+    :return: counts (num_groups x num_nodes x num_nodes), to be accumulated over batches
+    """
+    assignments = binarise_assignments(s, threshold, mask)
+    group_one_hot = torch.nn.functional.one_hot(groups.long().view(-1), num_groups).to(assignments.dtype)
+    counts = torch.einsum('bg,bnc,bmc->gnm', group_one_hot, assignments, assignments)
+    return torch.triu(counts, diagonal=1)
@@ -1,14 +1,12 @@
 import numpy as np
 import torch
-import torch_geometric.utils as pyg_utils
-import wandb
 from torch_geometric.data import DataLoader
 
 from datasets import BrainDataset
 from main_loop import generate_dataset, create_fold_generator, generate_st_model
 from model import SpatioTemporalModel
-from utils import Normalisation, ConnType, DatasetType, \
-    AnalysisType, EncodingStrategy, ConvStrategy, PoolingStrategy, SweepType, create_name_for_model, change_w_config_
+from post_analysis.diffpool_analysis import coassignment_counts
+from run_registry import RunRegistry
 
 DEVICE_RUN = 'cuda'
 
@@ -25,6 +23,7 @@ best_runs = {
                          4: {'run_id': 's1nhqmnj'}}
 }
 
+registry = RunRegistry()
 for model_type, runs_all in best_runs.items():
     print('----', model_type)
     clusters = {
@@ -38,19 +37,9 @@ for model_type, runs_all in best_runs.items():
 
     for fold_num, run_info in runs_all.items():
         run_id = run_info['run_id']
-        api = wandb.Api()
-        best_run = api.run(f'/st-team/spatio-temporal-brain/runs/{run_id}')
-        w_config = best_run.config
-
-        change_w_config_(w_config)
-
+        run = registry.get_or_import(run_id, overrides=run_info)
+        w_config = run['run_cfg']
         w_config['device_run'] = DEVICE_RUN
-        if 'lr' in run_info.keys():
-            w_config['param_lr'] = float(run_info['lr'])
-        if 'dropout' in run_info.keys():
-            w_config['param_dropout'] = float(run_info['dropout'])
-        if 'weight_d' in run_info.keys():
-            w_config['param_weight_decay'] = float(run_info['weight_d'])
 
         dataset: BrainDataset = generate_dataset(w_config)
 
@@ -64,39 +53,15 @@ for model_type, runs_all in best_runs.items():
         for train_index, test_index in skf_outer_generator:
             outer_split_num += 1
             # Only run for the specific fold defined in the script arguments.
-            if outer_split_num != w_config['fold_num']:
+            if outer_split_num != w_config['split_to_test']:
                 continue
 
             X_test_out = dataset[torch.tensor(test_index)]
 
             break
 
-        inner_fold_for_val: int = 1
         model: SpatioTemporalModel = generate_st_model(w_config, for_test=True)
-        if 'model_v' in run_info.keys():
-            model.VERSION = run_info['model_v']
-        model_saving_path: str = create_name_for_model(target_var=w_config['target_var'],
-                                                       model=model,
-                                                       outer_split_num=w_config['fold_num'],
-                                                       inner_split_num=inner_fold_for_val,
-                                                       n_epochs=w_config['num_epochs'],
-                                                       threshold=w_config['threshold'],
-                                                       batch_size=w_config['batch_size'],
-                                                       num_nodes=w_config['num_nodes'],
-                                                       conn_type=w_config['param_conn_type'],
-                                                       normalisation=w_config['param_normalisation'],
-                                                       analysis_type=w_config['analysis_type'],
-                                                       metric_evaluated='loss',
-                                                       dataset_type=w_config['dataset_type'],
-                                                       lr=w_config['param_lr'],
-                                                       weight_decay=w_config['param_weight_decay'],
-                                                       edge_weights=w_config['edge_weights'])
-        if 'model_v' in run_info.keys():
-            # We know the very specific "old" cases
-            if w_config['param_pooling'] == PoolingStrategy.DIFFPOOL:
-                model_saving_path = model_saving_path.replace('T_difW_F', 'GC_FGA_F')
-            elif w_config['param_pooling'] == PoolingStrategy.MEAN:
-                model_saving_path = model_saving_path.replace('T_no_W_F', 'GC_FGA_F')
+        model_saving_path: str = run['checkpoint_path']
         model.load_state_dict(torch.load(model_saving_path, map_location=w_config['device_run']))
         model.eval()
 
@@ -104,65 +69,16 @@ for model_type, runs_all in best_runs.items():
         # needs cast to int() because of higher precision when reading the csv
         test_out_loader = DataLoader(X_test_out, batch_size=400, shuffle=False)
 
-        # TODO: change forward() function in model for this to be more straightforward instead of copying
-        NEW_MAX_NODES = 17
         for data in test_out_loader:
             print('.', end='')
             with torch.no_grad():
                 data = data.to(DEVICE_RUN)
-                x, edge_index, edge_attr = data.x, data.edge_index, data.edge_attr
-                if model.multimodal_size > 0:
-                    xn, x = x[:, :model.multimodal_size], x[:, model.multimodal_size:]
-                    xn = model.multimodal_lin(xn)
-                    xn = model.activation(xn)
-                    xn = model.multimodal_batch(xn)
-                    # xn = F.dropout(xn, p=self.dropout, training=self.training)
-
-                # Processing temporal part
-                if model.conv_strategy != ConvStrategy.NONE:
-                    x = x.view(-1, 1, model.num_time_length)
-                    x = model.temporal_conv(x)
-
-                    # Concatenating for the final embedding per node
-                    x = x.view(-1, model.size_before_lin_temporal)
-                    x = model.lin_temporal(x)
-                    x = model.activation(x)
-                elif model.encoding_strategy == EncodingStrategy.STATS:
-                    x = model.stats_lin(x)
-                    x = model.activation(x)
-                    x = model.stats_batch(x)
-
-                if model.multimodal_size > 0:
-                    x = torch.cat((xn, x), dim=1)
-
-                if model.sweep_type in [SweepType.META_NODE, SweepType.META_EDGE_NODE]:
-                    x, edge_attr, _ = model.meta_layer(x, edge_index, edge_attr)
-                # print("Try 2")
-                adj_tmp = pyg_utils.to_dense_adj(edge_index, data.batch, edge_attr=edge_attr)
-                if edge_attr is not None:  # Because edge_attr only has 1 feature per edge
-                    adj_tmp = adj_tmp[:, :, :, 0]
-                x_tmp, batch_mask = pyg_utils.to_dense_batch(x, data.batch)
-                # x, link_loss, ent_loss = model.diff_pool(x_tmp, adj_tmp, batch_mask)
-                # print("Try 2")
-                s = model.diff_pool.gnn1_pool(x_tmp, adj_tmp, batch_mask)
-                s = s.unsqueeze(0) if s.dim() == 2 else s
-                s = torch.softmax(s, dim=-1)
-
-                # Going over each assigment matrix of the batch
-                # TODO: stupidly slow, I needa optimise this, shouldn't never have done this this way
-                for batch_i in range(s.shape[0]):
-                    sex_info = data.y[batch_i].item()
-                    total_amount[sex_info] += 1
-                    for col in range(NEW_MAX_NODES):
-                        matches = (s[batch_i][:, col] > 0.5).nonzero()
-                        # Going over each match
-                        for elem_i in range(matches.shape[0]):
-                            for elem_j in range(elem_i + 1, matches.shape[0]):
-                                clusters[sex_info][matches[elem_i].item(), matches[elem_j].item()] += 1
-                                # print(matches[elem_i].item(), matches[elem_j].item())
-                # break
-                # np.save(f'diffpool_interp/s2_tmp{in_index}.npy', s.detach().cpu().numpy())
-                # in_index += 1
+                s, batch_mask = model.diffpool_assignments(data)
+                groups = data.y.long()
+                clusters_batch = coassignment_counts(s, groups, num_groups=2, threshold=0.5, mask=batch_mask)
+                for sex_info in [0, 1]:
+                    clusters[sex_info] += clusters_batch[sex_info]
+                    total_amount[sex_info] += (groups == sex_info).sum().item()
         print()
 
     np.save(f'results/dp_interp_{model_type}_male.npy', clusters[1].cpu().numpy())
@@ -0,0 +1,58 @@
+import os
+from typing import Dict, List
+
+import numpy as np
+import torch
+from torch_geometric.data import DataLoader
+
+from model import INTERMEDIATE_ROWS, SpatioTemporalModel
+
+
+def export_intermediates(model: SpatioTemporalModel, dataset, output_dir: str, device: str = 'cpu',
+                         batch_size: int = 400, keys: List[str] = None) -> Dict[str, np.ndarray]:
+    """
+    Runs the model once over the dataset (e.g. X_test_out) and writes its intermediate representations (see
+    SpatioTemporalModel.forward()) to .npy files in output_dir, as memory-mapped arrays filled batch by batch. The
+    labels of the graphs are saved in y.npy.
+
+    Arrays with one row per graph (see model.INTERMEDIATE_ROWS) have len(dataset) rows, and the ones with one row per
+    node have one row for each node of each graph, in the order of the dataset.
+
+    :param keys: intermediate representations to save (all by default)
+    :return: the arrays, opened again in read-only mode
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    model.eval()
+    loader = DataLoader(dataset, batch_size=batch_size, shuffle=False)
+
+    # Nodes of the graphs in dataset, which might be a subset of the whole dataset
+    node_slices = dataset.slices['x']
+    num_total_nodes = int((node_slices[1:] - node_slices[:-1])[torch.tensor(list(dataset.indices()))].sum())
+    rows = dict(INTERMEDIATE_ROWS, y='graph')
+
+    arrays: Dict[str, np.ndarray] = {}
+    graph_offset, node_offset = 0, 0
+    for data in loader:
+        with torch.no_grad():
+            data = data.to(device)
+            _, intermediates = model(data, return_intermediates=True)
+        intermediates['y'] = data.y
+        if keys is not None:
+            intermediates = {key: value for key, value in intermediates.items() if key in keys + ['y']}
+
+        for key, tensor in intermediates.items():
+            values = tensor.detach().float().cpu().numpy() if tensor.dtype != torch.bool else tensor.cpu().numpy()
+            per_node = rows[key] == 'node'
+            if key not in arrays:
+                num_rows = num_total_nodes if per_node else len(dataset)
+                arrays[key] = np.lib.format.open_memmap(os.path.join(output_dir, f'{key}.npy'), mode='w+',
+                                                        dtype=values.dtype, shape=(num_rows,) + values.shape[1:])
+            offset = node_offset if per_node else graph_offset
+            arrays[key][offset:offset + values.shape[0]] = values
+
+        graph_offset += data.num_graphs
+        node_offset += data.num_nodes
+
+    for array in arrays.values():
+        array.flush()
+    return {key: np.load(os.path.join(output_dir, f'{key}.npy'), mmap_mode='r') for key in arrays.keys()}
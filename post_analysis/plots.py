@@ -1,7 +1,6 @@
 import matplotlib.pyplot as plt
 import numpy as np
 import torch
-from scipy.stats import friedmanchisquare
 
 from sklearn.metrics import roc_curve, auc, roc_auc_score, classification_report
 
@@ -125,7 +124,7 @@ for i, name in enumerate(['mean_5', 'mean_20', 'diff_5', 'diff_20', 'gcn_mean_5'
 ########################
 ########################
 # Adapted from https://scikit-learn.org/stable/auto_examples/model_selection/plot_roc_crossval.html
-from scipy import interp
+from results_warehouse import interpolated_roc
 tprs = []
 aucs = []
 mean_fpr = np.linspace(0, 1, 100)
@@ -138,11 +137,8 @@ for fold, ord_index in enumerate(range(4, 40, 8)):
     predictions = np.load('results/predictions_' + name)
 
     fpr, tpr, _ = roc_curve(labels, predictions)
-    roc_val = auc(fpr, tpr)
-
     ax.plot(fpr, tpr, lw=2, alpha=0.5, label=f'Roc Fold {fold+1}', color=colours_plot[fold])
-    interp_tpr = interp(mean_fpr, fpr, tpr)
-    interp_tpr[0] = 0.0
+    interp_tpr, roc_val = interpolated_roc(labels, predictions, mean_fpr)
     tprs.append(interp_tpr)
     aucs.append(roc_val)
 
@@ -229,16 +225,12 @@ plt.savefig('50_threshold_example.pdf', bbox_inches = 'tight', pad_inches = 0)
 
 #################
 ######
-#All AUCs
-mean_cnn = [0.6895, 0.6388, 0.6871, 0.7488, 0.6807]
-mean_cnn_gcn5 = [0.7206, 0.6477, 0.6855, 0.7581, 0.6935]
-mean_cnn_gcn20 = [0.7216, 0.6460, 0.6840, 0.7588, 0.6897]
-xgboost_4split = [0.7875, 0.7723, 0.7853, 0.7859, 0.7950]
-
-stat, p = friedmanchisquare(mean_cnn,
-                            mean_cnn_gcn5,
-                            mean_cnn_gcn20)
-print(stat, p)
+#All AUCs, from the results imported with outputs/calculate_means.py --import_legacy
+from results_warehouse import ResultsWarehouse
+tests = ResultsWarehouse().significance_tests('auc', group_by=['model_name'],
+                                              where={'model_name': ['Loss mean 5', 'GCN Loss mean 5',
+                                                                    'GCN Loss mean 20']})
+print(tests['friedman_statistic'], tests['friedman_p'])
 
 
 ####################################################################
@@ -442,40 +434,20 @@ plt.close()
 ###
 ###
 import torch
-import wandb
 import matplotlib.pyplot as plt
 from main_loop import generate_st_model
 from model import SpatioTemporalModel
-from utils import change_w_config_, create_name_for_model
+from run_registry import RunRegistry
 
 
 # this run_id correspond to 2nd fold of 100_n_e_diffpool
 run_id = 'nxqb9kvj'
-api = wandb.Api()
-best_run = api.run(f'/st-team/spatio-temporal-brain/runs/{run_id}')
-w_config = best_run.config
-inner_fold_for_val: int = 1
-
-change_w_config_(w_config)
+run = RunRegistry().get_or_import(run_id)
+w_config = run['run_cfg']
 w_config['device_run'] = 'cuda'
 
 model: SpatioTemporalModel = generate_st_model(w_config, for_test=True)
-model_saving_path: str = create_name_for_model(target_var=w_config['target_var'],
-                                               model=model,
-                                               outer_split_num=w_config['fold_num'],
-                                               inner_split_num=inner_fold_for_val,
-                                               n_epochs=w_config['num_epochs'],
-                                               threshold=w_config['threshold'],
-                                               batch_size=w_config['batch_size'],
-                                               num_nodes=w_config['num_nodes'],
-                                               conn_type=w_config['param_conn_type'],
-                                               normalisation=w_config['param_normalisation'],
-                                               analysis_type=w_config['analysis_type'],
-                                               metric_evaluated='loss',
-                                               dataset_type=w_config['dataset_type'],
-                                               lr=w_config['param_lr'],
-                                               weight_decay=w_config['param_weight_decay'],
-                                               edge_weights=w_config['edge_weights'])
+model_saving_path: str = run['checkpoint_path']
 
 model.load_state_dict(torch.load(model_saving_path, map_location=w_config['device_run']))
 model.eval()
@@ -1,16 +1,18 @@
+from typing import Dict, List, Tuple, Any
+
 import numpy as np
 import torch
-import wandb
 from torch_geometric.data import DataLoader
 
 from datasets import HCPDataset
-from main_loop import generate_st_model, evaluate_model
+from main_loop import generate_st_model, evaluate_models
 from model import SpatioTemporalModel
-from utils import DatasetType, AnalysisType, ConnType, \
-    create_name_for_model, Normalisation, create_name_for_brain_dataset, EncodingStrategy, PoolingStrategy, \
-    ConvStrategy, SweepType
+from post_analysis.windowed_eval import windowed_loader
+from run_registry import RunRegistry
+from utils import DatasetType, create_name_for_brain_dataset
 
-# Extra fields besides run_id are due to precision issues when saving.
+# Extra fields besides run_id are due to precision issues when saving, only needed when importing the runs from wandb
+# into the RunRegistry.
 best_runs_ukb = {
     '100_n_diffpool': {0: {'run_id': 'khnljhrj'},
                        1: {'run_id': 'k9y54v5w', 'weight_d': 0.0012895162344404025},
@@ -132,88 +134,35 @@ best_runs_hcp100_THRES = {
 DEVICE_RUN = 'cpu'
 
 
-def print_metrics(model_name, runs_all, validate_hcp=False):
+def print_metrics(model_name, runs_all, validate_hcp=False, registry: RunRegistry = None, windowed: bool = False,
+                  stride: int = 245):
+    """
+    :param windowed: evaluate on HCP with all windows of each session (see evaluate_model_windowed()), otherwise the
+                     sessions are truncated to their first 490 timepoints
+    :param stride: timepoints between the start of consecutive windows
+    """
+    if registry is None:
+        registry = RunRegistry()
+    # The same HCP dataset is usually needed by every fold
+    hcp_datasets: Dict[str, HCPDataset] = {}
+    hcp_models: Dict[str, List[Tuple[SpatioTemporalModel, Dict[str, Any]]]] = {}
     metrics_ukb = {'f1': [], 'acc': [], 'auc': [], 'sensitivity': [], 'specificity': []}
     metrics_hcp = {'f1': [], 'acc': [], 'auc': [], 'sensitivity': [], 'specificity': []}
     for fold_num, run_info in runs_all.items():
         run_id = run_info['run_id']
         # print('Args are', run_id, device_run, dropout, weight_d)
 
-        api = wandb.Api()
-        best_run = api.run(f'/st-team/spatio-temporal-brain/runs/{run_id}')
-        # w_config = best_run.config
+        run = registry.get_or_import(run_id, overrides=run_info)
         for metric in metrics_ukb.keys():
-            metrics_ukb[metric].append(best_run.summary[f'values_test_{metric}'])
+            metrics_ukb[metric].append(run['summary'][f'values_test_{metric}'])
 
         # Running for HCP
-        w_config = best_run.config
-
-        w_config['analysis_type'] = AnalysisType(w_config['analysis_type'])
-        w_config['dataset_type'] = DatasetType(w_config['dataset_type'])
+        w_config = run['run_cfg']
         w_config['device_run'] = DEVICE_RUN
-        w_config['param_lr'] = w_config['lr']
-        if 'lr' not in run_info.keys():
-            w_config['param_lr'] = w_config['lr']
-        else:
-            w_config['param_lr'] = float(run_info['lr'])
-        w_config['model_with_sigmoid'] = True
-        w_config['param_activation'] = w_config['activation']
-        w_config['param_channels_conv'] = w_config['channels_conv']
-        w_config['param_conn_type'] = ConnType(w_config['conn_type'])
-        w_config['param_conv_strategy'] = ConvStrategy(w_config['conv_strategy'])
-        if 'dropout' not in run_info.keys():
-            w_config['param_dropout'] = w_config['dropout']
-        else:
-            w_config['param_dropout'] = float(run_info['dropout'])
-        w_config['param_encoding_strategy'] = EncodingStrategy(w_config['encoding_strategy'])
-        w_config['param_normalisation'] = Normalisation(w_config['normalisation'])
-        w_config['param_num_gnn_layers'] = w_config['num_gnn_layers']
-        w_config['param_pooling'] = PoolingStrategy(w_config['pooling'])
-        if 'weight_d' not in run_info.keys():
-            w_config['param_weight_decay'] = w_config['weight_decay']
-        else:
-            w_config['param_weight_decay'] = float(run_info['weight_d'])
-
-        w_config['sweep_type'] = SweepType(w_config['sweep_type'])
-        w_config['param_gat_heads'] = 0
-        if w_config['sweep_type'] == SweepType.GAT:
-            w_config['param_gat_heads'] = w_config.gat_heads
-
-        if w_config['analysis_type'] == AnalysisType.ST_MULTIMODAL:
-            w_config['multimodal_size'] = 10
-        elif w_config['analysis_type'] == AnalysisType.ST_UNIMODAL:
-            w_config['multimodal_size'] = 0
-
-        if w_config['target_var'] in ['age', 'bmi']:
-            w_config['model_with_sigmoid'] = False
 
         # Getting best model
-        inner_fold_for_val: int = 1
         model: SpatioTemporalModel = generate_st_model(w_config, for_test=True)
-        if 'model_v' in run_info.keys():
-            model.VERSION = run_info['model_v']
-        model_saving_path: str = create_name_for_model(target_var=w_config['target_var'],
-                                                       model=model,
-                                                       outer_split_num=w_config['fold_num'],
-                                                       inner_split_num=inner_fold_for_val,
-                                                       n_epochs=w_config['num_epochs'],
-                                                       threshold=w_config['threshold'],
-                                                       batch_size=w_config['batch_size'],
-                                                       num_nodes=w_config['num_nodes'],
-                                                       conn_type=w_config['param_conn_type'],
-                                                       normalisation=w_config['param_normalisation'],
-                                                       analysis_type=w_config['analysis_type'],
-                                                       metric_evaluated='loss',
-                                                       dataset_type=w_config['dataset_type'],
-                                                       lr=w_config['param_lr'],
-                                                       weight_decay=w_config['param_weight_decay'],
-                                                       edge_weights=w_config['edge_weights'])
-        if 'model_v' in run_info.keys():
-            # We know the very specific "old" cases
-            if w_config['param_pooling'] == PoolingStrategy.DIFFPOOL:
-                model_saving_path = model_saving_path.replace('T_difW_F', 'GC_FGA_F')
-            elif w_config['param_pooling'] == PoolingStrategy.MEAN:
-                model_saving_path = model_saving_path.replace('T_no_W_F', 'GC_FGA_F')
+        model_saving_path: str = run['checkpoint_path']
         model.load_state_dict(torch.load(model_saving_path, map_location=w_config['device_run']))
         model.eval()
         if not validate_hcp:
@@ -223,7 +172,7 @@ def print_metrics(model_name, runs_all, validate_hcp=False):
             name_dataset = create_name_for_brain_dataset(num_nodes=68,
                                                          time_length=1200,
                                                          target_var='gender',
-                                                         threshold=w_config['threshold'],
+                                                         threshold=w_config['param_threshold'],
                                                          normalisation=w_config['param_normalisation'],
                                                          connectivity_type=w_config['param_conn_type'],
                                                          analysis_type=w_config['analysis_type'],
@@ -231,24 +180,37 @@ def print_metrics(model_name, runs_all, validate_hcp=False):
                                                          dataset_type=DatasetType('hcp'),
                                                          edge_weights=w_config['edge_weights'])
             print('Going with', name_dataset)
-            dataset = HCPDataset(root=name_dataset,
-                                 target_var='gender',
-                                 num_nodes=68,
-                                 threshold=w_config['threshold'],
-                                 connectivity_type=w_config['param_conn_type'],
-                                 normalisation=w_config['param_normalisation'],
-                                 analysis_type=w_config['analysis_type'],
-                                 encoding_strategy=w_config['param_encoding_strategy'],
-                                 time_length=1200,
-                                 edge_weights=w_config['edge_weights'])
-
+            if name_dataset not in hcp_datasets:
+                hcp_datasets[name_dataset] = HCPDataset(root=name_dataset,
+                                                        target_var='gender',
+                                                        num_nodes=68,
+                                                        threshold=w_config['param_threshold'],
+                                                        connectivity_type=w_config['param_conn_type'],
+                                                        normalisation=w_config['param_normalisation'],
+                                                        analysis_type=w_config['analysis_type'],
+                                                        encoding_strategy=w_config['param_encoding_strategy'],
+                                                        time_length=1200,
+                                                        edge_weights=w_config['edge_weights'])
+            hcp_models.setdefault(name_dataset, []).append((model, w_config))
+
+    # All fold models with the same HCP dataset are evaluated together, with each batch only loaded once
+    for name_dataset, models_cfgs in hcp_models.items():
+        dataset = hcp_datasets[name_dataset]
+        models = [model for model, _ in models_cfgs]
+        w_config = models_cfgs[0][1]
+
+        if windowed:
+            models, test_out_loader = windowed_loader(models, dataset, stride=stride)
+        else:
             # dataset.data is private, might change in future versions of pyg...
             dataset.data.x = dataset.data.x[:, :490]
-
             test_out_loader = DataLoader(dataset, batch_size=w_config['batch_size'], shuffle=False)
-            test_metrics = evaluate_model(model, test_out_loader, w_config['param_pooling'], w_config['device_run'])
+        ensemble_metrics = evaluate_models(models, test_out_loader, w_config['param_pooling'],
+                                           w_config['device_run'])
+        for test_metrics in ensemble_metrics['models']:
             for metric in metrics_hcp.keys():
                 metrics_hcp[metric].append(test_metrics[metric])
+        print('HCP ensemble of', len(models), 'folds:', ensemble_metrics['ensemble'])
 
     # print('UKB:')
     print(model_name, end=' & ')
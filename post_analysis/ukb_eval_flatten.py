@@ -1,12 +1,11 @@
 import pickle
 
 import numpy as np
-import wandb
-from xgboost import XGBModel
 
 from datasets import FlattenCorrsDataset
-from main_loop import generate_xgb_model, return_classifier_metrics
-from utils import DatasetType, AnalysisType, ConnType, create_name_for_flattencorrs_dataset, create_name_for_xgbmodel
+from main_loop import return_classifier_metrics
+from run_registry import RunRegistry
+from utils import DatasetType, AnalysisType, ConnType, create_name_for_flattencorrs_dataset
 
 best_runs = {
     'sex_flatten': {0: {'run_id': 'zqahc9zb'},
@@ -16,6 +15,7 @@ best_runs = {
                     4: {'run_id': 'igl3va7i'}}
 }
 
+registry = RunRegistry()
 for model_type, runs_all in best_runs.items():
     print('----', model_type)
     metrics_ukb = {'f1': [], 'acc': [], 'auc': [], 'sensitivity': [], 'specificity': []}
@@ -24,29 +24,12 @@ for model_type, runs_all in best_runs.items():
         run_id = run_info['run_id']
         # print('Args are', run_id, device_run, dropout, weight_d)
 
-        api = wandb.Api()
-        best_run = api.run(f'/st-team/spatio-temporal-brain/runs/{run_id}')
-        # w_config = best_run.config
+        run = registry.get_or_import(run_id, overrides=run_info)
         for metric in metrics_ukb.keys():
-            metrics_ukb[metric].append(best_run.summary[f'values_test_{metric}'])
-
-        # Running for HCP
-        w_config = best_run.config
-
-        w_config['analysis_type'] = AnalysisType(w_config['analysis_type'])
-        w_config['dataset_type'] = DatasetType(w_config['dataset_type'])
-        w_config['param_conn_type'] = ConnType(w_config['conn_type'])
-        if 'ode' in run_info.keys():
-            w_config['colsample_bynode'] = float(run_info['ode'])
+            metrics_ukb[metric].append(run['summary'][f'values_test_{metric}'])
 
         # Getting best model
-        inner_fold_for_val: int = 1
-        model: XGBModel = generate_xgb_model(w_config)
-        model_saving_path = create_name_for_xgbmodel(model=model,
-                                                     outer_split_num=w_config['fold_num'],
-                                                     inner_split_num=inner_fold_for_val,
-                                                     run_cfg=w_config
-                                                     )
+        model_saving_path = run['checkpoint_path']
         model = pickle.load(open(model_saving_path, "rb"))
 
         # Getting HCP Data
@@ -0,0 +1,100 @@
+from typing import Dict, List, Tuple
+
+import torch
+from torch_geometric.data import Batch, DataLoader
+
+from main_loop import evaluate_model
+from model import SpatioTemporalModel
+from utils import PoolingStrategy
+
+
+def window_starts(time_length: int, window_length: int, stride: int) -> List[int]:
+    """
+    Start of each window of window_length timepoints, every stride timepoints. A last window ending at time_length is
+    added when needed, so no timepoint is left out.
+    """
+    if window_length > time_length:
+        raise ValueError(f'Windows of {window_length} timepoints do not fit in {time_length} timepoints')
+    starts = list(range(0, time_length - window_length + 1, stride))
+    if starts[-1] != time_length - window_length:
+        starts.append(time_length - window_length)
+    return starts
+
+
+def windowed_batch(data: Batch, window_length: int, starts: List[int], multimodal_size: int = 0) -> Batch:
+    """
+    Batch with every window of every graph in data, as graphs with the same edges. The graph of window w of the b-th
+    graph in data is w * data.num_graphs + b.
+    """
+    num_windows, num_nodes, num_graphs = len(starts), data.num_nodes, data.num_graphs
+    xn, x = data.x[:, :multimodal_size], data.x[:, multimodal_size:]
+
+    x = torch.stack([x[:, start:start + window_length] for start in starts]).view(num_windows * num_nodes, -1)
+    if multimodal_size > 0:
+        x = torch.cat((xn.repeat(num_windows, 1), x), dim=1)
+
+    window_ids = torch.arange(num_windows, device=x.device)
+    num_edges = data.edge_index.size(1)
+    edge_index = data.edge_index.repeat(1, num_windows) + (window_ids * num_nodes).repeat_interleave(num_edges)
+    edge_attr = None
+    if data.edge_attr is not None:
+        edge_attr = data.edge_attr.repeat(num_windows, *([1] * (data.edge_attr.dim() - 1)))
+    batch = data.batch.repeat(num_windows) + (window_ids * num_graphs).repeat_interleave(num_nodes)
+
+    windows = Batch(x=x, edge_index=edge_index, edge_attr=edge_attr, y=data.y.repeat(num_windows), batch=batch)
+    # Windows keep the edges sorted by destination
+    if getattr(data, 'in_degree', None) is not None:
+        windows.in_degree = data.in_degree.repeat(num_windows)
+    if getattr(data, 'gcn_norm', None) is not None:
+        windows.gcn_norm = data.gcn_norm.repeat(num_windows)
+        windows.gcn_norm_weighted = data.gcn_norm_weighted.repeat(num_windows)
+    return windows
+
+
+class WindowedModel(torch.nn.Module):
+    """
+    Wraps a model to predict on sessions longer than the ones it was trained on (e.g. HCP's 1200 timepoints for a UKB
+    model of 490). Each session is cut into windows of model.num_time_length timepoints (see window_starts()), all
+    windows of the batch go through the model in the same forward pass, and the predictions of the windows of each
+    subject are averaged into one.
+    """
+
+    def __init__(self, model: SpatioTemporalModel, starts: List[int]):
+        super().__init__()
+        self.model = model
+        self.starts = starts
+
+    def forward(self, data):
+        windows = windowed_batch(data, self.model.num_time_length, self.starts, self.model.multimodal_size)
+        output = self.model(windows)
+        # DiffPool also returns its (already averaged) link and entropy losses
+        output_windows, extra_losses = (output[0], output[1:]) if isinstance(output, tuple) else (output, ())
+        output_batch = output_windows.view(len(self.starts), data.num_graphs).mean(dim=0).unsqueeze(1)
+        return (output_batch, *extra_losses) if extra_losses else output_batch
+
+
+def windowed_loader(models: List[SpatioTemporalModel], dataset, stride: int = 245,
+                    windows_per_batch: int = 4000) -> Tuple[List[WindowedModel], DataLoader]:
+    """
+    :param windows_per_batch: windows in each forward pass, i.e. the batch size in graphs
+    :return: the models wrapped in WindowedModel, and a loader with batches of whole subjects
+    """
+    window_length = models[0].num_time_length
+    time_length = dataset[0].x.size(1) - models[0].multimodal_size
+    starts = window_starts(time_length, window_length, stride)
+    print(f'Evaluating {len(starts)} windows of {window_length} timepoints per subject, starting at {starts}')
+
+    loader = DataLoader(dataset, batch_size=max(1, windows_per_batch // len(starts)), shuffle=False)
+    return [WindowedModel(model, starts) for model in models], loader
+
+
+def evaluate_model_windowed(model: SpatioTemporalModel, dataset, pooling_mechanism: PoolingStrategy, device: str,
+                            stride: int = 245, windows_per_batch: int = 4000) -> Dict[str, float]:
+    """
+    Like main_loop.evaluate_model(), with all windows of each session (see WindowedModel).
+
+    The cost is about the number of windows per session (4 for HCP with the default stride) times the cost of
+    evaluating the truncated sessions.
+    """
+    windowed_models, loader = windowed_loader([model], dataset, stride, windows_per_batch)
+    return evaluate_model(windowed_models[0], loader, pooling_mechanism, device)
@@ -0,0 +1,383 @@
+import os
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Dict, Any, Iterable, List, Optional
+
+import torch
+import torch.nn as nn
+
+from run_logger import WandbLogger, WANDB_LOGGER
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+# Submodules of SpatioTemporalModel whose forward time is attributed to each stage
+MODEL_STAGES = {
+    'temporal_conv': ['temporal_conv', 'lin_temporal', 'stats_lin', 'encoder_model'],
+    'gnn': ['gnn_conv1', 'gnn_conv2', 'meta_layer'],
+    'pooling': ['diff_pool', 'pre_final_linear']
+}
+
+
+class RSSSampler:
+    """
+    Peak resident set size (in MB) of this process while a stage is active.
+
+    RSS is sampled every `interval` seconds by one background thread, started with the first stage and kept until
+    close(), so each stage only resets and reads the peak. It needs psutil: without it, the peak is unavailable.
+    """
+
+    def __init__(self, interval: float = 0.005):
+        self.interval: float = interval
+        self._peak: float = 0
+        self._lock = threading.Lock()
+        self._running = threading.Event()
+        self._process = psutil.Process() if psutil is not None else None
+        self._thread: threading.Thread = None
+
+    @property
+    def available(self) -> bool:
+        return self._process is not None
+
+    def __current_rss(self) -> float:
+        return self._process.memory_info().rss / 2 ** 20
+
+    def __sample(self):
+        while self._running.is_set():
+            rss = self.__current_rss()
+            with self._lock:
+                self._peak = max(self._peak, rss)
+            time.sleep(self.interval)
+
+    def reset(self):
+        if not self.available:
+            return
+        rss = self.__current_rss()
+        with self._lock:
+            self._peak = rss
+        if self._thread is None:
+            self._running.set()
+            self._thread = threading.Thread(target=self.__sample, daemon=True)
+            self._thread.start()
+
+    def peak(self) -> Optional[float]:
+        """
+        :return: peak RSS since the last reset(), or None without psutil
+        """
+        if not self.available:
+            return None
+        rss = self.__current_rss()
+        with self._lock:
+            return max(self._peak, rss)
+
+    def close(self):
+        if self._thread is not None:
+            self._running.clear()
+            self._thread.join()
+            self._thread = None
+
+
+class LegacyTraceWindow:
+    """
+    The part of torch.profiler.profile() used by StageProfiler, with torch.autograd.profiler for torch < 1.8: nothing
+    is recorded for the first `wait` steps, then the next `active` steps are recorded and given to on_trace_ready.
+    """
+
+    def __init__(self, wait: int, active: int, use_cuda: bool, on_trace_ready):
+        self.wait: int = wait
+        self.active: int = active
+        self.use_cuda: bool = use_cuda
+        self.on_trace_ready = on_trace_ready
+        self._steps: int = 0
+        self._profile = None
+
+    def start(self):
+        if self.wait == 0:
+            self.__begin()
+
+    def step(self):
+        self._steps += 1
+        if self._profile is None and self._steps == self.wait:
+            self.__begin()
+        elif self._profile is not None and self._steps == self.wait + self.active:
+            self.stop()
+
+    def __begin(self):
+        self._profile = torch.autograd.profiler.profile(use_cuda=self.use_cuda, record_shapes=True)
+        self._profile.__enter__()
+
+    def stop(self):
+        if self._profile is None:
+            return
+        self._profile.__exit__(None, None, None)
+        self.on_trace_ready(self._profile)
+        self._profile = None
+
+
+class StageProfiler:
+    """
+    Wall-clock time and/or peak memory per stage of the training loop.
+
+    Times are accumulated over an epoch. When disabled, stage() and iterate() add nothing besides a function call.
+    When timing on CUDA, the device is synchronised at every stage boundary, otherwise we would be timing kernel
+    launches only. Optionally, a torch.profiler trace is captured for a window of training steps and a table with
+    the top operators is saved for the sweep_type/pooling combination of the run.
+
+    With track_memory, the peak host RSS and the peak of torch's CUDA allocator are kept for each stage over the
+    whole run (stages must not be nested, as the allocator's peak is reset when each one starts).
+    """
+
+    def __init__(self, enabled: bool = False, device: str = 'cpu', trace_steps: int = 0, trace_wait: int = 5,
+                 trace_name: str = 'run', output_dir: str = 'logs/profiles', top_ops: int = 25,
+                 track_memory: bool = False):
+        self.time_stages: bool = enabled
+        self.track_memory: bool = track_memory
+        self.enabled: bool = enabled or track_memory
+        self.device = device
+        self.on_cuda: bool = str(device).startswith('cuda')
+        self.synchronise: bool = enabled and self.on_cuda
+        self.times: Dict[str, float] = defaultdict(float)
+        self.peak_host_mb: Dict[str, float] = defaultdict(float)
+        self.peak_device_mb: Dict[str, float] = defaultdict(float)
+        self._rss_sampler = RSSSampler() if track_memory else None
+        self._hooks = []
+        self._open_stages: Dict[str, float] = {}
+
+        self.trace_steps: int = trace_steps
+        self.trace_wait: int = trace_wait
+        self.trace_name: str = trace_name
+        self.output_dir: str = output_dir
+        self.top_ops: int = top_ops
+        self._torch_profiler = None
+        self.checkpointed_modules: List[str] = []
+
+    @classmethod
+    def from_run_cfg(cls, run_cfg: Dict[str, Any]) -> 'StageProfiler':
+        if 'sweep_type' in run_cfg:
+            trace_name = '_'.join([run_cfg['sweep_type'].value, run_cfg['param_pooling'].value])
+        else:
+            trace_name = run_cfg['analysis_type'].value
+        return cls(enabled=run_cfg.get('profile', False),
+                   device=run_cfg['device_run'],
+                   trace_steps=run_cfg.get('profile_trace_steps', 0),
+                   trace_name=trace_name,
+                   track_memory=run_cfg.get('profile_memory', False))
+
+    def _now(self) -> float:
+        if self.synchronise:
+            torch.cuda.synchronize()
+        return time.perf_counter()
+
+    def _begin(self) -> float:
+        if self.track_memory:
+            if self.on_cuda:
+                torch.cuda.reset_peak_memory_stats(self.device)
+            self._rss_sampler.reset()
+        return self._now() if self.time_stages else 0
+
+    def _end(self, name: str, start: float):
+        if self.time_stages:
+            self.times[name] += self._now() - start
+        if self.track_memory:
+            host_peak = self._rss_sampler.peak()
+            if host_peak is not None:
+                self.peak_host_mb[name] = max(self.peak_host_mb[name], host_peak)
+            if self.on_cuda:
+                self.peak_device_mb[name] = max(self.peak_device_mb[name],
+                                                torch.cuda.max_memory_allocated(self.device) / 2 ** 20)
+
+    @contextmanager
+    def stage(self, name: str):
+        if not self.enabled:
+            yield
+            return
+        start = self._begin()
+        try:
+            yield
+        finally:
+            self._end(name, start)
+
+    def iterate(self, iterable: Iterable, name: str = 'collation'):
+        """
+        Yields the elements of iterable (e.g. a DataLoader), accounting the time spent waiting on each one.
+        """
+        if not self.enabled:
+            yield from iterable
+            return
+        iterator = iter(iterable)
+        while True:
+            start = self._begin()
+            try:
+                elem = next(iterator)
+            except StopIteration:
+                break
+            finally:
+                self._end(name, start)
+            yield elem
+
+    def attach(self, model: nn.Module):
+        """
+        Registers forward hooks in the model's submodules, according to MODEL_STAGES.
+
+        Submodules with activation checkpointing run again in the backward pass, and that time is accounted in
+        '<stage>_recompute' (e.g. gnn_recompute for meta_layer). Their saving in memory shows in the peak memory of the
+        forward and backward stages.
+        """
+        self.checkpointed_modules = list(getattr(model, 'checkpointed_modules', []))
+        if self.checkpointed_modules and self.enabled:
+            print('Activation checkpointing for', self.checkpointed_modules)
+        if not self.time_stages:
+            return
+        for stage_name, module_names in MODEL_STAGES.items():
+            for module_name in module_names:
+                module = getattr(model, module_name, None)
+                if not isinstance(module, nn.Module):
+                    continue
+                self._hooks.append(module.register_forward_pre_hook(self.__start_hook(stage_name)))
+                self._hooks.append(module.register_forward_hook(self.__end_hook(stage_name)))
+
+    @staticmethod
+    def __hook_stage(stage_name: str, module: nn.Module) -> str:
+        return f'{stage_name}_recompute' if getattr(module, 'recomputing', False) else stage_name
+
+    def __start_hook(self, stage_name: str):
+        def hook(module, inputs):
+            # Evaluation passes are already accounted as a whole
+            if module.training:
+                self._open_stages[self.__hook_stage(stage_name, module)] = self._now()
+
+        return hook
+
+    def __end_hook(self, stage_name: str):
+        def hook(module, inputs, output):
+            name = self.__hook_stage(stage_name, module)
+            start = self._open_stages.pop(name, None)
+            if start is not None:
+                self.times[name] += self._now() - start
+
+        return hook
+
+    def start_trace(self):
+        if not self.time_stages or self.trace_steps <= 0:
+            return
+        try:
+            from torch.profiler import profile, schedule, ProfilerActivity
+        except ImportError:
+            # torch.profiler only exists since torch 1.8
+            self._torch_profiler = LegacyTraceWindow(wait=self.trace_wait + 1, active=self.trace_steps,
+                                                     use_cuda=self.synchronise, on_trace_ready=self.__save_trace)
+            self._torch_profiler.start()
+            return
+
+        activities = [ProfilerActivity.CPU]
+        if self.synchronise:
+            activities.append(ProfilerActivity.CUDA)
+        self._torch_profiler = profile(activities=activities,
+                                       schedule=schedule(wait=self.trace_wait, warmup=1, active=self.trace_steps,
+                                                         repeat=1),
+                                       on_trace_ready=self.__save_trace,
+                                       record_shapes=True,
+                                       profile_memory=True)
+        self._torch_profiler.start()
+
+    def step(self):
+        """
+        Marks the end of one training step for the torch.profiler window.
+        """
+        if self._torch_profiler is not None:
+            self._torch_profiler.step()
+
+    def __save_trace(self, prof):
+        os.makedirs(self.output_dir, exist_ok=True)
+        base_name = os.path.join(self.output_dir, f'trace_{self.trace_name}')
+        prof.export_chrome_trace(f'{base_name}.json')
+        sort_by = 'self_cuda_time_total' if self.synchronise else 'self_cpu_time_total'
+        if isinstance(prof, torch.autograd.profiler.profile) and self.synchronise:
+            # The autograd profiler of torch < 1.8 has no self CUDA time
+            sort_by = 'cuda_time_total'
+        table = prof.key_averages().table(sort_by=sort_by, row_limit=self.top_ops)
+        with open(f'{base_name}_top_ops.txt', 'w') as fd:
+            fd.write(table)
+        print(f'Top operators for {self.trace_name}:')
+        print(table)
+
+    def stop_trace(self):
+        if self._torch_profiler is not None:
+            self._torch_profiler.stop()
+            self._torch_profiler = None
+
+    def epoch_summary(self, epoch: int, logger: Optional[WandbLogger] = WANDB_LOGGER) -> Dict[str, float]:
+        """
+        Prints and logs (unless logger is None) the time breakdown of the epoch, and starts counting again.
+        """
+        if not self.time_stages:
+            return {}
+        summary = dict(self.times)
+        # Time in forward() not covered by the submodules in MODEL_STAGES
+        if 'forward' in summary:
+            model_stages_time = sum(summary.get(stage_name, 0) for stage_name in MODEL_STAGES.keys())
+            summary['forward_other'] = max(summary['forward'] - model_stages_time, 0)
+
+        print(f'Epoch {epoch:03d} time per stage:',
+              ', '.join(f'{name}: {round(value, 3)}s' for name, value in sorted(summary.items())))
+        if logger is not None:
+            logger.log({f'time_{name}': value for name, value in summary.items()}, commit=False)
+
+        self.times = defaultdict(float)
+        return summary
+
+    def memory_summary(self) -> Dict[str, float]:
+        summary: Dict[str, Any] = {f'peak_rss_mb_{name}': value for name, value in self.peak_host_mb.items()}
+        if self._rss_sampler is not None and not self._rss_sampler.available:
+            summary['peak_rss_mb'] = 'unavailable (needs psutil)'
+        summary.update({f'peak_torch_mb_{name}': value for name, value in self.peak_device_mb.items()})
+        return summary
+
+    def peaks(self) -> Dict[str, Any]:
+        """
+        Peak memory of each stage, to be given to merge_peaks() of the profiler of another process.
+        """
+        return {'host': dict(self.peak_host_mb), 'device': dict(self.peak_device_mb),
+                'checkpointed_modules': list(self.checkpointed_modules)}
+
+    def merge_peaks(self, peaks: Dict[str, Any]):
+        """
+        Keeps the highest peak of each stage between this profiler and peaks (see peaks()), e.g. of the processes
+        training the inner folds in parallel.
+        """
+        for name, value in peaks['host'].items():
+            self.peak_host_mb[name] = max(self.peak_host_mb[name], value)
+        for name, value in peaks['device'].items():
+            self.peak_device_mb[name] = max(self.peak_device_mb[name], value)
+        if not self.checkpointed_modules:
+            self.checkpointed_modules = peaks['checkpointed_modules']
+
+    def send_memory_summary(self, logger: WandbLogger = WANDB_LOGGER):
+        """
+        Prints the peak memory of each stage and stores it in the run summary, along with the submodules that had
+        activation checkpointing, to compare runs with and without it.
+        """
+        if not self.track_memory:
+            return
+        summary = self.memory_summary()
+        print('Peak memory per stage:', ', '.join(f'{name}: {round(value, 1) if isinstance(value, float) else value}'
+                                                  for name, value in summary.items()))
+        summary['activation_checkpointing'] = ','.join(self.checkpointed_modules) or 'none'
+        for key, value in summary.items():
+            logger.summary(key, value)
+
+    def close(self):
+        self.stop_trace()
+        if self._rss_sampler is not None:
+            self._rss_sampler.close()
+        for hook in self._hooks:
+            hook.remove()
+        self._hooks = []
+
+
+# To be used as default argument where no profiling is wanted
+NULL_PROFILER = StageProfiler(enabled=False)
@@ -0,0 +1,240 @@
+import os
+import sqlite3
+import time
+from typing import Dict, Any, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from scipy.stats import friedmanchisquare, ttest_rel
+from sklearn.metrics import roc_curve, auc
+
+RESULTS_PATH = 'logs/results.db'
+
+# Names used by the hand-written result dictionaries (e.g. outputs/calculate_means.py)
+LEGACY_METRIC_NAMES = {'aucs': 'auc', 'accs': 'acc', 'f1s': 'f1', 'sens': 'sensitivity', 'spec': 'specificity'}
+
+
+def interpolated_roc(labels: np.ndarray, predictions: np.ndarray, mean_fpr: np.ndarray) -> Tuple[np.ndarray, float]:
+    """
+    :return: true positive rates of the ROC curve at mean_fpr (starting at 0), and its AUC
+    """
+    fpr, tpr, _ = roc_curve(labels, predictions)
+    interp_tpr = np.interp(mean_fpr, fpr, tpr)
+    interp_tpr[0] = 0.0
+    return interp_tpr, auc(fpr, tpr)
+
+
+class ResultsWarehouse:
+    """
+    SQLite tables with the results of every run, filled by main_loop when sending its metrics to wandb:
+
+    - runs: one row per run, with one column per (scalar) key of its run_cfg, so results can be grouped and filtered
+      by any hyperparameter
+    - metrics: one row per run, split ('val' for the inner folds, 'test' for the outer fold) and metric
+    - predictions: test set predictions and labels of each run, for ROC curves
+
+    The query methods return pandas DataFrames, with statistics calculated over all folds of each group at once.
+    """
+
+    def __init__(self, db_path: str = RESULTS_PATH):
+        self.db_path = db_path
+        if os.path.dirname(db_path):
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        with self.__connect() as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS runs (run_id TEXT PRIMARY KEY, created REAL)')
+            conn.execute('CREATE TABLE IF NOT EXISTS metrics (run_id TEXT, split TEXT, inner_fold INTEGER, '
+                         'metric TEXT, value REAL)')
+            conn.execute('CREATE INDEX IF NOT EXISTS metrics_lookup ON metrics (metric, split, run_id)')
+            conn.execute('CREATE TABLE IF NOT EXISTS predictions (run_id TEXT, split TEXT, predictions BLOB, '
+                         'labels BLOB, PRIMARY KEY (run_id, split))')
+
+    def __connect(self) -> sqlite3.Connection:
+        # Sweep workers might write at the same time
+        return sqlite3.connect(self.db_path, timeout=60)
+
+    #
+    # Writing
+    #
+    def add_run(self, run_id: str, run_cfg: Dict[str, Any]):
+        values = {key: _scalar(value) for key, value in run_cfg.items()
+                  if key != 'run_id' and _scalar(value) is not _NOT_SCALAR}
+        with self.__connect() as conn:
+            existing = {row[1] for row in conn.execute('PRAGMA table_info(runs)')}
+            for key in values.keys() - existing:
+                try:
+                    conn.execute(f'ALTER TABLE runs ADD COLUMN "{key}"')
+                except sqlite3.OperationalError as e:
+                    # Another process might have just added it
+                    if 'duplicate column' not in str(e):
+                        raise
+            columns = ['"run_id"', '"created"'] + [f'"{key}"' for key in values.keys()]
+            conn.execute(f'INSERT OR REPLACE INTO runs ({", ".join(columns)}) '
+                         f'VALUES ({", ".join("?" * len(columns))})',
+                         [run_id, time.time()] + list(values.values()))
+
+    def add_metrics(self, run_id: str, split: str, metrics: Dict[str, float], inner_fold: int = None):
+        with self.__connect() as conn:
+            conn.execute('DELETE FROM metrics WHERE run_id = ? AND split = ? AND inner_fold IS ?',
+                         (run_id, split, inner_fold))
+            conn.executemany('INSERT INTO metrics VALUES (?, ?, ?, ?, ?)',
+                             [(run_id, split, inner_fold, metric, float(value)) for metric, value in metrics.items()
+                              if value is not None])
+
+    def add_predictions(self, run_id: str, split: str, predictions, labels):
+        with self.__connect() as conn:
+            conn.execute('INSERT OR REPLACE INTO predictions VALUES (?, ?, ?, ?)',
+                         (run_id, split, np.asarray(predictions, dtype=np.float32).tobytes(),
+                          np.asarray(labels, dtype=np.float32).tobytes()))
+
+    def import_fold_results(self, model_name: str, results: Dict[str, List[float]], split: str = 'test'):
+        """
+        Adds results written by hand, as in outputs/calculate_means.py ({'aucs': [fold1, fold2, ...], ...}), as runs
+        with only a model_name and a split_to_test.
+        """
+        num_folds = len(next(iter(results.values())))
+        for fold in range(num_folds):
+            run_id = f'legacy:{model_name}:{fold + 1}'
+            self.add_run(run_id, {'model_name': model_name, 'split_to_test': fold + 1})
+            self.add_metrics(run_id, split, {LEGACY_METRIC_NAMES.get(metric, metric): values[fold]
+                                             for metric, values in results.items()})
+
+    #
+    # Queries
+    #
+    def metrics_frame(self, metrics: List[str], split: str = 'test', where: Dict[str, Any] = None) -> pd.DataFrame:
+        """
+        :return: one row per run (and inner fold) with all the columns of runs, and one column per metric
+        """
+        where_sql, values = self.__where_sql(where)
+        with self.__connect() as conn:
+            runs = pd.read_sql_query(f'SELECT * FROM runs WHERE 1 = 1{where_sql}', conn, params=values)
+            frame = pd.read_sql_query(f'SELECT run_id, inner_fold, metric, value FROM metrics WHERE split = ? '
+                                      f'AND metric IN ({", ".join("?" * len(metrics))})', conn,
+                                      params=[split] + list(metrics))
+        # Test metrics have no inner fold
+        frame['inner_fold'] = frame['inner_fold'].fillna(0).astype(int)
+        frame = frame.pivot_table(index=['run_id', 'inner_fold'], columns='metric', values='value').reset_index()
+        return runs.merge(frame, on='run_id')
+
+    def fold_statistics(self, metrics: List[str], group_by: List[str], split: str = 'test',
+                        where: Dict[str, Any] = None) -> pd.DataFrame:
+        """
+        Mean, standard deviation (as np.std()) and number of folds of each metric, for each group of runs with the same
+        values in group_by. Everything is aggregated in SQLite, in a single query.
+        """
+        where_sql, values = self.__where_sql(where)
+        group_columns = ', '.join(f'runs."{column}"' for column in group_by)
+        sql = (f'SELECT {group_columns}, metrics.metric, COUNT(*) AS folds, AVG(metrics.value) AS mean, '
+               f'AVG(metrics.value * metrics.value) AS mean_sq FROM metrics '
+               f'JOIN runs ON runs.run_id = metrics.run_id WHERE metrics.split = ? '
+               f'AND metrics.metric IN ({", ".join("?" * len(metrics))}){where_sql} '
+               f'GROUP BY {group_columns}, metrics.metric')
+        with self.__connect() as conn:
+            frame = pd.read_sql_query(sql, conn, params=[split] + list(metrics) + values)
+        frame['std'] = np.sqrt(np.maximum(frame['mean_sq'] - frame['mean'] ** 2, 0))
+        frame = frame.drop(columns='mean_sq')
+        return frame.pivot_table(index=group_by, columns='metric', values=['mean', 'std', 'folds'])
+
+    def summary_table(self, metrics: List[str], group_by: List[str], split: str = 'test',
+                      where: Dict[str, Any] = None, decimals: int = 3) -> pd.DataFrame:
+        """
+        fold_statistics() as "mean (std)" strings, e.g. for LaTeX tables with .to_latex().
+        """
+        statistics = self.fold_statistics(metrics, group_by, split, where)
+        table = pd.DataFrame(index=statistics.index)
+        for metric in metrics:
+            if metric not in statistics['mean'].columns:
+                continue
+            table[metric] = (statistics['mean'][metric].round(decimals).astype(str) + ' (' +
+                             statistics['std'][metric].round(decimals).astype(str) + ')')
+        return table
+
+    def fold_matrix(self, metric: str, group_by: List[str], split: str = 'test', fold_column: str = 'split_to_test',
+                    where: Dict[str, Any] = None) -> pd.DataFrame:
+        """
+        :return: one row per fold and one column per group, only with the folds that all groups have
+        """
+        frame = self.metrics_frame([metric], split, where)
+        if 'inner_fold' in frame.columns and split != 'test':
+            frame = frame.groupby(group_by + [fold_column], as_index=False)[metric].mean()
+        return frame.pivot_table(index=fold_column, columns=group_by, values=metric).dropna()
+
+    def significance_tests(self, metric: str, group_by: List[str], reference=None, split: str = 'test',
+                           fold_column: str = 'split_to_test', where: Dict[str, Any] = None) -> Dict[str, Any]:
+        """
+        Friedman test over all groups, with the folds as blocks, and paired t-tests of every group against reference
+        (one of the groups, the best mean by default), all of them calculated at once on the fold matrix.
+        """
+        matrix = self.fold_matrix(metric, group_by, split, fold_column, where)
+        results: Dict[str, Any] = {'folds': len(matrix.index)}
+        if len(matrix.columns) >= 3:
+            results['friedman_statistic'], results['friedman_p'] = friedmanchisquare(*matrix.values.T)
+        if reference is None:
+            reference = matrix.mean(axis=0).idxmax()
+        statistics, p_values = ttest_rel(matrix.values, matrix[reference].values[:, None], axis=0)
+        results['reference'] = reference
+        results['paired_t'] = pd.DataFrame({'mean': matrix.mean(axis=0), 'statistic': statistics, 'p': p_values},
+                                           index=matrix.columns)
+        return results
+
+    def mean_roc(self, group_by: List[str], split: str = 'test', where: Dict[str, Any] = None,
+                 num_points: int = 100) -> Dict[Any, Dict[str, Any]]:
+        """
+        Mean ROC curve of each group of runs, interpolating the curve of every run (i.e. fold) at the same false positive
+        rates.
+
+        :return: for each group, mean_fpr, mean_tpr, std_tpr, the AUC of the mean curve and the AUCs of each run
+        """
+        where_sql, values = self.__where_sql(where)
+        group_columns = ', '.join(f'runs."{column}"' for column in group_by)
+        sql = (f'SELECT {group_columns}, predictions.predictions, predictions.labels FROM predictions '
+               f'JOIN runs ON runs.run_id = predictions.run_id WHERE predictions.split = ?{where_sql}')
+        with self.__connect() as conn:
+            rows = conn.execute(sql, [split] + values).fetchall()
+
+        mean_fpr = np.linspace(0, 1, num_points)
+        curves: Dict[Any, Tuple[list, list]] = {}
+        for row in rows:
+            group = row[0] if len(group_by) == 1 else tuple(row[:len(group_by)])
+            tpr, roc_auc = interpolated_roc(np.frombuffer(row[-1], dtype=np.float32),
+                                            np.frombuffer(row[-2], dtype=np.float32), mean_fpr)
+            curves.setdefault(group, ([], []))
+            curves[group][0].append(tpr)
+            curves[group][1].append(roc_auc)
+
+        results = {}
+        for group, (tprs, aucs) in curves.items():
+            tprs = np.stack(tprs)
+            mean_tpr = tprs.mean(axis=0)
+            mean_tpr[-1] = 1.0
+            results[group] = {'mean_fpr': mean_fpr, 'mean_tpr': mean_tpr, 'std_tpr': tprs.std(axis=0),
+                              'mean_auc': auc(mean_fpr, mean_tpr), 'aucs': np.array(aucs)}
+        return results
+
+    def __where_sql(self, where: Optional[Dict[str, Any]]) -> Tuple[str, list]:
+        if not where:
+            return '', []
+        conditions, values = [], []
+        for column, value in where.items():
+            if isinstance(value, (list, tuple, set)):
+                conditions.append(f'runs."{column}" IN ({", ".join("?" * len(value))})')
+                values += [_scalar(item) for item in value]
+            else:
+                conditions.append(f'runs."{column}" = ?')
+                values.append(_scalar(value))
+        return ' AND ' + ' AND '.join(conditions), values
+
+
+_NOT_SCALAR = object()
+
+
+def _scalar(value: Any) -> Any:
+    """
+    Value as saved in a column of runs (enums as their value), or _NOT_SCALAR for lists, dictionaries, etc.
+    """
+    value = getattr(value, 'value', value)
+    if isinstance(value, np.generic):
+        value = value.item()
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    return _NOT_SCALAR
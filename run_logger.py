@@ -0,0 +1,51 @@
+from typing import Dict, Any, List, Tuple
+
+import torch.nn as nn
+import wandb
+
+
+class WandbLogger:
+    """
+    Where the training loop sends its metrics: the wandb run of this process.
+    """
+
+    def log(self, data: Dict[str, Any], commit: bool = True):
+        wandb.log(data, commit=commit)
+
+    def watch(self, model: nn.Module, log: str = 'all'):
+        wandb.watch(model, log=log)
+
+    def summary(self, key: str, value: Any):
+        if wandb.run is not None:
+            wandb.run.summary[key] = value
+
+
+class BufferedLogger(WandbLogger):
+    """
+    Keeps the metrics in memory, for processes without a wandb run (e.g. the workers of
+    main_loop.run_inner_folds_in_parallel()), so they can be sent later with replay(). Models are not watched, as their
+    gradients only exist in this process.
+    """
+
+    def __init__(self):
+        self.entries: List[Tuple[str, Any, Any]] = []
+
+    def log(self, data: Dict[str, Any], commit: bool = True):
+        self.entries.append(('log', data, commit))
+
+    def watch(self, model: nn.Module, log: str = 'all'):
+        pass
+
+    def summary(self, key: str, value: Any):
+        self.entries.append(('summary', key, value))
+
+    def replay(self, logger: WandbLogger):
+        for kind, first, second in self.entries:
+            if kind == 'log':
+                logger.log(first, commit=second)
+            else:
+                logger.summary(first, second)
+
+
+# To be used as default argument where metrics go to wandb as usual
+WANDB_LOGGER = WandbLogger()
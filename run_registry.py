@@ -0,0 +1,345 @@
+import argparse
+import glob
+import json
+import os
+import re
+import sqlite3
+import time
+import uuid
+from typing import Dict, Any, List, Optional
+
+import numpy as np
+
+from checkpoints import CheckpointStore, CHECKPOINT_STORE_PATH
+from utils import AnalysisType, DatasetType, ConnType, ConvStrategy, EncodingStrategy, Normalisation, \
+    PoolingStrategy, SweepType
+
+REGISTRY_PATH = 'logs/run_registry.db'
+
+# Keys of run_cfg which are saved as the value of their enum
+RUN_CFG_ENUMS = {'analysis_type': AnalysisType,
+                 'dataset_type': DatasetType,
+                 'param_conn_type': ConnType,
+                 'param_conv_strategy': ConvStrategy,
+                 'param_encoding_strategy': EncodingStrategy,
+                 'param_normalisation': Normalisation,
+                 'param_pooling': PoolingStrategy,
+                 'sweep_type': SweepType}
+
+# run_cfg keys with their own (indexed) column, for the most common queries
+INDEXED_KEYS = ['analysis_type', 'dataset_type', 'target_var', 'split_to_test', 'sweep_type', 'param_pooling']
+
+# Name given by utils.create_name_for_model() before the CheckpointStore, where enums only kept their first 3 letters
+LEGACY_CHECKPOINT_NAME = re.compile(
+    r'(?P<target_var>[^_]+)_(?P<dataset_type>[^_]+)_(?P<outer_split_num>\d+)_(?P<inner_split_num>\d+)_'
+    r'(?P<metric_evaluated>[^_]+)_'
+    r'V_(?P<model_version>.+?)TL_(?P<time_length>\d+)D_(?P<dropout>[\d.e-]+)A_(?P<activation>[a-z]+)'
+    r'P_(?P<pooling>.{3})CS_(?P<conv_strategy>.{3})CH_(?P<channels_conv>\d+)FS_(?P<final_sigmoid>[TF])'
+    r'T_(?P<sweep_type>.{3})W_(?P<edge_weights>[TF])GH_(?P<gat_heads>\d+)GL_(?P<num_gnn_layers>\d+)'
+    r'E_(?P<encoding_strategy>.{3})M_(?P<multimodal_size>\d+)S_(?P<temporal_embed_size>\d+)_'
+    r'(?P<lr>[^_]+)_(?P<weight_decay>[^_]+)_(?P<n_epochs>\d+)_(?P<threshold>\d+)_(?P<normalisation>.{3})_'
+    r'(?P<batch_size>\d+)_(?P<num_nodes>\d+)_(?P<conn_type>[a-z]+)\.pth$')
+
+
+def _to_json(obj: Any) -> str:
+    def default(value):
+        if isinstance(value, np.generic):
+            return value.item()
+        if isinstance(value, np.ndarray):
+            return value.tolist()
+        return str(value)
+
+    return json.dumps(obj, default=default)
+
+
+def _enum_value(value: Any) -> Any:
+    return getattr(value, 'value', value)
+
+
+def _enum_from_prefix(enum_class, prefix: str):
+    matches = [member for member in enum_class if member.value[:3] == prefix]
+    if len(matches) != 1:
+        raise ValueError(f'{prefix} is not the prefix of a single {enum_class.__name__}')
+    return matches[0]
+
+
+def analysis_type_of(multimodal_size: int) -> AnalysisType:
+    # As set in main_loop.create_run_cfg()
+    return AnalysisType.ST_MULTIMODAL if multimodal_size > 0 else AnalysisType.ST_UNIMODAL
+
+
+def legacy_checkpoint_config(legacy_path: str) -> Optional[Dict[str, Any]]:
+    """
+    Configuration of a checkpoint saved with its old long name, as main_loop.create_st_model_checkpoint_config() would
+    create it, so checkpoints of runs which are not in the registry can also be moved to the CheckpointStore.
+
+    :return: None if the name is not one given by utils.create_name_for_model()
+    """
+    match = LEGACY_CHECKPOINT_NAME.match(os.path.basename(legacy_path))
+    if match is None:
+        return None
+    values = match.groupdict()
+    try:
+        config = {'target_var': values['target_var'],
+                  'dataset_type': DatasetType(values['dataset_type']),
+                  'outer_split_num': int(values['outer_split_num']),
+                  'inner_split_num': int(values['inner_split_num']),
+                  'metric_evaluated': values['metric_evaluated'],
+                  'model_version': values['model_version'],
+                  'time_length': int(values['time_length']),
+                  'dropout': float(values['dropout']),
+                  'activation': values['activation'],
+                  'pooling': _enum_from_prefix(PoolingStrategy, values['pooling']),
+                  'conv_strategy': _enum_from_prefix(ConvStrategy, values['conv_strategy']),
+                  'channels_conv': int(values['channels_conv']),
+                  'final_sigmoid': values['final_sigmoid'] == 'T',
+                  'sweep_type': _enum_from_prefix(SweepType, values['sweep_type']),
+                  'edge_weights': values['edge_weights'] == 'T',
+                  'gat_heads': int(values['gat_heads']),
+                  'num_gnn_layers': int(values['num_gnn_layers']),
+                  'encoding_strategy': _enum_from_prefix(EncodingStrategy, values['encoding_strategy']),
+                  'multimodal_size': int(values['multimodal_size']),
+                  'temporal_embed_size': int(values['temporal_embed_size']),
+                  'lr': float(values['lr']),
+                  'weight_decay': float(values['weight_decay']),
+                  'n_epochs': int(values['n_epochs']),
+                  'threshold': int(values['threshold']),
+                  'normalisation': _enum_from_prefix(Normalisation, values['normalisation']),
+                  'batch_size': int(values['batch_size']),
+                  'num_nodes': int(values['num_nodes']),
+                  'conn_type': ConnType(values['conn_type'])}
+    except ValueError:
+        return None
+    config['analysis_type'] = analysis_type_of(config['multimodal_size'])
+    return config
+
+
+def restore_run_cfg(run_cfg: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    run_cfg as created by main_loop.create_run_cfg(), from its json representation.
+    """
+    run_cfg = dict(run_cfg)
+    for key, enum_class in RUN_CFG_ENUMS.items():
+        if run_cfg.get(key) is not None:
+            run_cfg[key] = enum_class(run_cfg[key])
+    return run_cfg
+
+
+class RunRegistry:
+    """
+    Local SQLite database with the run_cfg, metrics (with the same keys as in the wandb summary) and path of the saved
+    model of every finished run, so evaluation scripts can find their runs without querying the wandb API.
+    """
+
+    def __init__(self, db_path: str = REGISTRY_PATH):
+        self.db_path = db_path
+        if os.path.dirname(db_path):
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        with self.__connect() as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS runs ('
+                         'run_id TEXT PRIMARY KEY, created REAL, '
+                         + ', '.join(f'{key} TEXT' for key in INDEXED_KEYS) +
+                         ', run_cfg TEXT, summary TEXT, checkpoint_path TEXT)')
+            conn.execute(f'CREATE INDEX IF NOT EXISTS runs_query ON runs ({", ".join(INDEXED_KEYS)})')
+
+    def __connect(self) -> sqlite3.Connection:
+        # Sweep workers might register runs at the same time
+        conn = sqlite3.connect(self.db_path, timeout=60)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def register(self, run_id: Optional[str], run_cfg: Dict[str, Any], summary: Dict[str, Any],
+                 checkpoint_path: Optional[str]) -> str:
+        """
+        Saves a run, replacing any previous one with the same run_id.
+
+        :param run_id: the wandb run id, a random one is generated if None
+        :return: the run_id
+        """
+        if run_id is None:
+            run_id = uuid.uuid4().hex[:8]
+        indexed_values = [None if run_cfg.get(key) is None else str(_enum_value(run_cfg[key]))
+                          for key in INDEXED_KEYS]
+        with self.__connect() as conn:
+            conn.execute(f'INSERT OR REPLACE INTO runs (run_id, created, {", ".join(INDEXED_KEYS)}, run_cfg, summary, '
+                         f'checkpoint_path) VALUES ({", ".join("?" * (len(INDEXED_KEYS) + 5))})',
+                         [run_id, time.time()] + indexed_values + [_to_json(run_cfg), _to_json(summary),
+                                                                   checkpoint_path])
+        return run_id
+
+    def get(self, run_id: str) -> Optional[Dict[str, Any]]:
+        """
+        :return: dictionary with run_id, run_cfg (with its enums), summary and checkpoint_path, or None if not there
+        """
+        with self.__connect() as conn:
+            row = conn.execute('SELECT * FROM runs WHERE run_id = ?', (run_id,)).fetchone()
+        return None if row is None else self.__to_record(row)
+
+    def query(self, order_by: str = None, descending: bool = False, limit: int = None,
+              **filters) -> List[Dict[str, Any]]:
+        """
+        Runs whose run_cfg matches all filters, e.g. query(target_var='gender', param_pooling=PoolingStrategy.DIFFPOOL,
+        order_by='mean_val_loss', limit=1) for the best DiffPool run.
+
+        :param order_by: key of the summary to sort the runs with, otherwise they are sorted by creation time
+        """
+        conditions, values = [], []
+        for key, value in filters.items():
+            column = key if key in INDEXED_KEYS else f"json_extract(run_cfg, '$.{key}')"
+            conditions.append(f'{column} = ?')
+            values.append(str(_enum_value(value)) if key in INDEXED_KEYS else _enum_value(value))
+        sql = 'SELECT * FROM runs'
+        if conditions:
+            sql += ' WHERE ' + ' AND '.join(conditions)
+        if order_by is not None:
+            sql += f" ORDER BY json_extract(summary, '$.{order_by}') {'DESC' if descending else 'ASC'}"
+        else:
+            sql += ' ORDER BY created'
+        if limit is not None:
+            sql += f' LIMIT {int(limit)}'
+        with self.__connect() as conn:
+            rows = conn.execute(sql, values).fetchall()
+        return [self.__to_record(row) for row in rows]
+
+    def get_or_import(self, run_id: str, overrides: Dict[str, Any] = None) -> Dict[str, Any]:
+        """
+        Like get(), but runs from before the registry existed are imported once from the wandb API. Checkpoints are not
+        moved (see migrate_checkpoints()).
+        """
+        record = self.get(run_id)
+        if record is None:
+            print(f'Run {run_id} not in the registry, importing it from wandb')
+            record = self.import_from_wandb(run_id, overrides)
+        return record
+
+    def import_from_wandb(self, run_id: str, overrides: Dict[str, Any] = None,
+                          entity_project: str = 'st-team/spatio-temporal-brain') -> Dict[str, Any]:
+        """
+        Registers a run saved only in wandb. Its checkpoint_path is the one in the CheckpointStore if the model is
+        there, otherwise the old name of the model, recreated from its config as it was done in the evaluation scripts.
+
+        :param overrides: values which lost precision when saved in wandb ('lr', 'weight_d', 'dropout' and 'ode' for
+                          colsample_bynode), and 'model_v' for models saved with an older SpatioTemporalModel.VERSION
+        """
+        import wandb
+        from main_loop import create_run_cfg, generate_st_model, create_st_model_checkpoint_config, generate_xgb_model
+        from utils import create_name_for_xgbmodel, create_name_for_model
+
+        overrides = {} if overrides is None else overrides
+        best_run = wandb.Api().run(f'/{entity_project}/runs/{run_id}')
+        run_cfg = create_run_cfg(dict(best_run.config))
+        for key, run_cfg_key in [('lr', 'param_lr'), ('weight_d', 'param_weight_decay'), ('dropout', 'param_dropout'),
+                                 ('ode', 'colsample_bynode')]:
+            if key in overrides:
+                run_cfg[run_cfg_key] = float(overrides[key])
+
+        inner_fold_for_val: int = 1
+        if run_cfg['analysis_type'] == AnalysisType.FLATTEN_CORRS:
+            checkpoint_path = create_name_for_xgbmodel(model=generate_xgb_model(run_cfg),
+                                                       outer_split_num=run_cfg['split_to_test'],
+                                                       inner_split_num=inner_fold_for_val,
+                                                       run_cfg=run_cfg)
+        else:
+            model = generate_st_model(run_cfg, for_test=True)
+            checkpoint_config = create_st_model_checkpoint_config(run_cfg, model, run_cfg['split_to_test'],
+                                                                  inner_fold_for_val)
+            # Name given by create_name_for_model() before the CheckpointStore
+            if 'model_v' in overrides:
+                model.VERSION = overrides['model_v']
+            checkpoint_path = create_name_for_model(target_var=run_cfg['target_var'],
+                                                    model=model,
+                                                    outer_split_num=run_cfg['split_to_test'],
+                                                    inner_split_num=inner_fold_for_val,
+                                                    n_epochs=run_cfg['num_epochs'],
+                                                    threshold=run_cfg['param_threshold'],
+                                                    batch_size=run_cfg['batch_size'],
+                                                    num_nodes=run_cfg['num_nodes'],
+                                                    conn_type=run_cfg['param_conn_type'],
+                                                    normalisation=run_cfg['param_normalisation'],
+                                                    analysis_type=run_cfg['analysis_type'],
+                                                    metric_evaluated='loss',
+                                                    dataset_type=run_cfg['dataset_type'],
+                                                    lr=run_cfg['param_lr'],
+                                                    weight_decay=run_cfg['param_weight_decay'],
+                                                    edge_weights=run_cfg['edge_weights'])
+            if 'model_v' in overrides:
+                # We know the very specific "old" cases
+                if run_cfg['param_pooling'] == PoolingStrategy.DIFFPOOL:
+                    checkpoint_path = checkpoint_path.replace('T_difW_F', 'GC_FGA_F')
+                elif run_cfg['param_pooling'] == PoolingStrategy.MEAN:
+                    checkpoint_path = checkpoint_path.replace('T_no_W_F', 'GC_FGA_F')
+            store = CheckpointStore(run_cfg.get('checkpoint_store', CHECKPOINT_STORE_PATH))
+            checkpoint_path = store.existing_path(checkpoint_config) or checkpoint_path
+
+        summary = {key: value for key, value in best_run.summary.items()
+                   if key.startswith(('mean_val_', 'std_val_', 'values_val_', 'values_test_'))}
+        self.register(run_id, run_cfg, summary, checkpoint_path)
+        return self.get(run_id)
+
+    def migrate_checkpoints(self, legacy_dir: str = 'logs') -> List[str]:
+        """
+        Moves every checkpoint to its path in the CheckpointStore, which is only done here:
+        - models of registered runs saved with their old long names, or under an older configuration of the store,
+          updating their checkpoint_path
+        - other files in legacy_dir with the old long names of utils.create_name_for_model()
+        - checkpoints in the store whose configuration has no analysis_type, from before it was added
+
+        :return: new paths of the moved checkpoints
+        """
+        migrated = []
+        store_roots = {CHECKPOINT_STORE_PATH}
+        for record in self.query():
+            run_cfg, checkpoint_path = record['run_cfg'], record['checkpoint_path']
+            if run_cfg['analysis_type'] == AnalysisType.FLATTEN_CORRS or checkpoint_path is None or \
+                    not os.path.exists(checkpoint_path):
+                continue
+            store = CheckpointStore(run_cfg.get('checkpoint_store', CHECKPOINT_STORE_PATH))
+            store_roots.add(store.root)
+            from main_loop import generate_st_model, create_st_model_checkpoint_config
+            model = generate_st_model(run_cfg, for_test=True)
+            new_path = store.migrate(checkpoint_path,
+                                     create_st_model_checkpoint_config(run_cfg, model, run_cfg['split_to_test'], 1))
+            if new_path != checkpoint_path:
+                with self.__connect() as conn:
+                    conn.execute('UPDATE runs SET checkpoint_path = ? WHERE run_id = ?', (new_path, record['run_id']))
+                migrated.append(new_path)
+
+        store = CheckpointStore(CHECKPOINT_STORE_PATH)
+        for legacy_path in sorted(glob.glob(os.path.join(legacy_dir, '*.pth'))):
+            checkpoint_config = legacy_checkpoint_config(legacy_path)
+            if checkpoint_config is None:
+                print(f'Not migrating {legacy_path}: not named by create_name_for_model()')
+                continue
+            new_path = store.migrate(legacy_path, checkpoint_config)
+            if new_path != legacy_path:
+                migrated.append(new_path)
+
+        for root in store_roots:
+            store = CheckpointStore(root)
+            for checkpoint_path, checkpoint_config in store.find():
+                if 'analysis_type' in checkpoint_config or 'multimodal_size' not in checkpoint_config:
+                    continue
+                checkpoint_config['analysis_type'] = analysis_type_of(checkpoint_config['multimodal_size'])
+                new_path = store.migrate(checkpoint_path, checkpoint_config)
+                if new_path != checkpoint_path:
+                    migrated.append(new_path)
+        return migrated
+
+    @staticmethod
+    def __to_record(row: sqlite3.Row) -> Dict[str, Any]:
+        return {'run_id': row['run_id'],
+                'created': row['created'],
+                'run_cfg': restore_run_cfg(json.loads(row['run_cfg'])),
+                'summary': json.loads(row['summary']),
+                'checkpoint_path': row['checkpoint_path']}
+
+
+# python run_registry.py
+# python run_registry.py --legacy_dir logs
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Moves all checkpoints with old names to the CheckpointStore')
+    parser.add_argument('--legacy_dir', default='logs', help='Directory of the checkpoints with old names')
+    args = parser.parse_args()
+
+    migrated_paths = RunRegistry().migrate_checkpoints(args.legacy_dir)
+    print('Migrated', len(migrated_paths), 'checkpoints')
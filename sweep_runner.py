@@ -0,0 +1,459 @@
+"""
+Local executor for the sweeps in wandb_sweeps/*.yaml, without needing `wandb agent` nor an internet connection.
+
+Configurations are sampled from the .yaml parameter space and put in a SQLite job queue. The queue file can be in a
+filesystem shared by several machines, each one running its own workers:
+
+    python sweep_runner.py enqueue wandb_sweeps/hcp/some_sweep.yaml --count 50 --db sweeps.db
+    python sweep_runner.py work --db sweeps.db --workers 4 --devices cuda:0 cuda:1
+    python sweep_runner.py status --db sweeps.db
+
+Workers are long-lived processes, forked after the datasets needed by the pending jobs are loaded (in shared memory),
+so each trial only pays for its own training. Results of each trial are stored back in the queue.
+
+With `early_terminate: {type: hyperband, min_iter: 3, eta: 3}` in the .yaml, trials are stopped by ASHA based on their
+validation loss (see ASHAScheduler).
+"""
+import argparse
+import copy
+import itertools
+import json
+import math
+import multiprocessing
+import os
+import random
+import socket
+import sqlite3
+import time
+import threading
+import traceback
+from contextlib import contextmanager
+from typing import Dict, Any, List, Optional, Tuple
+
+import numpy as np
+import torch
+import wandb
+import yaml
+
+from utils import AnalysisType, DeviceLeaseManager, create_name_for_brain_dataset, \
+    create_name_for_flattencorrs_dataset, process_is_alive
+
+# Per worker process: datasets already loaded, by name of the dataset
+_datasets_cache: Dict[str, Any] = {}
+
+
+def sample_configs(sweep_cfg: Dict[str, Any], count: int, seed: int = 0) -> List[Dict[str, Any]]:
+    """
+    Samples configurations like wandb does for `method: random` (log_uniform bounds are natural logs), or
+    enumerates all of them for `method: grid`.
+    """
+    parameters: Dict[str, Dict[str, Any]] = sweep_cfg['parameters']
+
+    if sweep_cfg.get('method', 'random') == 'grid':
+        keys = list(parameters.keys())
+        all_values = [[param['value']] if 'value' in param else param['values'] for param in parameters.values()]
+        return [dict(zip(keys, values)) for values in itertools.product(*all_values)]
+    elif sweep_cfg.get('method', 'random') != 'random':
+        print('Only random and grid sweeps can be run locally')
+        exit(-1)
+
+    rng = random.Random(seed)
+    configs = []
+    for _ in range(count):
+        config = {}
+        for name, param in parameters.items():
+            distribution = param.get('distribution', 'constant' if 'value' in param else 'categorical')
+            if distribution == 'constant':
+                config[name] = param['value']
+            elif distribution == 'categorical':
+                config[name] = rng.choice(param['values'])
+            elif distribution == 'uniform':
+                config[name] = rng.uniform(param['min'], param['max'])
+            elif distribution == 'log_uniform':
+                config[name] = math.exp(rng.uniform(param['min'], param['max']))
+            elif distribution == 'int_uniform':
+                config[name] = rng.randint(param['min'], param['max'])
+            else:
+                print('Unrecognised distribution:', distribution)
+                exit(-1)
+        configs.append(config)
+    return configs
+
+
+class JobQueue:
+    """
+    Jobs stored in a SQLite file. Each job is claimed inside an exclusive transaction, thus only one worker (of any
+    machine sharing the file) will get it.
+
+    Workers are named "hostname:pid" and update the heartbeat of their running job (see keep_alive()). A running job
+    whose worker is no longer alive in this host, or whose heartbeat is older than stale_after seconds (e.g. the
+    machine died), is put back as pending by the next claim().
+    """
+
+    def __init__(self, db_path: str, timeout: float = 120, stale_after: float = 600):
+        self.db_path: str = db_path
+        self.timeout: float = timeout
+        self.stale_after: float = stale_after
+        with self.__connect() as conn:
+            conn.execute('''CREATE TABLE IF NOT EXISTS jobs (
+                                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                                sweep TEXT NOT NULL,
+                                config TEXT NOT NULL,
+                                status TEXT NOT NULL DEFAULT 'pending',
+                                worker TEXT,
+                                created REAL,
+                                started REAL,
+                                finished REAL,
+                                result TEXT,
+                                error TEXT,
+                                heartbeat REAL)''')
+            # Queues created before heartbeats were stored
+            if 'heartbeat' not in [row[1] for row in conn.execute('PRAGMA table_info(jobs)')]:
+                conn.execute('ALTER TABLE jobs ADD COLUMN heartbeat REAL')
+            # Sweep-level settings, e.g. early_terminate from the .yaml
+            conn.execute('CREATE TABLE IF NOT EXISTS sweeps (name TEXT PRIMARY KEY, early_terminate TEXT)')
+            # Intermediate results of the trials at each rung of the scheduler
+            conn.execute('''CREATE TABLE IF NOT EXISTS rungs (
+                                sweep TEXT NOT NULL,
+                                job_id INTEGER NOT NULL,
+                                epoch INTEGER NOT NULL,
+                                loss REAL NOT NULL,
+                                PRIMARY KEY (job_id, epoch))''')
+
+    def __connect(self) -> sqlite3.Connection:
+        # isolation_level=None so that transactions are only the explicit ones
+        return sqlite3.connect(self.db_path, timeout=self.timeout, isolation_level=None)
+
+    def enqueue(self, sweep_name: str, configs: List[Dict[str, Any]], early_terminate: Dict[str, Any] = None):
+        now = time.time()
+        with self.__connect() as conn:
+            conn.execute('INSERT OR REPLACE INTO sweeps (name, early_terminate) VALUES (?, ?)',
+                         (sweep_name, json.dumps(early_terminate)))
+            conn.executemany('INSERT INTO jobs (sweep, config, created) VALUES (?, ?, ?)',
+                             [(sweep_name, json.dumps(config), now) for config in configs])
+
+    def pending_configs(self, sweep_name: str = None) -> List[Dict[str, Any]]:
+        query = "SELECT config FROM jobs WHERE status = 'pending'"
+        params: Tuple = ()
+        if sweep_name is not None:
+            query += ' AND sweep = ?'
+            params = (sweep_name,)
+        with self.__connect() as conn:
+            return [json.loads(row[0]) for row in conn.execute(query, params)]
+
+    def early_terminate(self, sweep_name: str) -> Optional[Dict[str, Any]]:
+        with self.__connect() as conn:
+            row = conn.execute('SELECT early_terminate FROM sweeps WHERE name = ?', (sweep_name,)).fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+    def report_rung(self, sweep_name: str, job_id: int, epoch: int, loss: float) -> List[float]:
+        """
+        Stores the loss of a trial at a rung, and returns the losses of all trials of the sweep at that rung so far.
+        """
+        with self.__connect() as conn:
+            conn.execute('INSERT OR REPLACE INTO rungs (sweep, job_id, epoch, loss) VALUES (?, ?, ?, ?)',
+                         (sweep_name, job_id, epoch, loss))
+            return [row[0] for row in conn.execute('SELECT loss FROM rungs WHERE sweep = ? AND epoch = ?',
+                                                   (sweep_name, epoch))]
+
+    def __requeue_lost_jobs(self, conn: sqlite3.Connection):
+        now = time.time()
+        lost = [(job_id, worker) for job_id, worker, heartbeat in
+                conn.execute("SELECT id, worker, heartbeat FROM jobs WHERE status = 'running'")
+                if not process_is_alive(worker) or (heartbeat or 0) < now - self.stale_after]
+        for job_id, worker in lost:
+            print(f'Job {job_id} of {worker} lost, back to pending')
+            conn.execute("UPDATE jobs SET status = 'pending', worker = NULL, started = NULL, heartbeat = NULL "
+                         "WHERE id = ?", (job_id,))
+
+    def claim(self, worker_name: str, sweep_name: str = None) -> Optional[Tuple[int, str, Dict[str, Any]]]:
+        """
+        :param worker_name: "hostname:pid" of the worker process
+        """
+        conn = self.__connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            self.__requeue_lost_jobs(conn)
+            query = "SELECT id, sweep, config FROM jobs WHERE status = 'pending'"
+            params: Tuple = ()
+            if sweep_name is not None:
+                query += ' AND sweep = ?'
+                params = (sweep_name,)
+            row = conn.execute(query + ' ORDER BY id LIMIT 1', params).fetchone()
+            if row is None:
+                conn.execute('COMMIT')
+                return None
+            now = time.time()
+            conn.execute("UPDATE jobs SET status = 'running', worker = ?, started = ?, heartbeat = ? WHERE id = ?",
+                         (worker_name, now, now, row[0]))
+            conn.execute('COMMIT')
+        except sqlite3.Error:
+            conn.execute('ROLLBACK')
+            raise
+        finally:
+            conn.close()
+        return row[0], row[1], json.loads(row[2])
+
+    def heartbeat(self, job_id: int, worker_name: str):
+        with self.__connect() as conn:
+            conn.execute("UPDATE jobs SET heartbeat = ? WHERE id = ? AND worker = ? AND status = 'running'",
+                         (time.time(), job_id, worker_name))
+
+    @contextmanager
+    def keep_alive(self, job_id: int, worker_name: str, interval: float = 60):
+        """
+        Updates the heartbeat of the job every interval seconds from a background thread, while the job runs.
+        """
+        stop = threading.Event()
+
+        def beat():
+            while not stop.wait(interval):
+                try:
+                    self.heartbeat(job_id, worker_name)
+                except sqlite3.Error as error:
+                    print(f'Heartbeat of job {job_id} failed:', error)
+
+        thread = threading.Thread(target=beat, daemon=True)
+        thread.start()
+        try:
+            yield
+        finally:
+            stop.set()
+            thread.join()
+
+    def finish(self, job_id: int, result: Dict[str, Any] = None, error: str = None):
+        """
+        Marks the job as failed (with error), stopped (by the scheduler, see run_trial()) or done.
+        """
+        if error is not None:
+            status = 'failed'
+        elif result is not None and result.get('stopped_epoch') is not None:
+            status = 'stopped'
+        else:
+            status = 'done'
+        with self.__connect() as conn:
+            conn.execute('UPDATE jobs SET status = ?, finished = ?, result = ?, error = ? WHERE id = ?',
+                         (status, time.time(), json.dumps(result, default=float), error, job_id))
+
+    def status(self) -> List[Tuple[str, str, int]]:
+        with self.__connect() as conn:
+            return conn.execute('SELECT sweep, status, COUNT(*) FROM jobs GROUP BY sweep, status '
+                                'ORDER BY sweep, status').fetchall()
+
+
+class ASHAScheduler:
+    """
+    Asynchronous successive halving (ASHA) for one trial, given as trial_reporter to main_loop.run_experiment().
+
+    Rungs are at epochs min_iter * eta^k. When the trial reaches a rung, its best validation loss so far is compared
+    with the ones of all trials of the sweep that already got there: it is only promoted to the next rung if it is in
+    the best 1/eta of them. There is no waiting for other trials, thus the first ones to arrive are always promoted.
+
+    This is the stopping variant of ASHA only: a trial that is stopped is never resumed, even if later trials do worse
+    at that rung, and trials are not started from the lowest rung's checkpoints. Stopped trials are marked as 'stopped'
+    in the JobQueue, without test metrics.
+    """
+
+    def __init__(self, job_queue: JobQueue, sweep_name: str, job_id: int, max_iter: int, min_iter: int = 3,
+                 eta: int = 3):
+        self.job_queue: JobQueue = job_queue
+        self.sweep_name: str = sweep_name
+        self.job_id: int = job_id
+        self.eta: int = eta
+        self.rungs: List[int] = []
+        rung = min_iter
+        while rung < max_iter:
+            self.rungs.append(rung)
+            rung *= eta
+        self.stopped_epoch: Optional[int] = None
+
+    @classmethod
+    def from_early_terminate(cls, early_terminate: Optional[Dict[str, Any]], job_queue: JobQueue, sweep_name: str,
+                             job_id: int, num_epochs: int) -> Optional['ASHAScheduler']:
+        """
+        Uses the `early_terminate` section of the sweep .yaml (only type: hyperband, with min_iter and eta).
+        """
+        if not early_terminate or early_terminate.get('type') != 'hyperband':
+            return None
+        return cls(job_queue, sweep_name, job_id,
+                   max_iter=early_terminate.get('max_iter', num_epochs),
+                   min_iter=early_terminate.get('min_iter', 3),
+                   eta=early_terminate.get('eta', 3))
+
+    def __call__(self, epoch: int, loss: float) -> bool:
+        if epoch not in self.rungs:
+            return True
+        rung_losses = self.job_queue.report_rung(self.sweep_name, self.job_id, epoch, loss)
+        cutoff = np.percentile(rung_losses, 100 / self.eta)
+        if loss > cutoff:
+            print(f'ASHA: stopping at epoch {epoch}, loss {round(loss, 5)} worse than cutoff {round(cutoff, 5)}')
+            self.stopped_epoch = epoch
+            return False
+        return True
+
+
+def dataset_name(run_cfg: Dict[str, Any]) -> str:
+    if run_cfg['analysis_type'] == AnalysisType.FLATTEN_CORRS:
+        return create_name_for_flattencorrs_dataset(run_cfg)
+    return create_name_for_brain_dataset(num_nodes=run_cfg['num_nodes'],
+                                         time_length=run_cfg['time_length'],
+                                         target_var=run_cfg['target_var'],
+                                         threshold=run_cfg['param_threshold'],
+                                         normalisation=run_cfg['param_normalisation'],
+                                         connectivity_type=run_cfg['param_conn_type'],
+                                         analysis_type=run_cfg['analysis_type'],
+                                         encoding_strategy=run_cfg['param_encoding_strategy'],
+                                         dataset_type=run_cfg['dataset_type'],
+                                         edge_weights=run_cfg['edge_weights'])
+
+
+def load_dataset(run_cfg: Dict[str, Any]):
+    """
+    Loads the dataset for run_cfg only once per process, with its tensors in shared memory.
+    """
+    from main_loop import generate_dataset
+
+    name = dataset_name(run_cfg)
+    if name not in _datasets_cache:
+        dataset = generate_dataset(run_cfg)
+        for _, tensor in dataset.data:
+            if torch.is_tensor(tensor):
+                tensor.share_memory_()
+        _datasets_cache[name] = dataset
+    return _datasets_cache[name]
+
+
+def trial_copy(dataset):
+    """
+    Shallow copy of the dataset in which the labels can be changed (e.g. scaling for regression) without touching the
+    shared one, as indexing the dataset gives views of its tensors.
+    """
+    trial_dataset = copy.copy(dataset)
+    trial_dataset.data = copy.copy(dataset.data)
+    trial_dataset.data.y = dataset.data.y.clone()
+    return trial_dataset
+
+
+def run_trial(config: Dict[str, Any], device_run: str, scheduler: ASHAScheduler = None,
+              run_id: str = None) -> Dict[str, Any]:
+    """
+    :param run_id: id of the wandb run (a random one if None), which also keys the training state to resume from
+    """
+    from main_loop import create_run_cfg, run_experiment
+
+    torch.manual_seed(1)
+    np.random.seed(1111)
+    random.seed(1111)
+    torch.cuda.manual_seed_all(1111)
+
+    # Offline run, so that wandb.log() and wandb.run.summary are still there for main_loop. WANDB_MODE=dryrun works
+    # with the pinned wandb 0.8.31 (wandb.init(mode=...) does not exist before 0.10)
+    os.environ['WANDB_MODE'] = 'dryrun'
+    wandb.init(config=config, reinit=True, id=run_id)
+    run_cfg = create_run_cfg(config, device_run=device_run)
+    print('Resulting run_cfg:', run_cfg)
+
+    start = time.time()
+    overall_metrics, test_metrics = run_experiment(run_cfg, dataset=trial_copy(load_dataset(run_cfg)),
+                                                   trial_reporter=scheduler)
+    return {'inner': overall_metrics, 'test': test_metrics, 'train_time': time.time() - start,
+            'stopped_epoch': scheduler.stopped_epoch if scheduler is not None else None}
+
+
+def worker_loop(db_path: str, device_run: Optional[str], sweep_name: Optional[str], wait: float):
+    if device_run is None:
+        # A GPU if the machine has any (waiting for a free one), kept by the worker for all its jobs
+        with DeviceLeaseManager.from_available_devices().lease() as leased_device:
+            return worker_loop(db_path, leased_device, sweep_name, wait)
+
+    # Because of strange bug with symbolic links in server
+    os.environ['WANDB_DISABLE_CODE'] = 'true'
+    job_queue = JobQueue(db_path)
+    worker_name = f'{socket.gethostname()}:{os.getpid()}'
+
+    while True:
+        job = job_queue.claim(worker_name, sweep_name)
+        if job is None:
+            if wait <= 0:
+                break
+            time.sleep(wait)
+            continue
+
+        job_id, job_sweep, config = job
+        print(f'[{worker_name}] Job {job_id} on {device_run}:', config)
+        scheduler = ASHAScheduler.from_early_terminate(job_queue.early_terminate(job_sweep), job_queue, job_sweep,
+                                                       job_id, config.get('num_epochs', 0))
+        try:
+            with job_queue.keep_alive(job_id, worker_name):
+                # Same run id if the job is requeued, so it resumes from its training state (with checkpoint_interval)
+                result = run_trial(config, device_run, scheduler, run_id=f'{job_sweep}-{job_id}')
+        except (Exception, SystemExit):
+            # main_loop calls exit() for invalid configurations
+            job_queue.finish(job_id, error=traceback.format_exc())
+            print(f'[{worker_name}] Job {job_id} failed')
+        else:
+            job_queue.finish(job_id, result=result)
+            if result['stopped_epoch'] is not None:
+                print(f'[{worker_name}] Job {job_id} stopped at epoch {result["stopped_epoch"]}')
+            else:
+                print(f'[{worker_name}] Job {job_id} done in {round(result["train_time"], 1)}s')
+
+
+def run_workers(db_path: str, num_workers: int, devices: List[str], sweep_name: str = None, wait: float = 0):
+    from main_loop import create_run_cfg
+
+    # Datasets of the jobs pending at this point are loaded before forking, so all workers share them
+    for config in JobQueue(db_path).pending_configs(sweep_name):
+        try:
+            load_dataset(create_run_cfg(config, device_run='cpu'))
+        except (Exception, SystemExit):
+            print('Dataset not preloaded for', config)
+
+    # Fork, not spawn, to keep the loaded datasets (CUDA is not initialised in this process)
+    context = multiprocessing.get_context('fork')
+    workers = []
+    for worker_num in range(num_workers):
+        device_run = devices[worker_num % len(devices)] if devices else None
+        worker = context.Process(target=worker_loop, args=(db_path, device_run, sweep_name, wait))
+        worker.start()
+        workers.append(worker)
+    for worker in workers:
+        worker.join()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Local sweep runner with a SQLite job queue')
+    parser.add_argument('--db', default='sweeps.db', help='SQLite file with the job queue')
+    subparsers = parser.add_subparsers(dest='command')
+
+    enqueue_parser = subparsers.add_parser('enqueue', help='Samples configurations of a sweep .yaml into the queue')
+    enqueue_parser.add_argument('sweep_file')
+    enqueue_parser.add_argument('--count', type=int, default=20, help='Number of configurations (random sweeps)')
+    enqueue_parser.add_argument('--seed', type=int, default=0)
+
+    work_parser = subparsers.add_parser('work', help='Runs pending jobs with long-lived workers')
+    work_parser.add_argument('--workers', type=int, default=1)
+    work_parser.add_argument('--devices', nargs='*', default=[],
+                             help='Devices given to the workers in turns (by default, leased with DeviceLeaseManager)')
+    work_parser.add_argument('--sweep', default=None, help='Only run jobs of this sweep')
+    work_parser.add_argument('--wait', type=float, default=0,
+                             help='Seconds between checks for new jobs once the queue is empty (0 exits)')
+
+    subparsers.add_parser('status', help='Number of jobs per sweep and status')
+
+    args = parser.parse_args()
+
+    if args.command == 'enqueue':
+        with open(args.sweep_file) as fd:
+            sweep_cfg = yaml.safe_load(fd)
+        sweep_name = sweep_cfg.get('name', os.path.splitext(os.path.basename(args.sweep_file))[0])
+        configs = sample_configs(sweep_cfg, args.count, args.seed)
+        JobQueue(args.db).enqueue(sweep_name, configs, sweep_cfg.get('early_terminate'))
+        print(f'Enqueued {len(configs)} jobs for {sweep_name}')
+    elif args.command == 'work':
+        run_workers(args.db, args.workers, args.devices, args.sweep, args.wait)
+    elif args.command == 'status':
+        for sweep_name, status, count in JobQueue(args.db).status():
+            print(f'{sweep_name}: {status} {count}')
+    else:
+        parser.print_help()
@@ -4,6 +4,7 @@
 #
 
 import torch.nn as nn
+import torch.nn.functional as F
 from math import ceil
 from torch.nn import BatchNorm1d
 
@@ -17,25 +18,54 @@ class Chomp1d(nn.Module):
         return x[:, :, :-self.chomp_size].contiguous()
 
 
+class CausalConv1d(nn.Conv1d):
+    """
+    Conv1d padded only on the left, so output i only depends on the inputs up to i * stride. It gives the same outputs
+    as padding both sides and chomping the last padding / stride outputs (when padding is a multiple of stride),
+    without calculating those outputs. F.pad still makes a padded copy of the input, in place of the copy of the
+    chomped output, so the saving is in computation (padding / stride fewer outputs), not necessarily in memory.
+    """
+
+    def __init__(self, in_channels, out_channels, kernel_size, stride, padding, dilation):
+        super(CausalConv1d, self).__init__(in_channels, out_channels, kernel_size, stride=stride, dilation=dilation)
+        self.left_padding = padding
+
+    def forward(self, x):
+        return super(CausalConv1d, self).forward(F.pad(x, [self.left_padding, 0]))
+
+
 class StridedTemporalBlock(nn.Module):
     def __init__(self, n_inputs, n_hidden, n_outputs, kernel_size, stride, dilation, padding, final_output,
                  dropout=0.2):
         super(StridedTemporalBlock, self).__init__()
         self.stride = stride
-        self.conv1 = nn.Conv1d(n_inputs, n_hidden, kernel_size,
-                               stride=stride, padding=padding, dilation=dilation)
+        # Both are the same when the padding is a multiple of the stride, as in TemporalConvNet
+        causal = padding % stride == 0
+        if causal:
+            self.conv1 = CausalConv1d(n_inputs, n_hidden, kernel_size, stride=stride, padding=padding,
+                                      dilation=dilation)
+            self.conv2 = CausalConv1d(n_hidden, n_outputs, kernel_size, stride=stride, padding=padding,
+                                      dilation=dilation)
+        else:
+            self.conv1 = nn.Conv1d(n_inputs, n_hidden, kernel_size,
+                                   stride=stride, padding=padding, dilation=dilation)
+            self.conv2 = nn.Conv1d(n_hidden, n_outputs, kernel_size,
+                                   stride=stride, padding=padding, dilation=dilation)
         self.batch1 = BatchNorm1d(n_hidden)
-        self.chomp1 = Chomp1d(int(padding / stride))
         self.relu1 = nn.ReLU()
         self.dropout1 = nn.Dropout(dropout)
 
-        self.conv2 = nn.Conv1d(n_hidden, n_outputs, kernel_size,
-                               stride=stride, padding=padding, dilation=dilation)
         self.batch2 = BatchNorm1d(n_outputs)
-        self.chomp2 = Chomp1d(int(padding / stride))
         self.relu2 = nn.ReLU()
         self.dropout2 = nn.Dropout(dropout)
 
+        if causal:
+            # Placeholders keep the positions (and state_dict keys) of the modules in net
+            self.chomp1 = nn.Identity()
+            self.chomp2 = nn.Identity()
+        else:
+            self.chomp1 = Chomp1d(int(padding / stride))
+            self.chomp2 = Chomp1d(int(padding / stride))
         self.net = nn.Sequential(self.conv1, self.chomp1, self.relu1, self.batch1, self.dropout1,
                                  self.conv2, self.chomp2, self.relu2, self.batch2, self.dropout2)
         self.downsample = nn.Conv1d(n_inputs, n_outputs, 1) if n_inputs != n_outputs else None
@@ -51,9 +81,13 @@ class StridedTemporalBlock(nn.Module):
 
     def forward(self, x):
         out = self.net(x)
-        res = x if self.downsample is None else self.downsample(x)
+        res = x
+        # Averaging over time before the 1x1 convolution gives the same result, with the convolution on the (shorter)
+        # output length, and AdaptiveAvgPool1d no longer keeps the full length output of the convolution for backward
         if self.stride > 1:
             res = self.residual_downsample(res)
+        if self.downsample is not None:
+            res = self.downsample(res)
         return self.relu(out + res)
 
 
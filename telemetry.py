@@ -0,0 +1,113 @@
+import queue
+import threading
+from typing import Dict, List, Callable, Optional
+
+import torch
+import torch.nn as nn
+import wandb
+
+
+class GradientTelemetry:
+    """
+    Samples per-layer gradient and activation statistics every `interval` training steps.
+
+    Statistics are calculated on the device where the model is, and only a handful of scalars per layer are sent
+    to a background thread, which is the only place where they are copied to the host and logged. With
+    interval <= 0 nothing is registered in the model and step() does nothing, which is what production sweeps use.
+    """
+
+    def __init__(self, model: nn.Module, interval: int, layers: List[str] = None,
+                 log_fn: Callable[[Dict[str, float]], None] = None):
+        self.interval: int = interval
+        self.enabled: bool = interval > 0
+        self.log_fn = log_fn if log_fn is not None else (lambda summary: wandb.log(summary, commit=False))
+        self.num_steps: int = 0
+
+        # By default, every direct child of the model holding parameters is one "layer"
+        if layers is None:
+            layers = [name for name, module in model.named_children() if len(list(module.parameters())) > 0]
+        self.layers: Dict[str, nn.Module] = {name: getattr(model, name) for name in layers}
+
+        self._armed: bool = False
+        self._activation_stats: Dict[str, torch.Tensor] = {}
+        self._hooks = []
+        self._queue: Optional[queue.Queue] = None
+        self._worker: Optional[threading.Thread] = None
+
+        if self.enabled:
+            # First step is always sampled
+            self._armed = True
+            for name, module in self.layers.items():
+                self._hooks.append(module.register_forward_hook(self.__activation_hook(name)))
+            self._queue = queue.Queue()
+            self._worker = threading.Thread(target=self.__ship_summaries, daemon=True)
+            self._worker.start()
+
+    @staticmethod
+    def __tensor_stats(tensors: List[torch.Tensor]) -> torch.Tensor:
+        # [mean, std, max(abs), L2 norm] over all elements of the tensors, without concatenating them
+        numel = sum(tensor.numel() for tensor in tensors)
+        total = sum(tensor.sum() for tensor in tensors)
+        total_sq = sum((tensor * tensor).sum() for tensor in tensors)
+        max_abs = torch.stack([tensor.abs().max() for tensor in tensors]).max()
+
+        mean = total / numel
+        std = (total_sq / numel - mean * mean).clamp(min=0).sqrt()
+        return torch.stack([mean, std, max_abs, total_sq.sqrt()]).detach()
+
+    def __activation_hook(self, name: str):
+        def hook(module, inputs, output):
+            # Evaluation passes are not sampled
+            if not self._armed or not module.training:
+                return
+            # Some layers (e.g. MetaLayer, DiffPool) return tuples
+            outputs = output if isinstance(output, tuple) else (output,)
+            outputs = [out.detach().float() for out in outputs if torch.is_tensor(out) and out.numel() > 0]
+            if outputs:
+                self._activation_stats[name] = self.__tensor_stats(outputs)
+
+        return hook
+
+    def step(self):
+        """
+        To be called after loss.backward() and before the optimiser changes the gradients.
+        """
+        if not self.enabled:
+            return
+
+        if self._armed:
+            stats = {}
+            for name, module in self.layers.items():
+                grads = [param.grad.detach().float() for param in module.parameters() if param.grad is not None]
+                if grads:
+                    stats[f'grad_{name}'] = self.__tensor_stats(grads)
+            for name, act_stats in self._activation_stats.items():
+                stats[f'act_{name}'] = act_stats
+            self._activation_stats = {}
+            self._queue.put((self.num_steps, stats))
+
+        self.num_steps += 1
+        self._armed = self.num_steps % self.interval == 0
+
+    def __ship_summaries(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            step, stats = item
+            summary = {'telemetry_step': step}
+            for key, values in stats.items():
+                # Only place where there is a copy to the host
+                mean, std, max_abs, norm = values.cpu().tolist()
+                summary.update({f'{key}_mean': mean, f'{key}_std': std,
+                                f'{key}_max_abs': max_abs, f'{key}_norm': norm})
+            self.log_fn(summary)
+
+    def close(self):
+        for hook in self._hooks:
+            hook.remove()
+        self._hooks = []
+        if self._worker is not None:
+            self._queue.put(None)
+            self._worker.join()
+            self._worker = None
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Modules of this repository are in its root, as when running main_loop.py
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
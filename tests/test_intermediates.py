@@ -0,0 +1,44 @@
+import numpy as np
+import torch
+from torch_geometric.data import Data, InMemoryDataset
+
+from model import SpatioTemporalModel
+from post_analysis.intermediates import export_intermediates
+from utils import ConvStrategy, EncodingStrategy, PoolingStrategy, SweepType
+
+from test_model import FakeAE
+
+
+class GraphsDataset(InMemoryDataset):
+    """
+    InMemoryDataset over a list of graphs, without files.
+    """
+
+    def __init__(self, graphs):
+        super(GraphsDataset, self).__init__(None)
+        self.data, self.slices = self.collate(graphs)
+
+
+def test_export_intermediates_of_subset(tmp_path):
+    torch.manual_seed(1)
+    time_length, num_nodes = 30, 6
+    model = SpatioTemporalModel(num_time_length=time_length, dropout_perc=0.1, pooling=PoolingStrategy.MEAN,
+                                channels_conv=8, activation='relu', conv_strategy=ConvStrategy.NONE,
+                                sweep_type=SweepType.META_NODE, multimodal_size=0,
+                                encoding_strategy=EncodingStrategy.AE3layers, encoding_model=FakeAE(time_length),
+                                num_nodes=num_nodes)
+    nodes = torch.arange(num_nodes)
+    edge_index = torch.stack([nodes.repeat_interleave(num_nodes), nodes.repeat(num_nodes)])
+    graphs = [Data(x=torch.randn(num_nodes, time_length), edge_index=edge_index,
+                   edge_attr=torch.rand(edge_index.size(1), 1), y=torch.tensor([float(i)])) for i in range(5)]
+    # Same number of graphs as nodes per graph, which cannot be told apart from the shapes
+    subset = GraphsDataset(graphs)[torch.tensor([4, 1, 2, 0, 3, 2])]
+
+    arrays = export_intermediates(model, subset, str(tmp_path), batch_size=4)
+
+    assert arrays['temporal_embeddings'].shape == (6 * num_nodes, 50)
+    assert arrays['node_embeddings'].shape[0] == 6 * num_nodes
+    assert arrays['graph_embeddings'].shape[0] == 6
+    np.testing.assert_array_equal(arrays['y'].ravel(), [4, 1, 2, 0, 3, 2])
+    np.testing.assert_allclose(arrays['temporal_embeddings'][num_nodes:2 * num_nodes],
+                               model.encoder_model.encode(graphs[1].x).detach().numpy(), atol=1e-5)
@@ -0,0 +1,148 @@
+import pytest
+import torch
+import torch.nn as nn
+from torch_geometric.data import Batch, Data
+from torch_geometric.nn import GCNConv
+from torch_scatter import scatter_mean
+
+from model import EdgeModel, EdgeNodeMetaLayer, NodeModel, SpatioTemporalModel
+from utils import ConvStrategy, EncodingStrategy, PoolingStrategy, SweepType
+from utils_graphs import gcn_normalisation, sort_edges_by_destination
+
+NUM_GRAPHS, NUM_NODES, NUM_FEATURES = 8, 20, 6
+
+
+def random_batch(symmetric: bool, num_edge_features: int):
+    """
+    Batch of random graphs with self-loops, symmetric as the thresholded ones or not.
+    """
+    edge_indices, edge_attrs = [], []
+    for graph_num in range(NUM_GRAPHS):
+        mask = torch.rand(NUM_NODES, NUM_NODES) < 0.3
+        weights = torch.rand(NUM_NODES, NUM_NODES, num_edge_features)
+        if symmetric:
+            mask = mask | mask.t()
+            weights = weights + weights.transpose(0, 1)
+        mask[torch.arange(NUM_NODES), torch.arange(NUM_NODES)] = True
+        row, col = mask.nonzero().t()
+        edge_indices.append(torch.stack([row, col]) + graph_num * NUM_NODES)
+        edge_attrs.append(weights[row, col])
+    return torch.cat(edge_indices, dim=1), torch.cat(edge_attrs, dim=0)
+
+
+def concat_meta_layer(edge_model, node_model, x, edge_index, edge_attr):
+    """
+    EdgeModel.forward() and NodeModel over the concatenated inputs, as before their first layers were factorised.
+    """
+    row, col = edge_index
+    if edge_model is not None:
+        edge_attr = edge_model(x[row], x[col], edge_attr)
+    out = node_model.node_mlp_1(torch.cat([x[row], edge_attr], dim=1))
+    out = scatter_mean(out, col, dim=0, dim_size=x.size(0))
+    return node_model.node_mlp_2(torch.cat([x, out], dim=1)), edge_attr
+
+
+@pytest.mark.parametrize('symmetric', [True, False])
+@pytest.mark.parametrize('num_edge_features', [1, 0])
+@pytest.mark.parametrize('with_edge_model', [True, False])
+@pytest.mark.parametrize('sorted_edges', [True, False])
+def test_meta_layer_same_as_concatenation(symmetric, num_edge_features, with_edge_model, sorted_edges):
+    torch.manual_seed(1)
+    total_nodes = NUM_GRAPHS * NUM_NODES
+    edge_index, edge_attr = random_batch(symmetric, num_edge_features)
+    in_degree = None
+    if sorted_edges:
+        edge_index, edge_attr, in_degree = sort_edges_by_destination(edge_index, edge_attr, total_nodes)
+    x = torch.randn(total_nodes, NUM_FEATURES)
+    edge_model = EdgeModel(NUM_FEATURES, num_edge_features) if with_edge_model else None
+    node_model = NodeModel(NUM_FEATURES, num_edge_features)
+    layer = EdgeNodeMetaLayer(edge_model=edge_model, node_model=node_model)
+
+    with torch.no_grad():
+        expected_x, expected_edge_attr = concat_meta_layer(edge_model, node_model, x, edge_index, edge_attr)
+        out_x, out_edge_attr, _ = layer(x, edge_index, edge_attr, in_degree=in_degree)
+
+    assert torch.allclose(out_x, expected_x, atol=1e-5)
+    assert torch.allclose(out_edge_attr, expected_edge_attr, atol=1e-5)
+
+
+def test_meta_layer_gradients_same_as_concatenation():
+    torch.manual_seed(1)
+    total_nodes = NUM_GRAPHS * NUM_NODES
+    edge_index, edge_attr = random_batch(True, 1)
+    edge_index, edge_attr, in_degree = sort_edges_by_destination(edge_index, edge_attr, total_nodes)
+    layer = EdgeNodeMetaLayer(edge_model=EdgeModel(NUM_FEATURES, 1), node_model=NodeModel(NUM_FEATURES, 1))
+    x = torch.randn(total_nodes, NUM_FEATURES)
+
+    gradients = []
+    for run in [lambda: layer(x, edge_index, edge_attr, in_degree=in_degree)[0],
+                lambda: concat_meta_layer(layer.edge_model, layer.node_model, x, edge_index, edge_attr)[0]]:
+        layer.zero_grad()
+        run().pow(2).sum().backward()
+        gradients.append([parameter.grad.clone() for parameter in layer.parameters()])
+
+    for gradient, expected in zip(*gradients):
+        assert torch.allclose(gradient, expected, atol=1e-4)
+
+
+class FakeAE(nn.Module):
+    """
+    Same interface as encoders.AE, without its dependencies.
+    """
+
+    def __init__(self, time_length: int):
+        super(FakeAE, self).__init__()
+        self.EMBED_SIZE = 50
+        self.fc = nn.Linear(time_length, self.EMBED_SIZE)
+
+    def encode(self, x):
+        return self.fc(x)
+
+
+@pytest.mark.parametrize('multimodal_size', [0, 10])
+def test_node_embed_size_with_encoder(multimodal_size):
+    time_length, num_nodes = 30, 6
+    model = SpatioTemporalModel(num_time_length=time_length, dropout_perc=0.1, pooling=PoolingStrategy.MEAN,
+                                channels_conv=8, activation='relu', conv_strategy=ConvStrategy.NONE,
+                                sweep_type=SweepType.META_NODE, multimodal_size=multimodal_size,
+                                encoding_strategy=EncodingStrategy.AE3layers, encoding_model=FakeAE(time_length),
+                                num_nodes=num_nodes)
+    # Without multimodal features, the same size (and state_dict) as checkpoints saved before it included them
+    assert model.NODE_EMBED_SIZE == 50 + multimodal_size
+    assert model.meta_layer.node_model.node_mlp_1[0].in_features == 50 + multimodal_size + 1
+
+    nodes = torch.arange(num_nodes)
+    edge_index = torch.stack([nodes.repeat_interleave(num_nodes), nodes.repeat(num_nodes)])
+    graphs = [Data(x=torch.randn(num_nodes, multimodal_size + time_length), edge_index=edge_index,
+                   edge_attr=torch.rand(edge_index.size(1), 1), y=torch.tensor([1.])) for _ in range(3)]
+    model.eval()
+    with torch.no_grad():
+        out = model(Batch.from_data_list(graphs))
+    assert out.shape == (3, 1)
+
+
+@pytest.mark.parametrize('model_edge_weights', [True, False])
+@pytest.mark.parametrize('dataset_edge_weights', [True, False])
+def test_gcn_norm_only_used_with_same_edge_weights(model_edge_weights, dataset_edge_weights, monkeypatch):
+    torch.manual_seed(1)
+    total_nodes = NUM_GRAPHS * NUM_NODES
+    edge_index, edge_attr = random_batch(True, 1)
+
+    def gcn_conv_norm(edge_index_, num_nodes, edge_weight=None, dtype=None):
+        # GCNConv.norm() of torch_geometric 1.4 for graphs with all self-loops
+        return edge_index_, gcn_normalisation(edge_index_, edge_weight, num_nodes)
+
+    monkeypatch.setattr(GCNConv, 'norm', staticmethod(gcn_conv_norm), raising=False)
+    dataset_weights = edge_attr.view(-1) if dataset_edge_weights else None
+    data = Batch(x=torch.randn(total_nodes, 30), edge_index=edge_index, edge_attr=edge_attr,
+                 gcn_norm=gcn_normalisation(edge_index, dataset_weights, total_nodes),
+                 gcn_norm_weighted=torch.full((NUM_GRAPHS,), dataset_edge_weights, dtype=torch.bool))
+    model = SpatioTemporalModel(num_time_length=30, dropout_perc=0.1, pooling=PoolingStrategy.MEAN, channels_conv=8,
+                                activation='relu', conv_strategy=ConvStrategy.TCN_ENTIRE, sweep_type=SweepType.GCN,
+                                num_nodes=NUM_NODES, edge_weights=model_edge_weights)
+
+    _, gcn_norm = model._SpatioTemporalModel__gcn_inputs(data, total_nodes)
+
+    model_weights = edge_attr.view(-1) if model_edge_weights else None
+    assert torch.allclose(gcn_norm, gcn_normalisation(edge_index, model_weights, total_nodes))
+    assert (gcn_norm is data.gcn_norm) == (model_edge_weights == dataset_edge_weights)
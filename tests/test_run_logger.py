@@ -0,0 +1,55 @@
+import pickle
+
+from profiling import StageProfiler
+from run_logger import BufferedLogger, WandbLogger
+
+
+class RecordingLogger(WandbLogger):
+    def __init__(self):
+        self.calls = []
+
+    def log(self, data, commit=True):
+        self.calls.append(('log', data, commit))
+
+    def summary(self, key, value):
+        self.calls.append(('summary', key, value))
+
+
+def test_buffered_logger_replayed_in_order():
+    logger = BufferedLogger()
+    logger.watch(None)
+    logger.summary('trainable_params', 10)
+    logger.log({'train_loss1': 0.5}, commit=False)
+    logger.log({'val_loss1': 0.7})
+
+    # As sent back from a worker process
+    recording = RecordingLogger()
+    pickle.loads(pickle.dumps(logger)).replay(recording)
+    assert recording.calls == [('summary', 'trainable_params', 10), ('log', {'train_loss1': 0.5}, False),
+                               ('log', {'val_loss1': 0.7}, True)]
+
+
+def test_epoch_summary_sent_to_logger():
+    profiler = StageProfiler(enabled=True)
+    with profiler.stage('forward'):
+        pass
+    recording = RecordingLogger()
+    summary = profiler.epoch_summary(0, logger=recording)
+    assert recording.calls == [('log', {f'time_{name}': value for name, value in summary.items()}, False)]
+    assert profiler.epoch_summary(1, logger=None) == {}
+
+
+def test_merge_peaks_of_other_profilers():
+    profiler = StageProfiler(track_memory=True)
+    profiler.peak_host_mb['forward'] = 100
+    worker_profiler = StageProfiler(track_memory=True)
+    worker_profiler.peak_host_mb.update(forward=80, backward=120)
+    worker_profiler.peak_device_mb['forward'] = 50
+    worker_profiler.checkpointed_modules = ['meta_layer']
+
+    profiler.merge_peaks(worker_profiler.peaks())
+    assert profiler.peak_host_mb == {'forward': 100, 'backward': 120}
+    assert profiler.peak_device_mb == {'forward': 50}
+    assert profiler.checkpointed_modules == ['meta_layer']
+    profiler.close()
+    worker_profiler.close()
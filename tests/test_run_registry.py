@@ -0,0 +1,77 @@
+import os
+
+import torch
+
+from checkpoints import CheckpointStore
+from model import SpatioTemporalModel
+from run_registry import RunRegistry, legacy_checkpoint_config
+from utils import AnalysisType, ConnType, ConvStrategy, DatasetType, Normalisation, PoolingStrategy, SweepType, \
+    create_name_for_model
+
+
+def legacy_model_and_path(legacy_dir: str):
+    model = SpatioTemporalModel(num_time_length=1200, dropout_perc=0.3, pooling=PoolingStrategy.DIFFPOOL,
+                                channels_conv=8, activation='relu', conv_strategy=ConvStrategy.TCN_ENTIRE,
+                                sweep_type=SweepType.META_EDGE_NODE, multimodal_size=10, num_nodes=68,
+                                edge_weights=True)
+    path = create_name_for_model(target_var='gender', model=model, outer_split_num=2, inner_split_num=1,
+                                 n_epochs=150, threshold=20, batch_size=150, num_nodes=68, conn_type=ConnType.FMRI,
+                                 normalisation=Normalisation.SUBJECT, analysis_type=AnalysisType.ST_MULTIMODAL,
+                                 metric_evaluated='loss', dataset_type=DatasetType.UKB, edge_weights=True,
+                                 lr=0.0001, weight_decay=1e-05, prefix_location=legacy_dir + os.sep)
+    return model, path
+
+
+def checkpoint_config(model: SpatioTemporalModel):
+    # As main_loop.create_st_model_checkpoint_config() for this model
+    return {'target_var': 'gender', 'dataset_type': DatasetType.UKB, 'analysis_type': AnalysisType.ST_MULTIMODAL,
+            'outer_split_num': 2, 'inner_split_num': 1, 'metric_evaluated': 'loss', **model.to_config(),
+            'lr': 0.0001, 'weight_decay': 1e-05, 'n_epochs': 150, 'threshold': 20,
+            'normalisation': Normalisation.SUBJECT, 'batch_size': 150, 'num_nodes': 68, 'conn_type': ConnType.FMRI}
+
+
+def test_legacy_checkpoint_config(tmp_path):
+    model, path = legacy_model_and_path(str(tmp_path))
+    expected = checkpoint_config(model)
+    assert CheckpointStore.normalise(legacy_checkpoint_config(path)) == CheckpointStore.normalise(expected)
+    assert legacy_checkpoint_config(str(tmp_path / 'something_else.pth')) is None
+
+
+def test_lookups_do_not_move_checkpoints(tmp_path):
+    model, legacy_path = legacy_model_and_path(str(tmp_path))
+    torch.save({'weights': torch.ones(3)}, legacy_path)
+    store = CheckpointStore(str(tmp_path / 'checkpoints'))
+    assert store.existing_path(checkpoint_config(model)) is None
+    assert store.find() == []
+    assert os.path.exists(legacy_path)
+
+
+def test_migrate_unregistered_legacy_checkpoints(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    os.makedirs('logs')
+    model, legacy_path = legacy_model_and_path('logs')
+    torch.save({'weights': torch.ones(3)}, legacy_path)
+    torch.save({}, os.path.join('logs', 'not_a_model.pth'))
+
+    migrated = RunRegistry('logs/run_registry.db').migrate_checkpoints('logs')
+
+    new_path = CheckpointStore().existing_path(checkpoint_config(model))
+    assert migrated == [new_path]
+    assert not os.path.exists(legacy_path)
+    assert torch.equal(torch.load(new_path)['weights'], torch.ones(3))
+    # Files with other names are left where they are
+    assert os.path.exists(os.path.join('logs', 'not_a_model.pth'))
+
+
+def test_migrate_store_checkpoints_without_analysis_type(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    model, _ = legacy_model_and_path('logs')
+    config = checkpoint_config(model)
+    store = CheckpointStore()
+    old_config = {name: value for name, value in config.items() if name != 'analysis_type'}
+    torch.save({'weights': torch.ones(3)}, store.path(old_config))
+
+    migrated = RunRegistry('logs/run_registry.db').migrate_checkpoints('logs')
+
+    assert migrated == [store.existing_path(config)]
+    assert store.existing_path(old_config) is None
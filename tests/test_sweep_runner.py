@@ -0,0 +1,53 @@
+import os
+import socket
+import subprocess
+import sys
+import time
+
+from sweep_runner import JobQueue
+
+
+def dead_worker_name() -> str:
+    process = subprocess.Popen([sys.executable, '-c', 'pass'])
+    process.wait()
+    return f'{socket.gethostname()}:{process.pid}'
+
+
+def test_claim_gives_each_job_once(tmp_path):
+    job_queue = JobQueue(str(tmp_path / 'sweeps.db'))
+    job_queue.enqueue('sweep', [{'a': 1}, {'a': 2}])
+    worker_name = f'{socket.gethostname()}:{os.getpid()}'
+
+    first, second = job_queue.claim(worker_name), job_queue.claim(worker_name)
+    assert [first[2], second[2]] == [{'a': 1}, {'a': 2}]
+    assert job_queue.claim(worker_name) is None
+
+
+def test_jobs_of_dead_workers_are_requeued(tmp_path):
+    job_queue = JobQueue(str(tmp_path / 'sweeps.db'))
+    job_queue.enqueue('sweep', [{'a': 1}])
+    job_id, _, _ = job_queue.claim(dead_worker_name())
+
+    claimed = job_queue.claim(f'{socket.gethostname()}:{os.getpid()}')
+    assert claimed is not None and claimed[0] == job_id
+
+
+def test_jobs_with_stale_heartbeat_are_requeued(tmp_path):
+    db_path = str(tmp_path / 'sweeps.db')
+    JobQueue(db_path).enqueue('sweep', [{'a': 1}])
+    # Processes of other hosts cannot be checked, only their heartbeat
+    job_id, _, _ = JobQueue(db_path).claim('other-host:1')
+    assert JobQueue(db_path).claim('other-host:2') is None
+
+    claimed = JobQueue(db_path, stale_after=0).claim('other-host:2')
+    assert claimed is not None and claimed[0] == job_id
+
+
+def test_keep_alive_updates_heartbeat(tmp_path):
+    job_queue = JobQueue(str(tmp_path / 'sweeps.db'), stale_after=0.5)
+    job_queue.enqueue('sweep', [{'a': 1}])
+    job_id, _, _ = job_queue.claim('other-host:1')
+
+    with job_queue.keep_alive(job_id, 'other-host:1', interval=0.05):
+        time.sleep(0.7)
+        assert job_queue.claim('other-host:2') is None
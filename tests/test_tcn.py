@@ -0,0 +1,103 @@
+import pytest
+import torch
+import torch.nn as nn
+from torch.nn import BatchNorm1d
+
+from tcn import Chomp1d, StridedTemporalBlock, TemporalConvNet
+
+
+class PreviousStridedTemporalBlock(nn.Module):
+    """
+    StridedTemporalBlock before CausalConv1d: Conv1d padded on both sides and Chomp1d, and the 1x1 downsample
+    convolution before the average pooling of the residual path.
+    """
+
+    def __init__(self, n_inputs, n_hidden, n_outputs, kernel_size, stride, dilation, padding, final_output,
+                 dropout=0.2):
+        super(PreviousStridedTemporalBlock, self).__init__()
+        self.stride = stride
+        self.conv1 = nn.Conv1d(n_inputs, n_hidden, kernel_size, stride=stride, padding=padding, dilation=dilation)
+        self.batch1 = BatchNorm1d(n_hidden)
+        self.chomp1 = Chomp1d(int(padding / stride))
+        self.relu1 = nn.ReLU()
+        self.dropout1 = nn.Dropout(dropout)
+
+        self.conv2 = nn.Conv1d(n_hidden, n_outputs, kernel_size, stride=stride, padding=padding, dilation=dilation)
+        self.batch2 = BatchNorm1d(n_outputs)
+        self.chomp2 = Chomp1d(int(padding / stride))
+        self.relu2 = nn.ReLU()
+        self.dropout2 = nn.Dropout(dropout)
+
+        self.net = nn.Sequential(self.conv1, self.chomp1, self.relu1, self.batch1, self.dropout1,
+                                 self.conv2, self.chomp2, self.relu2, self.batch2, self.dropout2)
+        self.downsample = nn.Conv1d(n_inputs, n_outputs, 1) if n_inputs != n_outputs else None
+        self.residual_downsample = nn.AdaptiveAvgPool1d(final_output)
+        self.relu = nn.ReLU()
+
+    def forward(self, x):
+        out = self.net(x)
+        res = x if self.downsample is None else self.downsample(x)
+        if self.stride > 1:
+            res = self.residual_downsample(res)
+        return self.relu(out + res)
+
+
+def block_pair(num_inputs, hidden_channels, out_channels, stride, dilation, length, kernel_size=7):
+    """
+    Previous and current block with the same weights, the previous one loaded from the state_dict of the current one.
+    """
+    padding = (kernel_size - 1) * dilation
+    final_output = -(-length // (stride * 2))
+    kwargs = dict(kernel_size=kernel_size, stride=stride, dilation=dilation, padding=padding,
+                  final_output=final_output, dropout=0)
+    block = StridedTemporalBlock(num_inputs, hidden_channels, out_channels, **kwargs)
+    # The bias of the 1x1 convolution is zero by default, which would hide its order with the pooling
+    if block.downsample is not None:
+        block.downsample.bias.data.normal_()
+    previous_block = PreviousStridedTemporalBlock(num_inputs, hidden_channels, out_channels, **kwargs)
+    # Strict, so it also fails if the state_dict keys changed
+    previous_block.load_state_dict(block.state_dict())
+    return previous_block, block
+
+
+@pytest.mark.parametrize('stride', [1, 2])
+@pytest.mark.parametrize('dilation', [1, 4])
+@pytest.mark.parametrize('length', [490, 1200, 100, 31])
+@pytest.mark.parametrize('channels', [(1, 8, 16), (16, 32, 16)])
+def test_strided_temporal_block_same_as_previous(stride, dilation, length, channels):
+    torch.manual_seed(1)
+    previous_block, block = block_pair(*channels, stride=stride, dilation=dilation, length=length)
+    x = torch.randn(4, channels[0], length)
+
+    # Training mode (batch statistics) and evaluation mode (running statistics)
+    for training in [True, False]:
+        previous_block.train(training)
+        block.train(training)
+        with torch.no_grad():
+            previous_out, out = previous_block(x), block(x)
+        assert previous_out.shape == out.shape
+        assert torch.allclose(previous_out, out, atol=1e-5)
+
+
+def test_strided_temporal_block_gradients_same_as_previous():
+    torch.manual_seed(1)
+    previous_block, block = block_pair(1, 8, 16, stride=2, dilation=1, length=490)
+    x = torch.randn(4, 1, 490)
+
+    gradients = []
+    for module in [previous_block, block]:
+        module(x).pow(2).sum().backward()
+        gradients.append({name: parameter.grad for name, parameter in module.named_parameters()})
+    for name, gradient in gradients[1].items():
+        # Relative to the largest gradient, as the bias before BatchNorm1d only gets rounding errors
+        atol = 1e-5 * max(1., gradient.abs().max().item())
+        assert torch.allclose(gradients[0][name], gradient, rtol=1e-4, atol=atol), name
+
+
+def test_temporal_conv_net_output_length():
+    # As in SpatioTemporalModel, with the lengths of HCP and UKB
+    for length in [1200, 490]:
+        net = TemporalConvNet(1, [8, 16, 32, 64], stride=2, num_time_length=length, kernel_size=7).eval()
+        with torch.no_grad():
+            out = net(torch.randn(3, 1, length))
+        assert out.shape == (3, 64, -(-length // 16))
@@ -0,0 +1,97 @@
+import json
+import socket
+import subprocess
+import sys
+
+import pytest
+
+from utils import DeviceLeaseManager
+
+
+@pytest.fixture
+def lease_file(tmp_path):
+    return str(tmp_path / 'leases.json')
+
+
+def dead_owner() -> str:
+    """
+    Owner ("hostname:pid") of a process of this host which has already finished.
+    """
+    process = subprocess.Popen([sys.executable, '-c', 'pass'])
+    process.wait()
+    return f'{socket.gethostname()}:{process.pid}'
+
+
+def read_leases(lease_file: str):
+    with open(lease_file) as fd:
+        return json.load(fd)
+
+
+def test_from_spec(lease_file):
+    manager = DeviceLeaseManager.from_spec('cuda:0=2,cuda:1=1,cpu=*,fake:0', lease_file=lease_file)
+    assert manager.capacities == {'cuda:0': 2, 'cuda:1': 1, 'cpu': None, 'fake:0': 1}
+    assert manager.default_prefixes() == ['cuda']
+
+
+def test_capacity_limits(lease_file):
+    manager = DeviceLeaseManager.from_spec('cuda:0=2,cuda:1=1', lease_file=lease_file)
+    # The device with more free slots first
+    assert [manager.try_acquire() for _ in range(4)] == ['cuda:0', 'cuda:0', 'cuda:1', None]
+    assert {device: len(owners) for device, owners in read_leases(lease_file).items()} == {'cuda:0': 2, 'cuda:1': 1}
+
+    manager.release('cuda:0')
+    assert manager.try_acquire() == 'cuda:0'
+    assert manager.try_acquire() is None
+    # Other prefixes are only used when given
+    assert manager.try_acquire(['cpu']) is None
+
+
+def test_leases_shared_between_managers(lease_file):
+    first = DeviceLeaseManager.from_spec('cuda:0=1', lease_file=lease_file)
+    second = DeviceLeaseManager.from_spec('cuda:0=1', lease_file=lease_file)
+    second.owner = f'{socket.gethostname()}:1'
+    assert first.try_acquire() == 'cuda:0'
+    assert second.try_acquire() is None
+    # Releasing a device leased by another owner does nothing
+    second.release('cuda:0')
+    assert second.try_acquire() is None
+
+
+def test_unbounded_slots(lease_file):
+    manager = DeviceLeaseManager.from_spec('cpu=*', lease_file=lease_file)
+    assert all(manager.try_acquire(['cpu']) == 'cpu' for _ in range(10))
+
+
+def test_stale_lease_reclaimed(lease_file):
+    with open(lease_file, 'w') as fd:
+        json.dump({'cuda:0': [dead_owner(), dead_owner()], 'cuda:1': [dead_owner()]}, fd)
+    manager = DeviceLeaseManager.from_spec('cuda:0=2,cuda:1=1', lease_file=lease_file)
+
+    assert sorted(manager.try_acquire() for _ in range(3)) == ['cuda:0', 'cuda:0', 'cuda:1']
+    assert read_leases(lease_file) == {'cuda:0': [manager.owner] * 2, 'cuda:1': [manager.owner]}
+
+
+def test_leases_of_other_hosts_kept(lease_file):
+    with open(lease_file, 'w') as fd:
+        json.dump({'cuda:0': ['another-host:1']}, fd)
+    manager = DeviceLeaseManager.from_spec('cuda:0=1', lease_file=lease_file)
+    assert manager.try_acquire() is None
+
+
+def test_lease_released_on_exception(lease_file):
+    manager = DeviceLeaseManager.from_spec('cuda:0=2,cuda:1=1', lease_file=lease_file)
+    with pytest.raises(RuntimeError):
+        with manager.lease() as device:
+            assert device == 'cuda:0'
+            assert read_leases(lease_file)['cuda:0'] == [manager.owner]
+            raise RuntimeError('run failed')
+    assert read_leases(lease_file) == {'cuda:0': []}
+
+
+def test_lease_file_from_environment(tmp_path, monkeypatch):
+    lease_file = str(tmp_path / 'logs' / 'leases.json')
+    monkeypatch.setenv('ST_LEASE_FILE', lease_file)
+    manager = DeviceLeaseManager.from_spec('cpu=1')
+    assert manager.lease_file == lease_file
+    assert manager.try_acquire(['cpu']) == 'cpu'
+    assert read_leases(lease_file) == {'cpu': [manager.owner]}
@@ -0,0 +1,46 @@
+import torch
+
+from utils_graphs import sort_edges_by_destination
+
+
+def random_graph(num_nodes: int):
+    mask = torch.rand(num_nodes, num_nodes) < 0.4
+    mask[torch.arange(num_nodes), torch.arange(num_nodes)] = True
+    row, col = mask.nonzero().t()
+    return torch.stack([row, col]), torch.rand(row.size(0), 1)
+
+
+def test_sort_edges_by_destination():
+    torch.manual_seed(0)
+    edge_index, edge_attr = random_graph(10)
+    sorted_edge_index, sorted_edge_attr, in_degree = sort_edges_by_destination(edge_index, edge_attr, 10)
+
+    col = sorted_edge_index[1]
+    assert bool((col[1:] >= col[:-1]).all())
+    assert torch.equal(in_degree, torch.bincount(edge_index[1], minlength=10))
+    # Same edges, with the same attributes
+    original = {tuple(edge): attr for edge, attr in zip(edge_index.t().tolist(), edge_attr.view(-1).tolist())}
+    assert original == {tuple(edge): attr for edge, attr in zip(sorted_edge_index.t().tolist(),
+                                                                sorted_edge_attr.view(-1).tolist())}
+
+
+def test_sort_edges_of_collated_graphs_keeps_them_in_place():
+    # As done in BrainDataset.sort_edges() for all the graphs of a dataset at once
+    torch.manual_seed(0)
+    graphs = [random_graph(num_nodes) for num_nodes in [6, 9, 4]]
+    node_slices = torch.tensor([0, 6, 15, 19])
+    edge_slices = torch.tensor([0] + [edge_index.size(1) for edge_index, _ in graphs]).cumsum(0)
+    edge_index = torch.cat([edge_index for edge_index, _ in graphs], dim=1)
+    edge_attr = torch.cat([edge_attr for _, edge_attr in graphs], dim=0)
+    node_offsets = node_slices[:-1].repeat_interleave(edge_slices[1:] - edge_slices[:-1])
+
+    sorted_edge_index, sorted_edge_attr, in_degree = sort_edges_by_destination(edge_index + node_offsets, edge_attr,
+                                                                               int(node_slices[-1]))
+    sorted_edge_index = sorted_edge_index - node_offsets
+    for graph_num, (graph_edge_index, graph_edge_attr) in enumerate(graphs):
+        num_nodes = int(node_slices[graph_num + 1] - node_slices[graph_num])
+        expected = sort_edges_by_destination(graph_edge_index, graph_edge_attr, num_nodes)
+        edges = slice(edge_slices[graph_num], edge_slices[graph_num + 1])
+        assert torch.equal(sorted_edge_index[:, edges], expected[0])
+        assert torch.equal(sorted_edge_attr[edges], expected[1])
+        assert torch.equal(in_degree[node_slices[graph_num]:node_slices[graph_num + 1]], expected[2])
@@ -1,7 +1,12 @@
+import json
+import os
 import random
+import socket
+import time
 from collections import Counter, defaultdict
+from contextlib import contextmanager
 from enum import Enum, unique
-from typing import NoReturn, Dict, Any
+from typing import Dict, Any, List, Optional
 
 import fcntl
 import numpy as np
@@ -79,50 +84,162 @@ class EncodingStrategy(str, Enum):
     STATS = 'stats'
 
 
-def get_freer_gpu() -> int:
+# Shared by the runs from any working directory, unless the ST_LEASE_FILE environment variable has another path
+LEASE_FILE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'logs', 'device_leases.json')
+
+
+def process_is_alive(owner: str) -> bool:
     """
-    Considers that there is only GPU 0 and 1.
-    :return:
+    Whether the process of owner ("hostname:pid") is still running. Processes of other hosts cannot be checked, so they
+    are considered alive.
+    """
+    hostname, _, pid = owner.rpartition(':')
+    if hostname != socket.gethostname():
+        return True
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class DeviceLeaseManager:
     """
-    # This option is not preventing when GPUs not being used yet
-    # os.system('nvidia-smi -q -d Memory |grep -A4 GPU|grep Free >tmp_gpu')
-    # memory_available = [int(x.split()[2]) for x in open('tmp_gpu', 'r').readlines()]
-    # return np.argmax(memory_available)
-    print('Getting free GPU info...')
-    gpu_to_use: int = 0
-    with open('tmp_gpu.txt', 'r+') as fd:
-        fcntl.flock(fd, fcntl.LOCK_EX)
-        # Someone is using GPU 0 already
-        info_file = fd.read()
-        if info_file == 'server':
-            print('Server usage, just give 0')
-        elif info_file == '0':
-            print('GPU 0 already in use')
-            gpu_to_use = 1
-        else:
-            print('Reserving GPU 0')
-            # Inform gpu 0 is now reserved
-            fd.seek(0)
-            fd.write('0')
-            fd.truncate()
-        fcntl.flock(fd, fcntl.LOCK_UN)
-
-    return gpu_to_use
-
-
-def free_gpu_info() -> NoReturn:
-    print('Freeing GPU 0!')
-    with open('tmp_gpu.txt', 'r+') as fd:
-        fcntl.flock(fd, fcntl.LOCK_EX)
-        info_file = fd.read()
-        if info_file == 'server':
-            print('Server usage, no need to free GPU')
-        else:
-            fd.seek(0)
-            fd.write('')
-            fd.truncate()
-
-        fcntl.flock(fd, fcntl.LOCK_UN)
+    Leases of devices between the runs in a machine, each device with a number of slots (i.e. runs at the same time),
+    or None for unbounded slots.
+
+    Leases are kept in a JSON file locked with fcntl, as {device: ["hostname:pid", ...]}. A lease whose process is no
+    longer alive in this host is considered stale and is taken back, so a run that crashed (or was killed) before
+    releasing its device does not keep it busy. Device names are not checked, so fake ones (e.g. 'fake:0') can be used
+    in machines without GPUs.
+    """
+
+    def __init__(self, capacities: Dict[str, Optional[int]], lease_file: Optional[str] = None):
+        """
+        :param lease_file: ST_LEASE_FILE environment variable or LEASE_FILE_PATH by default
+        """
+        self.capacities: Dict[str, Optional[int]] = capacities
+        if lease_file is None:
+            lease_file = os.environ.get('ST_LEASE_FILE', LEASE_FILE_PATH)
+        self.lease_file: str = lease_file
+        self.owner: str = f'{socket.gethostname()}:{os.getpid()}'
+
+    @classmethod
+    def from_spec(cls, spec: str, lease_file: Optional[str] = None) -> 'DeviceLeaseManager':
+        """
+        :param spec: e.g. 'cuda:0=2,cuda:1=1,cpu=*' (devices without '=' get one slot, '*' is unbounded)
+        """
+        capacities = {}
+        for device_spec in spec.split(','):
+            device, _, slots = device_spec.strip().partition('=')
+            if slots == '*':
+                capacities[device] = None
+            else:
+                capacities[device] = int(slots) if slots else 1
+        return cls(capacities, lease_file)
+
+    @classmethod
+    def from_available_devices(cls, slots_per_gpu: int = 1, cpu_slots: Optional[int] = None,
+                               lease_file: Optional[str] = None) -> 'DeviceLeaseManager':
+        """
+        All visible GPUs and the CPU, unless the ST_DEVICES environment variable has a spec as in from_spec().
+
+        :param cpu_slots: None for unbounded, can also be set with the ST_CPU_SLOTS environment variable
+        """
+        if os.environ.get('ST_DEVICES'):
+            return cls.from_spec(os.environ['ST_DEVICES'], lease_file)
+        if cpu_slots is None and os.environ.get('ST_CPU_SLOTS'):
+            cpu_slots = int(os.environ['ST_CPU_SLOTS'])
+        capacities = {f'cuda:{gpu_num}': slots_per_gpu for gpu_num in range(torch.cuda.device_count())}
+        capacities['cpu'] = cpu_slots
+        return cls(capacities, lease_file)
+
+    def __update_leases(self, update_fn):
+        """
+        Calls update_fn(leases) with the file locked, and saves the leases it leaves.
+        """
+        os.makedirs(os.path.dirname(os.path.abspath(self.lease_file)), exist_ok=True)
+        with open(self.lease_file, 'a+') as fd:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                fd.seek(0)
+                content = fd.read()
+                leases: Dict[str, List[str]] = json.loads(content) if content.strip() else {}
+                for device, owners in leases.items():
+                    stale_owners = [owner for owner in owners if not process_is_alive(owner)]
+                    if stale_owners:
+                        print(f'Recovering stale lease(s) of {device} from', stale_owners)
+                    leases[device] = [owner for owner in owners if owner not in stale_owners]
+                result = update_fn(leases)
+                fd.seek(0)
+                fd.truncate()
+                fd.write(json.dumps(leases))
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+        return result
+
+    def default_prefixes(self) -> List[str]:
+        """
+        GPUs if there is any, otherwise the CPU: a run waits for a GPU instead of falling back to the CPU when they
+        are all busy.
+        """
+        if any(device.startswith('cuda') for device in self.capacities.keys()):
+            return ['cuda']
+        return ['cpu']
+
+    def try_acquire(self, prefixes: List[str] = None) -> Optional[str]:
+        """
+        Leases the device with more free slots, among the ones starting with the first prefix in prefixes with any
+        free slot.
+
+        :param prefixes: default_prefixes() by default
+        :return: None if there is no free slot
+        """
+        if prefixes is None:
+            prefixes = self.default_prefixes()
+
+        def acquire(leases: Dict[str, List[str]]) -> Optional[str]:
+            for prefix in prefixes:
+                free_slots = {device: float('inf') if capacity is None else capacity - len(leases.get(device, []))
+                              for device, capacity in self.capacities.items() if device.startswith(prefix)}
+                free_slots = {device: slots for device, slots in free_slots.items() if slots > 0}
+                if free_slots:
+                    device = max(free_slots.keys(), key=lambda d: free_slots[d])
+                    leases.setdefault(device, []).append(self.owner)
+                    return device
+            return None
+
+        return self.__update_leases(acquire)
+
+    def acquire(self, prefixes: List[str] = None, poll_interval: float = 10) -> str:
+        """
+        Same as try_acquire(), but waits until there is a free slot.
+        """
+        device = self.try_acquire(prefixes)
+        if device is None:
+            print('Waiting for a free device...')
+        while device is None:
+            time.sleep(poll_interval)
+            device = self.try_acquire(prefixes)
+        print('Leased device', device)
+        return device
+
+    def release(self, device: str):
+        def release(leases: Dict[str, List[str]]):
+            if self.owner in leases.get(device, []):
+                leases[device].remove(self.owner)
+
+        self.__update_leases(release)
+
+    @contextmanager
+    def lease(self, prefixes: List[str] = None, poll_interval: float = 10):
+        device = self.acquire(prefixes, poll_interval)
+        try:
+            yield device
+        finally:
+            self.release(device)
 
 
 def merge_y_and_others(ys, indices):
@@ -0,0 +1,93 @@
+import os
+import pickle
+from typing import Any, List
+
+import torch
+import torch.distributed as dist
+import torch.nn as nn
+
+
+def init_distributed() -> bool:
+    """
+    Starts the gloo process group when launched with several processes (e.g. torchrun, which sets WORLD_SIZE, RANK,
+    MASTER_ADDR and MASTER_PORT), otherwise does nothing.
+    """
+    if int(os.environ.get('WORLD_SIZE', 1)) > 1 and not dist.is_initialized():
+        dist.init_process_group(backend='gloo')
+    return is_distributed()
+
+
+def is_distributed() -> bool:
+    return dist.is_available() and dist.is_initialized() and dist.get_world_size() > 1
+
+
+def get_rank() -> int:
+    return dist.get_rank() if is_distributed() else 0
+
+
+def get_world_size() -> int:
+    return dist.get_world_size() if is_distributed() else 1
+
+
+def is_main_process() -> bool:
+    return get_rank() == 0
+
+
+def _object_to_tensor(obj: Any) -> torch.Tensor:
+    return torch.ByteTensor(torch.ByteStorage.from_buffer(pickle.dumps(obj)))
+
+
+def _tensor_to_object(tensor: torch.Tensor, size: int) -> Any:
+    return pickle.loads(bytes(tensor[:size].tolist()))
+
+
+def broadcast_object(obj: Any = None) -> Any:
+    """
+    Returns obj as given in the main process.
+
+    Pickled into a tensor, as dist.broadcast_object_list() is not available in torch < 1.8.
+    """
+    if not is_distributed():
+        return obj
+    tensor = _object_to_tensor(obj) if is_main_process() else None
+    size = torch.tensor([tensor.numel() if tensor is not None else 0], dtype=torch.long)
+    dist.broadcast(size, src=0)
+    if tensor is None:
+        tensor = torch.empty(size.item(), dtype=torch.uint8)
+    dist.broadcast(tensor, src=0)
+    return _tensor_to_object(tensor, size.item())
+
+
+def all_gather_object(obj: Any) -> List[Any]:
+    """
+    obj of each process, in order of rank.
+
+    Pickled into tensors padded to the same size, as dist.all_gather_object() is not available in torch < 1.8.
+    """
+    if not is_distributed():
+        return [obj]
+    tensor = _object_to_tensor(obj)
+    sizes = [torch.zeros(1, dtype=torch.long) for _ in range(get_world_size())]
+    dist.all_gather(sizes, torch.tensor([tensor.numel()], dtype=torch.long))
+    max_size = max(size.item() for size in sizes)
+    padded = torch.zeros(max_size, dtype=torch.uint8)
+    padded[:tensor.numel()] = tensor
+    gathered = [torch.empty(max_size, dtype=torch.uint8) for _ in sizes]
+    dist.all_gather(gathered, padded)
+    return [_tensor_to_object(tensor, size.item()) for tensor, size in zip(gathered, sizes)]
+
+
+def shard_dataset(dataset):
+    """
+    Part of the dataset for this process, without repeating elements (unlike DistributedSampler), for evaluation.
+    """
+    return dataset[torch.arange(get_rank(), len(dataset), get_world_size())]
+
+
+def sync_buffers(model: nn.Module):
+    """
+    BatchNorm running statistics are only updated with the part of the batch of each process, so the ones of the
+    main process are used everywhere (as DistributedDataParallel does at the start of each forward).
+    """
+    for buffer in model.buffers():
+        dist.broadcast(buffer, src=0)
@@ -0,0 +1,40 @@
+"""
+Preprocessing of the edges of brain graphs, done once per dataset (see BrainDataset in datasets.py) so models do not
+repeat it in every forward pass.
+"""
+import torch
+
+
+def sort_edges_by_destination(edge_index: torch.Tensor, edge_attr: torch.Tensor, num_nodes: int):
+    """
+    Edges sorted by destination node (and then by source), so the messages to each node are contiguous and can be
+    aggregated with segment reductions (see model.destination_rowptr()). Batching keeps them sorted, as the nodes of
+    each graph are shifted after the ones of the previous graphs.
+
+    :return: sorted edge_index and edge_attr, and the number of edges arriving at each node
+    """
+    order = torch.argsort(edge_index[1] * num_nodes + edge_index[0])
+    edge_index = edge_index[:, order]
+    if edge_attr is not None:
+        edge_attr = edge_attr[order]
+    return edge_index, edge_attr, torch.bincount(edge_index[1], minlength=num_nodes)
+
+
+def gcn_normalisation(edge_index: torch.Tensor, edge_weight: torch.Tensor, num_nodes: int):
+    """
+    Symmetric normalisation of the edge weights done by GCNConv (D^-1/2 A D^-1/2), for graphs which already have all
+    self-loops, as the thresholded ones. The normalisation of each graph only depends on its own nodes, so it can be
+    calculated for many graphs at once with their nodes numbered consecutively.
+
+    :param edge_weight: [E], or None for weights of 1
+    :return: normalised weight of each edge ([E]), or None if some node has no self-loop (as GCNConv would add it)
+    """
+    row, col = edge_index
+    if torch.unique(row[row == col]).numel() != num_nodes:
+        return None
+    if edge_weight is None:
+        edge_weight = torch.ones(row.size(0))
+    deg = torch.zeros(num_nodes, dtype=edge_weight.dtype).index_add_(0, row, edge_weight)
+    deg_inv_sqrt = deg.pow(-0.5)
+    deg_inv_sqrt[deg_inv_sqrt == float('inf')] = 0
+    return deg_inv_sqrt[row] * edge_weight * deg_inv_sqrt[col]